@@ -5,11 +5,13 @@ from .models import User
 from .schemas import RegisterSchema, LoginSchema, UserSchema, TokenSchema, MessageSchema
 from .jwt_utils import generate_access_token, generate_refresh_token, decode_token
 from .auth import JWTAuth
+from ethnosdemo.ratelimit import rate_limit
 
 router = Router()
 
 
 @router.post("/register", response={201: TokenSchema, 400: MessageSchema})
+@rate_limit('register')
 def register(request, payload: RegisterSchema):
     """Register a new user and return JWT tokens"""
 
@@ -40,6 +42,7 @@ def register(request, payload: RegisterSchema):
 
 
 @router.post("/login", response={200: TokenSchema, 401: MessageSchema})
+@rate_limit('login')
 def login(request, payload: LoginSchema):
     """Login user and return JWT tokens"""
 
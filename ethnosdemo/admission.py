@@ -0,0 +1,223 @@
+"""
+Admission control for API requests.
+
+Each API request is put in a priority class by its route
+(``ADMISSION_ROUTES``, first match wins; unmatched API routes are
+``default``). A class admits at most ``concurrency`` requests of a process at
+a time, and the process at most ``ADMISSION_MAX_ACTIVE`` in all. So CPU-heavy
+routes (password hashing, QR images, statistics) cannot take every worker
+thread away from cheap ones like ``/api/wallet/wallet``.
+
+A request that cannot start at once waits in its class's queue, FIFO. When a
+slot frees up, the waiting classes get it in priority order (0 first). A
+request finding its queue full (``queue``), or still waiting after
+``timeout`` seconds, is shed: it gets a 503 with ``Retry-After`` straight
+away instead of adding to the latency of everything else.
+
+``POST /api/batch`` is not admitted itself. Each of its sub-requests is
+admitted in its own class as it runs (see ethnosdemo/batch.py), so a batch
+cannot run heavy calls past their class's limits.
+
+Limits and counters are per process. ``GET /api/admission`` (staff only)
+reports each class's active and queued requests and its admitted, shed and
+timed-out totals since the process started.
+"""
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from ninja import Router
+from ninja.errors import HttpError
+
+from accounts.auth import JWTAuth
+
+router = Router()
+
+DEFAULT_CLASS = 'default'
+UNLIMITED = None
+SHED_DETAIL = 'Server busy, retry later'
+
+
+@dataclass(eq=False)
+class AdmissionClass:
+    name: str
+    priority: int
+    concurrency: int
+    queue: int
+    timeout: float
+    retry_after: int
+    active: int = 0
+    waiters: deque = field(default_factory=deque)
+    admitted: int = 0
+    shed: int = 0
+    timed_out: int = 0
+    max_queued: int = 0
+
+    def stats(self):
+        return {
+            'priority': self.priority, 'concurrency': self.concurrency, 'queue_size': self.queue,
+            'active': self.active, 'queued': len(self.waiters), 'max_queued': self.max_queued,
+            'admitted': self.admitted, 'shed': self.shed, 'timed_out': self.timed_out,
+        }
+
+
+class AdmissionController:
+    """Per-process concurrency slots handed out by priority class"""
+
+    def __init__(self, classes, max_active):
+        self.classes = {
+            name: AdmissionClass(
+                name=name, priority=config['priority'], concurrency=config['concurrency'],
+                queue=config['queue'], timeout=config['timeout'], retry_after=config.get('retry_after', 1),
+            )
+            for name, config in classes.items()
+        }
+        self.max_active = max_active
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def _has_slot(self, admission_class):
+        return admission_class.active < admission_class.concurrency and self.active < self.max_active
+
+    def _may_start(self, admission_class):
+        if not self._has_slot(admission_class):
+            return False
+        # A higher-priority class waiting for a slot it could use goes first
+        return not any(
+            other.waiters and other.priority < admission_class.priority and self._has_slot(other)
+            for other in self.classes.values()
+        )
+
+    def _admit(self, admission_class):
+        admission_class.active += 1
+        admission_class.admitted += 1
+        self.active += 1
+
+    def acquire(self, admission_class):
+        """Take a slot in the class, waiting in its queue; returns False if the request is shed"""
+        with self._condition:
+            if not admission_class.waiters and self._may_start(admission_class):
+                self._admit(admission_class)
+                return True
+            if len(admission_class.waiters) >= admission_class.queue:
+                admission_class.shed += 1
+                return False
+
+            ticket = object()
+            admission_class.waiters.append(ticket)
+            admission_class.max_queued = max(admission_class.max_queued, len(admission_class.waiters))
+            deadline = time.monotonic() + admission_class.timeout
+            while admission_class.waiters[0] is not ticket or not self._may_start(admission_class):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    admission_class.waiters.remove(ticket)
+                    admission_class.shed += 1
+                    admission_class.timed_out += 1
+                    # The request behind this one may now be first in line
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+            admission_class.waiters.popleft()
+            self._admit(admission_class)
+            # Another slot may be free for the next in line
+            self._condition.notify_all()
+            return True
+
+    def release(self, admission_class):
+        with self._condition:
+            admission_class.active -= 1
+            self.active -= 1
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'active': self.active, 'max_active': self.max_active,
+                'classes': {name: admission_class.stats() for name, admission_class in self.classes.items()},
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def controller():
+    """The process's admission controller, built from settings on first use"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(settings.ADMISSION_CLASSES, settings.ADMISSION_MAX_ACTIVE)
+        return _controller
+
+
+def _compile_routes(routes):
+    return [(method.upper(), re.compile(pattern), name) for method, pattern, name in routes]
+
+
+def classify(request, routes=None):
+    """The request's admission class, or None for requests that are not limited"""
+    if not settings.ADMISSION_CONTROL or not request.path.startswith('/api/'):
+        return UNLIMITED
+    for method, pattern, name in routes or _compile_routes(settings.ADMISSION_ROUTES):
+        if method in ('*', request.method) and pattern.match(request.path):
+            return UNLIMITED if name is None else controller().classes[name]
+    return controller().classes[DEFAULT_CLASS]
+
+
+class AdmissionControlMiddleware:
+    """Admit API requests by priority class and shed them with a 503 when their class is saturated"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.routes = _compile_routes(settings.ADMISSION_ROUTES)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def classify(self, request):
+        return classify(request, self.routes)
+
+    def _shed(self, admission_class):
+        response = JsonResponse({'detail': SHED_DETAIL}, status=503)
+        response['Retry-After'] = str(admission_class.retry_after)
+        return response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        admission_class = self.classify(request)
+        if admission_class is UNLIMITED:
+            return self.get_response(request)
+        if not controller().acquire(admission_class):
+            return self._shed(admission_class)
+        try:
+            return self.get_response(request)
+        finally:
+            controller().release(admission_class)
+
+    async def __acall__(self, request):
+        admission_class = self.classify(request)
+        if admission_class is UNLIMITED:
+            return await self.get_response(request)
+        # Waiting for a slot blocks, so it happens off the event loop
+        if not await sync_to_async(controller().acquire, thread_sensitive=False)(admission_class):
+            return self._shed(admission_class)
+        try:
+            return await self.get_response(request)
+        finally:
+            controller().release(admission_class)
+
+
+@router.get("/admission", auth=JWTAuth())
+def admission_stats(request):
+    """This process's admission classes: active and queued requests, and admitted, shed and timed-out totals"""
+    if not request.auth.is_staff:
+        raise HttpError(403, "Staff only")
+    return controller().stats()
@@ -3,6 +3,11 @@ ASGI config for ethnosdemo project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this module (e.g. ``gunicorn -k uvicorn.workers.UvicornWorker
+ethnosdemo.asgi:application``) when clients use the ``/api/wallet/events``
+stream: under ASGI an open stream is a suspended coroutine rather than a
+blocked worker thread, so one worker can hold thousands of them.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
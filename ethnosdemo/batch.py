@@ -0,0 +1,202 @@
+"""
+``POST /api/batch``: several API calls in one round trip.
+
+The body lists sub-requests to existing routes::
+
+    {"requests": [
+        {"method": "GET", "path": "/api/auth/me"},
+        {"method": "GET", "path": "/api/wallet/transactions?limit=20",
+         "headers": {"If-None-Match": "W/\\"7-42-json\\""}},
+        {"method": "POST", "path": "/api/wallet/send-money", "body": {...}}
+    ]}
+
+and the response holds one ``{"status", "headers", "body"}`` entry per
+sub-request, in the same order, in the format the batch request asked for.
+
+The batch is authenticated once and each sub-request runs as that user
+without looking the user up again (``JWTAuth`` reads ``batch_user``). Each
+sub-request gets its own copy of the user object. So a related object one
+sub-request caches, such as ``user.wallet``, is never served stale to a later
+one or shared between threads.
+
+Runs of consecutive GETs execute concurrently on a per-process thread pool of
+``API_BATCH_WORKERS`` threads. Any other method waits for the reads before it
+and runs alone, so writes happen in the order given and reads after a write
+see it.
+
+Sub-requests go straight to their view, so the rest of the middleware runs once,
+for the batch itself. Admission control is the exception. The batch is not
+admitted, but each sub-request takes a slot in its own admission class while
+it runs, as it would if sent alone, and gets a 503 entry if it is shed (see
+ethnosdemo/admission.py).
+"""
+import copy
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import msgpack
+import orjson
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from ninja import Router
+from ninja.errors import HttpError
+from pydantic import BaseModel, Field
+
+from accounts.auth import JWTAuth
+from .admission import SHED_DETAIL, UNLIMITED, classify, controller
+from .renderers import render_response, wants_msgpack
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+API_PREFIX = '/api/'
+BATCH_PATH = '/api/batch'
+# Request headers a sub-request may set; the rest are the batch request's
+SUB_REQUEST_HEADERS = {'if-none-match': 'HTTP_IF_NONE_MATCH'}
+# Response headers reported back per sub-request
+RESPONSE_HEADERS = ('ETag', 'Retry-After', 'RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset')
+
+
+class SubRequestSchema(BaseModel):
+    method: str = 'GET'
+    path: str = Field(..., description="API path with its query string, e.g. /api/wallet/transactions?limit=20")
+    headers: Dict[str, str] = Field(default_factory=dict, description="Only If-None-Match is honoured")
+    body: Optional[Any] = None
+
+
+class BatchSchema(BaseModel):
+    requests: List[SubRequestSchema]
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A forked child inherits the pool object but not its threads
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.API_BATCH_WORKERS, thread_name_prefix='api-batch')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _sub_request(batch_request, sub):
+    url = urlsplit(sub.path)
+    request = HttpRequest()
+    request.method = sub.method.upper()
+    request.path = request.path_info = url.path
+    request.META = {
+        key: value for key, value in batch_request.META.items()
+        if key in ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'HTTP_AUTHORIZATION', 'HTTP_ACCEPT')
+    }
+    request.META['REQUEST_METHOD'] = request.method
+    request.META['QUERY_STRING'] = url.query
+    for name, value in sub.headers.items():
+        key = SUB_REQUEST_HEADERS.get(name.lower())
+        if key:
+            request.META[key] = value
+    request.GET = QueryDict(url.query)
+    if sub.body is not None:
+        request._body = orjson.dumps(sub.body)
+        request.content_type, request.content_params = 'application/json', {}
+        request.META['CONTENT_TYPE'] = 'application/json'
+        request.META['CONTENT_LENGTH'] = str(len(request._body))
+    # The sub-request's view authenticates as the batch's user without a lookup
+    request.batch_user = copy.copy(batch_request.auth)
+    return request
+
+
+def _decode(request, response):
+    if not response.content:
+        return None
+    if wants_msgpack(request):
+        return msgpack.unpackb(response.content)
+    return orjson.loads(response.content)
+
+
+def _error(status, message, headers=None):
+    return {'status': status, 'headers': headers or {}, 'body': {'detail': message}}
+
+
+def _dispatch(request):
+    """Run one sub-request through its view; returns its ``{status, headers, body}`` entry"""
+    if not request.path.startswith(API_PREFIX) or request.path.rstrip('/') == BATCH_PATH:
+        return _error(400, "Sub-requests must be API paths other than /api/batch")
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return _error(404, "Not Found")
+    if iscoroutinefunction(match.func):
+        return _error(400, "Streaming endpoints cannot be batched")
+    request.resolver_match = match
+
+    admission_class = classify(request)
+    if admission_class is not UNLIMITED and not controller().acquire(admission_class):
+        return _error(503, SHED_DETAIL, {'Retry-After': str(admission_class.retry_after)})
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Batched %s %s failed", request.method, request.path)
+        return _error(500, "Internal server error")
+    finally:
+        if admission_class is not UNLIMITED:
+            controller().release(admission_class)
+    if response.streaming:
+        return _error(400, "Streaming endpoints cannot be batched")
+    return {
+        'status': response.status_code,
+        'headers': {name: response[name] for name in RESPONSE_HEADERS if response.has_header(name)},
+        'body': _decode(request, response),
+    }
+
+
+def _dispatch_in_worker(request):
+    # Pool threads keep their own database connections; recycle them like request threads do
+    close_old_connections()
+    try:
+        return _dispatch(request)
+    finally:
+        close_old_connections()
+
+
+@router.post("/batch", auth=JWTAuth())
+def batch(request, payload: BatchSchema):
+    """
+    Run several API requests as the authenticated user and return every
+    response at once; consecutive GETs run concurrently, other methods in order
+    """
+    if not 1 <= len(payload.requests) <= settings.API_BATCH_MAX_REQUESTS:
+        raise HttpError(400, f"A batch holds 1 to {settings.API_BATCH_MAX_REQUESTS} requests")
+
+    requests = [_sub_request(request, sub) for sub in payload.requests]
+    results = [None] * len(requests)
+    reads = []
+
+    def run_reads():
+        if len(reads) == 1:
+            results[reads[0]] = _dispatch(requests[reads[0]])
+        elif reads:
+            for index, result in zip(reads, _executor().map(_dispatch_in_worker, [requests[i] for i in reads])):
+                results[index] = result
+        reads.clear()
+
+    for index, sub_request in enumerate(requests):
+        if sub_request.method == 'GET':
+            reads.append(index)
+            continue
+        run_reads()
+        results[index] = _dispatch(sub_request)
+    run_reads()
+
+    return render_response(request, {'responses': results})
@@ -0,0 +1,65 @@
+"""
+Database routing between the primary and optional read replicas.
+
+Reads only go to a replica inside views decorated with ``@replica_reads``, and
+never for a user who has written recently: every wallet write pins its user to
+the primary for ``REPLICA_PIN_SECONDS`` so they always read their own writes.
+The pin is kept in the Django cache, which must be shared between workers
+(Redis, Memcached or the database cache) for the guarantee to hold across processes.
+"""
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def _pin_key(user_id):
+    return f"db_primary_pin:{user_id}"
+
+
+def pin_to_primary(*user_ids):
+    """Send these users' reads to the primary for the next REPLICA_PIN_SECONDS"""
+    if settings.DATABASE_REPLICAS:
+        cache.set_many({_pin_key(user_id): True for user_id in user_ids},
+                       timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(cache.get(_pin_key(user_id)))
+
+
+def replica_reads(view_func):
+    """Let a read-only view read from a replica unless its user is pinned to the primary"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        user = getattr(request, 'auth', None)
+        if not settings.DATABASE_REPLICAS or (user is not None and is_pinned_to_primary(user.id)):
+            return view_func(request, *args, **kwargs)
+
+        token = _replica_reads.set(True)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
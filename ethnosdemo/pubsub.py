@@ -0,0 +1,94 @@
+"""
+Publish/subscribe between request handlers and long-lived event streams.
+
+``publish(channel, message)`` may be called from any thread (request threads,
+the group-commit writer); ``subscribe(channel)`` is used from async code and
+yields messages as they arrive. The backend is chosen by ``PUBSUB_BACKEND``.
+
+``LocalPubSub``, the default, delivers within the current process only: each
+subscriber is an ``asyncio.Queue`` fed with ``call_soon_threadsafe``, so an
+idle subscriber costs a queue and a set entry, and a worker can hold thousands
+of them. With several worker processes, a subscriber only sees messages
+published by its own process; plug in a backend implementing ``PubSubBackend``
+over a shared broker (Redis, Postgres LISTEN/NOTIFY) to fan out between them.
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class PubSubBackend:
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def has_subscribers(self, channel):
+        """Whether a publish to ``channel`` could reach anyone (True if unknown)"""
+        return True
+
+    def subscribe(self, channel):
+        """Async context manager yielding an object whose ``get()`` coroutine returns the next message"""
+        raise NotImplementedError
+
+
+class LocalPubSub(PubSubBackend):
+    """In-process delivery to asyncio subscribers"""
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or settings.PUBSUB_QUEUE_SIZE
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put_dropping_oldest, queue, message)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                pass
+
+    def has_subscribers(self, channel):
+        return bool(self._subscribers.get(channel))
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(channel)
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+def _put_dropping_oldest(queue, message):
+    # A subscriber that stopped reading loses its oldest messages rather than growing without bound
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.PUBSUB_BACKEND)()
+
+
+def publish(channel, message):
+    get_backend().publish(channel, message)
+
+
+def has_subscribers(channel):
+    return get_backend().has_subscribers(channel)
+
+
+def subscribe(channel):
+    return get_backend().subscribe(channel)
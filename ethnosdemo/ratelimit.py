@@ -0,0 +1,193 @@
+"""
+Token-bucket rate limits for expensive or abusable endpoints.
+
+A view decorated with ``@rate_limit('<scope>')`` takes one token from the
+caller's bucket for that scope: the authenticated user's, or the client IP's
+for anonymous routes like login. ``RATE_LIMITS[scope]`` allows ``limit``
+requests per ``period`` seconds. A bucket holds up to ``burst`` tokens
+(default ``limit``) and refills at ``limit / period`` tokens a second. A scope
+missing from ``RATE_LIMITS`` is not limited.
+
+An empty bucket gets a 429 with ``Retry-After``. Every response of a limited
+view carries ``RateLimit-Limit``, ``RateLimit-Remaining`` and
+``RateLimit-Reset`` (seconds until the bucket is full again), added by
+``render_response``.
+
+Buckets live in a small SQLite database (``RATE_LIMIT_STORE``) in WAL mode,
+shared by every worker process on the host. A check is one ``INSERT ... ON
+CONFLICT DO UPDATE ... RETURNING`` statement in autocommit, so it is atomic
+across processes without an explicit transaction and takes a few tens of
+microseconds. The store is not synced to disk: losing buckets in a crash only
+refills them. If the store cannot be written, requests are let through.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+
+from .renderers import render_response
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# Refill since the last check, capped at the burst; SET expressions all see the old row
+_REFILLED = "min(:burst, tokens + max(0, :now - updated) * :rate)"
+TAKE = f"""
+INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = {_REFILLED} - ({_REFILLED} >= 1),
+    updated = :now,
+    allowed = {_REFILLED} >= 1
+RETURNING tokens, allowed
+"""
+PRUNE = "DELETE FROM buckets WHERE updated < :before"
+# Checks per process between deletions of buckets idle long enough to be full again
+PRUNE_EVERY = 10000
+
+
+class TokenBucketStore:
+    """Token buckets in a SQLite file shared by the host's worker processes"""
+
+    def __init__(self, path, busy_timeout_ms=1000):
+        self.path = str(path)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._checks = 0
+        self._checks_lock = threading.Lock()
+
+    def _connection(self):
+        # One connection per thread; a forked child opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                                         isolation_level=None, check_same_thread=False)
+            connection.executescript(
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=OFF;'
+                f'PRAGMA busy_timeout={self.busy_timeout_ms};'
+            )
+            connection.execute(SCHEMA)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, key, burst, rate):
+        """Take a token from ``key``'s bucket; returns ``(allowed, tokens left)``"""
+        connection = self._connection()
+        now = time.time()
+        tokens, allowed = connection.execute(TAKE, {'key': key, 'burst': burst, 'rate': rate, 'now': now}).fetchone()
+        with self._checks_lock:
+            self._checks += 1
+            prune = self._checks % PRUNE_EVERY == 0
+        if prune:
+            connection.execute(PRUNE, {'before': now - max_refill_seconds()})
+        return bool(allowed), tokens
+
+
+@dataclass
+class Policy:
+    scope: str
+    limit: int
+    period: float
+    burst: int = None
+
+    def __post_init__(self):
+        self.burst = self.burst or self.limit
+
+    @property
+    def rate(self):
+        """Tokens added per second"""
+        return self.limit / self.period
+
+    @property
+    def refill_seconds(self):
+        return self.burst / self.rate
+
+
+_store = None
+_policies = None
+_lock = threading.Lock()
+
+
+def store():
+    """The process's handle on the shared bucket store"""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = TokenBucketStore(settings.RATE_LIMIT_STORE, settings.RATE_LIMIT_BUSY_TIMEOUT_MS)
+        return _store
+
+
+def policies():
+    global _policies
+    if _policies is None:
+        _policies = {scope: Policy(scope, **config) for scope, config in settings.RATE_LIMITS.items()}
+    return _policies
+
+
+def max_refill_seconds():
+    """Longest time any bucket takes to refill from empty; idle that long, it may as well not exist"""
+    return max((policy.refill_seconds for policy in policies().values()), default=0)
+
+
+def client_ip(request):
+    """The client's address; the last proxy-appended entry when ``RATE_LIMIT_IP_HEADER`` is set"""
+    if settings.RATE_LIMIT_IP_HEADER:
+        forwarded = request.META.get(settings.RATE_LIMIT_IP_HEADER, '')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _bucket_key(request, scope):
+    user = getattr(request, 'auth', None)
+    if user is not None:
+        return f"{scope}:user:{user.pk}"
+    return f"{scope}:ip:{client_ip(request)}"
+
+
+def rate_limit_headers(policy, tokens):
+    return {
+        'RateLimit-Limit': str(policy.limit),
+        'RateLimit-Remaining': str(max(0, math.floor(tokens))),
+        'RateLimit-Reset': str(math.ceil((policy.burst - tokens) / policy.rate)),
+    }
+
+
+def rate_limit(scope):
+    """Limit a view to ``RATE_LIMITS[scope]`` per user, or per client IP when anonymous"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            policy = policies().get(scope) if settings.RATE_LIMIT_ENABLED else None
+            if policy is None:
+                return view_func(request, *args, **kwargs)
+
+            try:
+                allowed, tokens = store().take(_bucket_key(request, scope), policy.burst, policy.rate)
+            except sqlite3.Error:
+                logger.exception("Rate limit store unavailable; letting %s through", request.path)
+                return view_func(request, *args, **kwargs)
+
+            # Picked up by render_response, whatever the view returns
+            request.rate_limit_headers = rate_limit_headers(policy, tokens)
+            if not allowed:
+                response = render_response(request, {'detail': 'Too many requests'}, status=429)
+                response['Retry-After'] = str(math.ceil((1 - tokens) / policy.rate))
+                return response
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
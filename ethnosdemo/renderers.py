@@ -0,0 +1,258 @@
+"""
+Response rendering for the API.
+
+``FastJSONRenderer`` emits exactly the bytes of Ninja's ``JSONRenderer``. With
+``API_JSON_COMPACT`` on it uses orjson instead: the same values, without
+whitespace and with raw UTF-8 rather than ``\\u`` escapes, so smaller and
+faster but not byte-identical.
+
+Clients that send ``Accept: application/msgpack`` get MessagePack instead of
+JSON from every endpoint (``NegotiatingNinjaAPI``), with compact encodings:
+
+* ``Decimal``: ext type 1 holding a msgpack array ``[unscaled int, exponent]``,
+  so ``Decimal('948.34')`` is ``[94834, -2]``
+* ``UUID``: ext type 2 holding the 16 raw bytes
+* ``datetime``: the standard msgpack timestamp (ext type -1); naive values are taken as UTC
+* ``date``: ISO 8601 string
+
+``values_response`` is the trusted fast path for list endpoints. It takes rows
+from ``QuerySet.values(*Schema.model_fields)`` and serializes them directly,
+skipping model instances and Pydantic validation, so only use it where the
+column types already match the response schema.
+"""
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import partial
+from uuid import UUID
+
+import msgpack
+import orjson
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from ninja import NinjaAPI
+from ninja.renderers import BaseRenderer, JSONRenderer
+from ninja.responses import NinjaJSONEncoder
+
+_encoder = NinjaJSONEncoder()
+
+
+def _datetime_str(text):
+    # DjangoJSONEncoder's format, from an isoformat() string: milliseconds, 'Z' for UTC
+    if len(text) > 19 and text[19] == '.':
+        text = text[:23] + text[26:]
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+def _convert_datetimes(column):
+    # orjson formats datetimes like isoformat(), several times faster
+    return [None if text is None else _datetime_str(text) for text in orjson.loads(orjson.dumps(column))]
+
+
+def _convert_uuids(column):
+    # orjson writes UUIDs in str() form, several times faster
+    return orjson.loads(orjson.dumps(column))
+
+
+def _convert_strs(column):
+    return [None if value is None else str(value) for value in column]
+
+
+def _convert_any(column):
+    return [value if value.__class__ in _JSON_NATIVE else _encoder.default(value) for value in column]
+
+
+_JSON_NATIVE = {str, int, float, bool, type(None)}
+
+# How DjangoJSONEncoder writes the non-JSON types that .values() rows contain, a column at a time
+_COLUMN_CONVERTERS = {
+    Decimal: _convert_strs,
+    UUID: _convert_uuids,
+    datetime: _convert_datetimes,
+    date: _convert_strs,
+}
+
+
+def _convert_rows(rows, converters, fallback):
+    if not rows:
+        return rows
+    for key in rows[0]:
+        column = [row[key] for row in rows]
+        types = {value.__class__ for value in column} - _JSON_NATIVE
+        if not types:
+            continue
+        convert = converters.get(types.pop()) if len(types) == 1 else None
+        convert = convert or fallback
+        if convert is None:
+            continue
+        for row, value in zip(rows, convert(column)):
+            row[key] = value
+    return rows
+
+
+def jsonable_rows(rows):
+    """Convert Decimal, UUID and date/time values of ``.values()`` rows in place, as DjangoJSONEncoder would"""
+    return _convert_rows(rows, _COLUMN_CONVERTERS, _convert_any)
+
+
+def dumps(data):
+    """Serialize response data to JSON bytes"""
+    if settings.API_JSON_COMPACT:
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, cls=NinjaJSONEncoder).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, request, data, *, response_status):
+        return dumps(data)
+
+
+MSGPACK_DECIMAL = 1
+MSGPACK_UUID = 2
+
+
+# ExtType() validates its arguments, which costs more than packing the value; ours are known good
+_ext = partial(tuple.__new__, msgpack.ExtType)
+
+
+def _decimal_ext(value, pack=msgpack.packb):
+    if not value.is_finite():
+        # NaN and infinities have no unscaled form
+        return str(value)
+    text = str(value)
+    if 'E' not in text:
+        # Plain notation: the digits are the unscaled value, the fraction's length the exponent
+        whole, _, fraction = text.partition('.')
+        return _ext((MSGPACK_DECIMAL, pack([int(whole + fraction), -len(fraction)])))
+    exponent = value.as_tuple().exponent
+    return _ext((MSGPACK_DECIMAL, pack([int(value.scaleb(-exponent)), exponent])))
+
+
+def _msgpack_decimals(column):
+    pack = msgpack.Packer(autoreset=True).pack
+    return [None if value is None else _decimal_ext(value, pack) for value in column]
+
+
+def _msgpack_uuids(column):
+    return [None if value is None else _ext((MSGPACK_UUID, value.bytes)) for value in column]
+
+
+_MSGPACK_COLUMN_CONVERTERS = {
+    Decimal: _msgpack_decimals,
+    UUID: _msgpack_uuids,
+}
+
+
+def msgpackable_rows(rows):
+    """
+    Turn the Decimal and UUID values of ``.values()`` rows into their ext types in
+    place, a column at a time, so packing does not call back into Python per value
+    """
+    return _convert_rows(rows, _MSGPACK_COLUMN_CONVERTERS, None)
+
+
+def _msgpack_default(value):
+    if isinstance(value, Decimal):
+        return _decimal_ext(value)
+    if isinstance(value, UUID):
+        return _ext((MSGPACK_UUID, value.bytes))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return _encoder.default(value)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    charset = None
+
+    def render(self, request, data, *, response_status):
+        # Aware datetimes are packed as timestamps natively; default() sees only naive ones
+        return msgpack.packb(data, default=_msgpack_default, datetime=True)
+
+
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def wants_msgpack(request):
+    """Whether the Accept header prefers MessagePack over JSON"""
+    accept = request.headers.get('Accept', '') if request is not None else ''
+    if 'msgpack' not in accept:
+        return False
+    quality = {}
+    for item in accept.split(','):
+        media_type, *params = item.split(';')
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[media_type.strip().lower()] = q
+    msgpack_q = max(quality.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    return msgpack_q > 0 and msgpack_q >= quality.get('application/json', 0.0)
+
+
+_msgpack_renderer = MessagePackRenderer()
+
+
+def content_type(renderer):
+    if renderer.charset:
+        return f"{renderer.media_type}; charset={renderer.charset}"
+    return renderer.media_type
+
+
+def render_response(request, data, status=200, renderer=None, response=None):
+    """
+    Render ``data`` in the format the client asked for (``renderer`` otherwise,
+    JSON by default), into ``response`` if given or a new ``HttpResponse``.
+
+    A successful response carries the ETag a conditional view left on
+    ``request.response_etag`` (see wallet/versioning.py), and any response the
+    rate limit headers left on ``request.rate_limit_headers`` (see ethnosdemo/ratelimit.py).
+    """
+    renderer = _msgpack_renderer if wants_msgpack(request) else renderer or FastJSONRenderer()
+    content = renderer.render(request, data, response_status=status)
+    if response is None:
+        response = HttpResponse(content, status=status, content_type=content_type(renderer))
+    else:
+        response.content = content
+        response['Content-Type'] = content_type(renderer)
+    patch_vary_headers(response, ['Accept'])
+    etag = getattr(request, 'response_etag', None)
+    if etag and status == 200:
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    for name, value in getattr(request, 'rate_limit_headers', {}).items():
+        response[name] = value
+    return response
+
+
+def values_response(request, rows, status=200):
+    """
+    Respond with ``.values()`` rows, or a dict holding lists of them, without
+    building model instances or validating them
+    """
+    convert = msgpackable_rows if wants_msgpack(request) else jsonable_rows
+    for value in rows.values() if isinstance(rows, dict) else [rows]:
+        if isinstance(value, list):
+            convert(value)
+    return render_response(request, rows, status)
+
+
+class NegotiatingNinjaAPI(NinjaAPI):
+    """NinjaAPI that answers in MessagePack when the request's Accept header prefers it"""
+
+    def create_response(self, request, data, *, status=None, temporal_response=None):
+        if temporal_response:
+            status = temporal_response.status_code
+        assert status
+        return render_response(request, data, status, renderer=self.renderer, response=temporal_response)
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # First, so shed requests cost as little as possible
+    'ethnosdemo.admission.AdmissionControlMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -95,6 +97,135 @@ DATABASES = {
     )
 }
 
+# Read replicas, as comma-separated database URLs (e.g. sqlite:///replica.sqlite3).
+# Read-only endpoints use them unless the user has moved money in the last
+# REPLICA_PIN_SECONDS; see ethnosdemo/db_routers.py
+replica_urls_str = config('REPLICA_DATABASE_URLS', default='')
+DATABASE_REPLICAS = []
+for index, url in enumerate(url.strip() for url in replica_urls_str.split(',') if url.strip()):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# Extra wallet shards, as comma-separated database URLs. Each user's wallet,
+# cards, transactions and QR codes live on one shard picked by user-id hash;
+# 'default' is always shard 0. See wallet/sharding.py
+shard_urls_str = config('SHARD_DATABASE_URLS', default='')
+WALLET_SHARDS = ['default']
+for index, url in enumerate((url.strip() for url in shard_urls_str.split(',') if url.strip()), start=1):
+    alias = f'shard_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    WALLET_SHARDS.append(alias)
+
+DATABASE_ROUTERS = [
+    'wallet.sharding.ShardRouter',
+    'ethnosdemo.db_routers.PrimaryReplicaRouter',
+]
+
+# Render API JSON with orjson: compact and faster, but not byte-identical to
+# the default output (no spaces after separators, raw UTF-8); see ethnosdemo/renderers.py
+API_JSON_COMPACT = config('API_JSON_COMPACT', default=False, cast=bool)
+
+# Transactions older than this are moved to the archive table by
+# `manage.py archive_transactions`; see wallet/archive.py
+TRANSACTION_ARCHIVE_AFTER_DAYS = config('TRANSACTION_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+
+# High-throughput SQLite profile for single-node deployments: WAL journal,
+# a busy timeout instead of immediate "database is locked" errors, mmap reads,
+# fsync only at WAL checkpoints unless SQLITE_SYNCHRONOUS=FULL (a power loss can
+# drop the last commits, a process crash cannot), and BEGIN IMMEDIATE so writers queue on the busy timeout
+# rather than fail when upgrading a read lock.
+SQLITE_HIGH_THROUGHPUT = config('SQLITE_HIGH_THROUGHPUT', default=False, cast=bool)
+SQLITE_BUSY_TIMEOUT_MS = config('SQLITE_BUSY_TIMEOUT_MS', default=5000, cast=int)
+SQLITE_MMAP_SIZE = config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)
+SQLITE_SYNCHRONOUS = config('SQLITE_SYNCHRONOUS', default='NORMAL')
+
+if SQLITE_HIGH_THROUGHPUT:
+    for database in DATABASES.values():
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            database.setdefault('OPTIONS', {}).update({
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};'
+                    f'PRAGMA synchronous={SQLITE_SYNCHRONOUS};'
+                    f'PRAGMA mmap_size={SQLITE_MMAP_SIZE};'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            })
+
+# Commit concurrent wallet writes in batches from one writer thread per
+# database; see ethnosdemo/group_commit.py. On by default with the SQLite profile.
+GROUP_COMMIT = config('GROUP_COMMIT', default=SQLITE_HIGH_THROUGHPUT, cast=bool)
+GROUP_COMMIT_MAX_BATCH = config('GROUP_COMMIT_MAX_BATCH', default=256, cast=int)
+GROUP_COMMIT_MAX_WAIT_MS = config('GROUP_COMMIT_MAX_WAIT_MS', default=2, cast=float)
+
+# Pub/sub behind the /api/wallet/events stream; see ethnosdemo/pubsub.py. The
+# default delivers within one process only. Slow subscribers keep the newest
+# PUBSUB_QUEUE_SIZE messages; idle streams get a keep-alive comment every
+# SSE_HEARTBEAT_SECONDS.
+PUBSUB_BACKEND = config('PUBSUB_BACKEND', default='ethnosdemo.pubsub.LocalPubSub')
+PUBSUB_QUEUE_SIZE = config('PUBSUB_QUEUE_SIZE', default=100, cast=int)
+SSE_HEARTBEAT_SECONDS = config('SSE_HEARTBEAT_SECONDS', default=15, cast=float)
+
+# Optional per-process memory for columnar transaction histories that /api/wallet/stats
+# is then computed from; see wallet/columns.py. Off (0) by default: statistics are
+# computed in the database. e.g. 67108864 for 64 MiB.
+TRANSACTION_COLUMN_CACHE_BYTES = config('TRANSACTION_COLUMN_CACHE_BYTES', default=0, cast=int)
+
+
+# POST /api/batch: most sub-requests per batch, and threads per process running
+# a batch's GETs concurrently; see ethnosdemo/batch.py
+API_BATCH_MAX_REQUESTS = config('API_BATCH_MAX_REQUESTS', default=20, cast=int)
+API_BATCH_WORKERS = config('API_BATCH_WORKERS', default=4, cast=int)
+
+
+# Admission control of API requests by priority class; see ethnosdemo/admission.py.
+# Per process: each class runs at most `concurrency` requests and queues at most
+# `queue` more for up to `timeout` seconds, then answers 503 with `Retry-After`.
+# Priority 0 gets freed slots first. Routes are (method or '*', path regex,
+# class or None for unlimited), first match wins; other API routes are 'default'.
+ADMISSION_CONTROL = config('ADMISSION_CONTROL', default=True, cast=bool)
+ADMISSION_MAX_ACTIVE = config('ADMISSION_MAX_ACTIVE', default=32, cast=int)
+ADMISSION_CLASSES = {
+    'critical': {'priority': 0, 'concurrency': 32, 'queue': 64, 'timeout': 1.0, 'retry_after': 1},
+    'default': {'priority': 1, 'concurrency': 16, 'queue': 32, 'timeout': 2.0, 'retry_after': 1},
+    'heavy': {'priority': 2, 'concurrency': 4, 'queue': 8, 'timeout': 2.0, 'retry_after': 5},
+}
+ADMISSION_ROUTES = [
+    # Long-lived event streams would hold a slot for as long as they are open
+    ('*', r'^/api/wallet/events$', None),
+    # Each sub-request of a batch is admitted in its own class as it runs
+    ('POST', r'^/api/batch$', None),
+    ('GET', r'^/api/(auth/me|wallet/wallet|admission)$', 'critical'),
+    # Password hashing, QR image rendering and statistics aggregation
+    ('POST', r'^/api/auth/(login|register)$', 'heavy'),
+    ('*', r'^/api/wallet/qr-codes(/generate)?$', 'heavy'),
+    ('GET', r'^/api/wallet/(stats|dashboard)$', 'heavy'),
+]
+
+
+# Token-bucket rate limits per user (per client IP when anonymous) for the views
+# decorated with @rate_limit(scope); see ethnosdemo/ratelimit.py. Each scope allows
+# `limit` requests per `period` seconds, bursting to `burst` (default `limit`).
+# Buckets are kept in RATE_LIMIT_STORE, a SQLite file shared by the host's workers.
+# Behind a proxy, set RATE_LIMIT_IP_HEADER to the META key of the header it
+# appends the client address to (e.g. HTTP_X_FORWARDED_FOR).
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMIT_STORE = config('RATE_LIMIT_STORE', default=str(BASE_DIR / 'ratelimit.sqlite3'))
+RATE_LIMIT_BUSY_TIMEOUT_MS = config('RATE_LIMIT_BUSY_TIMEOUT_MS', default=1000, cast=int)
+RATE_LIMIT_IP_HEADER = config('RATE_LIMIT_IP_HEADER', default='')
+RATE_LIMITS = {
+    'login': {'limit': 10, 'period': 60},
+    'register': {'limit': 20, 'period': 3600, 'burst': 5},
+    'send_money': {'limit': 60, 'period': 60, 'burst': 20},
+    'generate_qr_code': {'limit': 30, 'period': 60, 'burst': 10},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -0,0 +1,233 @@
+import json
+import tempfile
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock
+from uuid import UUID, uuid4
+
+import msgpack
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from . import admission, ratelimit
+from .admission import AdmissionController
+from .group_commit import GroupCommitWriter
+from .renderers import MSGPACK_DECIMAL, MSGPACK_UUID, render_response, values_response
+
+
+def create_user(email):
+    return User.objects.create(email=email)
+
+
+def fail(email):
+    User.objects.create(email=email)
+    raise ValueError(email)
+
+
+class GroupCommitTests(TransactionTestCase):
+    """Queued writes share a commit, and a failing one only rolls back itself"""
+
+    def test_failed_job_rolls_back_alone(self):
+        writer = GroupCommitWriter('default', max_batch=256, max_wait=0.05)
+        futures = [writer.submit(create_user, f'group{n}@example.com') for n in range(5)]
+        failed = writer.submit(fail, 'failed@example.com')
+        futures += [writer.submit(create_user, f'group{n}@example.com') for n in range(5, 10)]
+
+        self.assertEqual([future.result().email for future in futures],
+                         [f'group{n}@example.com' for n in range(10)])
+        with self.assertRaisesMessage(ValueError, 'failed@example.com'):
+            failed.result()
+        self.assertEqual(User.objects.filter(email__startswith='group').count(), 10)
+        self.assertFalse(User.objects.filter(email='failed@example.com').exists())
+
+
+def _ext_hook(code, data):
+    if code == MSGPACK_DECIMAL:
+        unscaled, exponent = msgpack.unpackb(data)
+        return Decimal(unscaled).scaleb(exponent)
+    if code == MSGPACK_UUID:
+        return UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+class MessagePackTests(SimpleTestCase):
+    """Rows converted a column at a time pack exactly as the per-value default hook does"""
+
+    def test_rows_match_default_hook(self):
+        request = RequestFactory().get('/api/wallet/transactions', HTTP_ACCEPT='application/msgpack')
+        amounts = ['33600.91', '0.00', '-12.50', '1E+3', '0.001', '-0', None]
+        rows = [
+            {
+                'id': n,
+                'transaction_id': None if amount is None else uuid4(),
+                'amount': None if amount is None else Decimal(amount),
+                'created_at': datetime(2026, 1, n + 1, tzinfo=timezone.utc),
+            }
+            for n, amount in enumerate(amounts)
+        ]
+        expected = render_response(request, [row.copy() for row in rows]).content
+        packed = values_response(request, [row.copy() for row in rows]).content
+
+        self.assertEqual(packed, expected)
+        decoded = msgpack.unpackb(packed, ext_hook=_ext_hook, timestamp=3)
+        self.assertEqual(decoded, rows)
+
+
+class BatchTests(TransactionTestCase):
+    """Batched calls run in order as the batch's user, each answered like a call of its own"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='batcher@example.com', password='x')
+
+    def post(self, requests, user=None):
+        return self.client.post(
+            '/api/batch', json.dumps({'requests': requests}), content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {generate_access_token(user or self.user)}',
+        )
+
+    def batch(self, *requests):
+        response = self.post([{'path': request} if isinstance(request, str) else request for request in requests])
+        self.assertEqual(response.status_code, 200)
+        return response.json()['responses']
+
+    def test_reads_after_a_write_see_it(self):
+        income = {'transaction_type': 'income', 'amount': 3, 'description': 'Batched'}
+        before, created, after, history = self.batch(
+            '/api/wallet/wallet',
+            {'method': 'POST', 'path': '/api/wallet/transactions', 'body': income},
+            '/api/wallet/wallet',
+            '/api/wallet/transactions?fields=description',
+        )
+
+        self.assertEqual([entry['status'] for entry in (before, created, after, history)], [200, 201, 200, 200])
+        self.assertEqual(Decimal(after['body']['balance']) - Decimal(before['body']['balance']), 3)
+        self.assertEqual(history['body'], [{'description': 'Batched'}])
+
+    def test_unbatchable_paths(self):
+        responses = self.batch('/api/nope', '/api/batch', '/api/wallet/events', '/admin/', '/api/auth/me')
+
+        self.assertEqual([(entry['status'], entry['body']) for entry in responses[:4]], [
+            (404, {'detail': 'Not Found'}),
+            (400, {'detail': 'Sub-requests must be API paths other than /api/batch'}),
+            (400, {'detail': 'Streaming endpoints cannot be batched'}),
+            (400, {'detail': 'Sub-requests must be API paths other than /api/batch'}),
+        ])
+        self.assertEqual(responses[4]['status'], 200)
+
+    @override_settings(API_BATCH_MAX_REQUESTS=2)
+    def test_batch_size_is_bounded(self):
+        self.assertEqual(self.post([{'path': '/api/auth/me'}] * 2).status_code, 200)
+        for size in (0, 3):
+            with self.subTest(size=size):
+                response = self.post([{'path': '/api/auth/me'}] * size)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'detail': 'A batch holds 1 to 2 requests'})
+
+    def test_if_none_match(self):
+        [first] = self.batch('/api/wallet/wallet')
+        etag = first['headers']['ETag']
+        unchanged, other = self.batch(
+            {'path': '/api/wallet/wallet', 'headers': {'If-None-Match': etag}},
+            {'path': '/api/wallet/wallet', 'headers': {'If-None-Match': 'W/"0-0-json"'}},
+        )
+
+        self.assertEqual(unchanged, {'status': 304, 'headers': {'ETag': etag}, 'body': None})
+        self.assertEqual(other['status'], 200)
+        self.assertEqual(other['headers'], {'ETag': etag})
+
+    def test_batch_user_comes_from_the_batch_token(self):
+        intruder = User.objects.create_user(email='intruder@example.com', password='x')
+        [me] = self.batch({
+            'path': '/api/auth/me', 'batch_user': intruder.pk,
+            'headers': {'Authorization': f'Bearer {generate_access_token(intruder)}', 'X-Batch-User': str(intruder.pk)},
+        })
+        self.assertEqual(me['body']['email'], 'batcher@example.com')
+
+        # Only a batch sets the attribute; a plain request without a token is refused
+        response = self.client.get('/api/auth/me', {'batch_user': self.user.pk}, HTTP_BATCH_USER=str(self.user.pk))
+        self.assertEqual(response.status_code, 401)
+
+
+class BatchAdmissionTests(TransactionTestCase):
+    """Each sub-request of a batch takes a slot in its own admission class"""
+
+    def setUp(self):
+        classes = {**settings.ADMISSION_CLASSES, 'heavy': {**settings.ADMISSION_CLASSES['heavy'], 'queue': 0}}
+        patcher = mock.patch.object(admission, '_controller', AdmissionController(classes, 32))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(email='batch@example.com', password='x')
+
+    def batch(self, *paths):
+        response = self.client.post(
+            '/api/batch', json.dumps({'requests': [{'path': path} for path in paths]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {generate_access_token(self.user)}',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['responses']
+
+    def test_sub_requests_are_admitted_by_class(self):
+        classes = admission.controller().classes
+        responses = self.batch('/api/wallet/wallet', '/api/wallet/stats', '/api/wallet/transactions')
+
+        self.assertEqual([entry['status'] for entry in responses], [200, 200, 200])
+        self.assertEqual([classes[name].admitted for name in ('critical', 'default', 'heavy')], [1, 1, 1])
+        self.assertEqual(admission.controller().active, 0)
+
+    def test_sub_request_is_shed_when_its_class_is_full(self):
+        heavy = admission.controller().classes['heavy']
+        held = [admission.controller().acquire(heavy) for _ in range(heavy.concurrency)]
+        try:
+            responses = self.batch('/api/wallet/wallet', '/api/wallet/stats')
+        finally:
+            for _ in held:
+                admission.controller().release(heavy)
+
+        self.assertEqual(responses[0]['status'], 200)
+        self.assertEqual(responses[1], {
+            'status': 503, 'headers': {'Retry-After': str(heavy.retry_after)},
+            'body': {'detail': 'Server busy, retry later'},
+        })
+        self.assertEqual(heavy.shed, 1)
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'login': {'limit': 2, 'period': 60}})
+class RateLimitTests(TestCase):
+    """An empty bucket answers 429, and every limited response says how much is left"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = ratelimit.TokenBucketStore(f'{directory.name}/ratelimit.sqlite3')
+        # A stopped clock, so no bucket refills between requests
+        clock = mock.Mock(time=mock.Mock(return_value=1_000_000.0))
+        for name, value in (('_store', store), ('_policies', None), ('time', clock)):
+            patcher = mock.patch.object(ratelimit, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def login(self, address='10.0.0.1'):
+        return self.client.post(
+            '/api/auth/login', json.dumps({'email': 'nobody@example.com', 'password': 'x'}),
+            content_type='application/json', REMOTE_ADDR=address,
+        )
+
+    def test_limit_and_headers(self):
+        responses = [self.login() for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses], [401, 401, 429])
+        self.assertEqual([response['RateLimit-Remaining'] for response in responses], ['1', '0', '0'])
+        self.assertEqual([response['RateLimit-Reset'] for response in responses], ['30', '60', '60'])
+        self.assertEqual({response['RateLimit-Limit'] for response in responses}, {'2'})
+        self.assertEqual(responses[2].json(), {'detail': 'Too many requests'})
+        self.assertEqual(responses[2]['Retry-After'], '30')
+        self.assertNotIn('Retry-After', responses[0])
+
+    def test_buckets_are_per_client(self):
+        for _ in range(2):
+            self.login('10.0.0.1')
+        self.assertEqual(self.login('10.0.0.1').status_code, 429)
+        self.assertEqual(self.login('10.0.0.2').status_code, 401)
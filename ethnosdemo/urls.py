@@ -16,20 +16,25 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from ninja import NinjaAPI
+from ethnosdemo.renderers import FastJSONRenderer, NegotiatingNinjaAPI
+from ethnosdemo.admission import router as admission_router
+from ethnosdemo.batch import router as batch_router
 from accounts.api import router as accounts_router
 from wallet.api import router as wallet_router
 
 # Initialize Ninja API
-api = NinjaAPI(
+api = NegotiatingNinjaAPI(
     title="Deji's Wallet API",
     version="1.0.0",
-    description="A comprehensive wallet application API for managing finances, cards, and transactions"
+    description="A comprehensive wallet application API for managing finances, cards, and transactions",
+    renderer=FastJSONRenderer(),
 )
 
 # Register routers
 api.add_router("/auth", accounts_router, tags=["Authentication"])
 api.add_router("/wallet", wallet_router, tags=["Wallet"])
+api.add_router("/", batch_router, tags=["Batch"])
+api.add_router("/", admission_router, tags=["Operations"])
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -1,13 +1,208 @@
+"""
+Admin for the wallet app.
+
+The wallet, transaction and archive changelists run in scale mode
+(``ScaleAdminMixin``) so they open quickly however large the tables grow:
+
+* the owning user is joined into the page query (``list_select_related``) and
+  picked with an autocomplete widget rather than a ``<select>`` of every user;
+* the unfiltered row count comes from the database's statistics
+  (``estimated_count``), and filtered counts stop at ``COUNT_LIMIT``;
+* pages in the default order are read by keyset (``?after=<cursor>``: rows
+  after the last one shown) instead of ``OFFSET``, so every page costs the same;
+* every filter is backed by an index leading with the filtered column, choice
+  lists never scan the table, and only index-backed columns are sortable.
+"""
 from django.contrib import admin
-from .models import Wallet, Card, Transaction, QRCode
+from django.contrib.admin.options import IncorrectLookupParameters, ShowFacets
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import Wallet, Card, Transaction, ArchivedTransaction, QRCode
+from .search import search_queryset
+
+# Counts at or below this are exact; larger filtered counts are shown as this value
+COUNT_LIMIT = 10000
+
+CURSOR_VAR = 'after'
+
+
+def estimated_count(model, using):
+    """Row count of the model's table from the database's statistics, or None if it has none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                # Written by ANALYZE; the first number of each row is the table's row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+            # Both ends of the rowid b-tree: exact unless rows were deleted
+            table = connection.ops.quote_name(table)
+            cursor.execute(f"SELECT (SELECT MAX(rowid) FROM {table}) - (SELECT MIN(rowid) FROM {table}) + 1")
+            return cursor.fetchone()[0] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never counts more than ``COUNT_LIMIT`` rows; ``approximate`` tells when it didn't count them all"""
+    approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > COUNT_LIMIT:
+                self.approximate = True
+                return estimate
+        count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+        self.approximate = count > COUNT_LIMIT
+        return min(count, COUNT_LIMIT)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist paging by keyset when sorted by pk, or by a non-null field and
+    then pk in the same direction; other orders fall back to numbered pages.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing filters or order starts again from the newest rows
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_VAR])
+
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        # Break ties in the direction of the sort, so an index on (field, pk) serves either way
+        if len(ordering) == 2 and ordering[1] == '-pk' and not str(ordering[0]).startswith('-'):
+            ordering[1] = 'pk'
+        return ordering
+
+    def _keyset_fields(self):
+        """Ordering of the page as (field name, descending) pairs, if keyset paging can follow it"""
+        ordering = [str(name) for name in self.queryset.query.order_by]
+        if not ordering or len(ordering) > 2 or ordering[-1].lstrip('-') != 'pk':
+            return None
+        fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        if len({descending for name, descending in fields}) > 1:
+            return None
+        if len(fields) == 2:
+            name = fields[0][0]
+            if '__' in name or self.lookup_opts.get_field(name).null:
+                return None
+        return fields
+
+    def _after(self, queryset, fields, cursor):
+        values = cursor.rsplit('~', len(fields) - 1)
+        if len(values) != len(fields):
+            raise IncorrectLookupParameters(cursor)
+        try:
+            values = [
+                (self.lookup_opts.pk if name == 'pk' else self.lookup_opts.get_field(name)).to_python(value)
+                for (name, descending), value in zip(fields, values)
+            ]
+        except ValidationError as e:
+            raise IncorrectLookupParameters(e)
+        before = fields[0][1]
+        if len(fields) == 1:
+            return queryset.filter(pk__lt=values[0]) if before else queryset.filter(pk__gt=values[0])
+        # Rows past (value, pk) in sort order, written so the index range is on the field
+        field, value, pk = fields[0][0], values[0], values[1]
+        if before:
+            return queryset.filter(**{f'{field}__lte': value}).exclude(Q(**{field: value}) & Q(pk__gte=pk))
+        return queryset.filter(**{f'{field}__gte': value}).exclude(Q(**{field: value}) & Q(pk__lte=pk))
+
+    def get_results(self, request):
+        fields = self._keyset_fields()
+        if fields is None or self.show_all:
+            self.keyset = False
+            return super().get_results(request)
+
+        self.keyset = True
+        self.cursor = request.GET.get(CURSOR_VAR)
+        queryset = self.queryset
+        if self.cursor:
+            queryset = self._after(queryset, fields, self.cursor)
+        result_list = queryset[:self.list_per_page]
+        rows = list(result_list)
+        has_more = len(rows) == self.list_per_page and queryset[self.list_per_page:].exists()
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = bool(self.cursor) or has_more
+        self.newest_url = self.get_query_string() if self.cursor else None
+        self.next_url = None
+        if has_more:
+            last = rows[-1]
+            cursor = '~'.join(str(getattr(last, name)) for name, descending in fields)
+            self.next_url = self.get_query_string({CURSOR_VAR: cursor})
+
+
+class ScaleAdminMixin:
+    """Changelist settings for tables too large to count, offset or scan"""
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    show_full_result_count = False
+    show_facets = ShowFacets.NEVER
+    paginator = EstimatedCountPaginator
+    change_list_template = 'admin/wallet/scale_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class RecentCategoryFilter(admin.SimpleListFilter):
+    """Category filter offering the categories of the latest rows instead of a DISTINCT over the table"""
+    title = 'category'
+    parameter_name = 'category'
+    sample_size = 10000
+
+    def lookups(self, request, model_admin):
+        recent = model_admin.get_queryset(request).order_by('-created_at', '-pk')
+        categories = set(recent.values_list('category', flat=True)[:self.sample_size]) - {None, ''}
+        return [(category, category) for category in sorted(categories)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(category=self.value())
+        return queryset
+
+
+class TransactionSearchMixin:
+    """Admin search through the full-text index (see wallet/search.py) instead of icontains scans"""
+
+    def get_search_results(self, request, queryset, search_term):
+        return search_queryset(queryset, search_term), False
 
 
 @admin.register(Wallet)
-class WalletAdmin(admin.ModelAdmin):
+class WalletAdmin(ScaleAdminMixin, admin.ModelAdmin):
     list_display = ('user', 'balance', 'currency', 'created_at', 'updated_at')
-    list_filter = ('currency', 'created_at')
+    list_filter = ('currency',)
+    sortable_by = ()
     search_fields = ('user__email', 'user__first_name', 'user__last_name')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('version', 'created_at', 'updated_at')
 
 
 @admin.register(Card)
@@ -16,19 +211,38 @@ class CardAdmin(admin.ModelAdmin):
     list_filter = ('card_type', 'is_primary', 'bank_name', 'created_at')
     search_fields = ('card_holder_name', 'card_number', 'user__email', 'bank_name')
     readonly_fields = ('created_at',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ScaleAdminMixin, TransactionSearchMixin, admin.ModelAdmin):
     list_display = ('transaction_id', 'user', 'transaction_type', 'amount', 'status', 'created_at')
-    list_filter = ('transaction_type', 'status', 'created_at', 'category')
+    list_filter = ('transaction_type', 'status', 'created_at', RecentCategoryFilter)
+    sortable_by = ('created_at',)
     search_fields = ('transaction_id', 'user__email', 'description', 'recipient_email', 'sender_email')
     readonly_fields = ('transaction_id', 'created_at')
 
 
+@admin.register(ArchivedTransaction)
+class ArchivedTransactionAdmin(ScaleAdminMixin, TransactionSearchMixin, admin.ModelAdmin):
+    list_display = ('transaction_id', 'user', 'transaction_type', 'amount', 'status', 'created_at', 'archived_at')
+    list_filter = ('transaction_type', 'status', 'created_at')
+    sortable_by = ('created_at',)
+    search_fields = ('transaction_id', 'user__email', 'description', 'recipient_email', 'sender_email')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(QRCode)
 class QRCodeAdmin(admin.ModelAdmin):
     list_display = ('user', 'qr_code', 'amount', 'is_active', 'expires_at', 'created_at')
     list_filter = ('is_active', 'created_at')
     search_fields = ('user__email', 'qr_code', 'description')
     readonly_fields = ('created_at',)
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
@@ -1,51 +1,112 @@
-from ninja import Router
+from ninja import Query, Router
 from ninja.errors import HttpError
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.conf import settings
 from django.db.models import Sum, Q
-from django.db import transaction
 from decimal import Decimal
-from datetime import datetime, timedelta
-from typing import List
+from datetime import date, datetime, timedelta
+from itertools import chain
+from typing import List, Optional
 import qrcode
 import io
 import base64
 import uuid
 
 from .models import Wallet, Card, Transaction, QRCode as QRCodeModel
+from .archive import find_transaction, page_transactions, transaction_filter, transaction_sources
+from .columns import column_statistics
+from .reconcile import to_cents
+from .events import event_stream
+from .services import InsufficientBalance, record_transaction, transfer_money
+from .snapshots import balance_history
+from .search import search_transactions
+from .sharding import shard_for_user
+from .sync import changes_since
+from .versioning import etag_from_version
 from .schemas import (
     WalletSchema, CardCreateSchema, CardSchema, CardUpdateSchema,
-    TransactionCreateSchema, TransactionSchema, QRCodeCreateSchema,
-    QRCodeSchema, QRCodeScanSchema, SendMoneySchema, StatsSchema,
-    DashboardSchema, MessageSchema, MonthlyStatsSchema
+    TransactionCreateSchema, TransactionSchema, TransactionFilterSchema, CounterpartySchema, QRCodeCreateSchema,
+    QRCodeSchema, QRCodeScanSchema, SendMoneySchema, StatsSchema, BalanceHistorySchema,
+    DashboardSchema, MessageSchema, MonthlyStatsSchema, SyncSchema
 )
 from accounts.models import User
-from accounts.auth import JWTAuth
+from accounts.auth import AsyncJWTAuth, JWTAuth
+from ethnosdemo.db_routers import replica_reads
+from ethnosdemo.ratelimit import rate_limit
+from ethnosdemo.renderers import values_response
 
 router = Router()
 
 
+def get_or_create_wallet(user):
+    """Read the wallet (possibly from a replica), creating it on the primary if missing"""
+    try:
+        return user.wallet
+    except Wallet.DoesNotExist:
+        wallet, created = Wallet.objects.using(shard_for_user(user)).get_or_create(user=user)
+        return wallet
+
+
+def select_fields(schema, fields):
+    """Schema fields named in a comma-separated ``?fields=`` value, in schema order (all if not given)"""
+    requested = {name.strip() for name in (fields or '').split(',') if name.strip()}
+    if not requested:
+        return list(schema.model_fields)
+    unknown = requested - schema.model_fields.keys()
+    if unknown:
+        raise HttpError(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in schema.model_fields if name in requested]
+
+
+FIELDS_DESCRIPTION = "Comma-separated response fields to return (default: all)"
+
+
 # ============ Wallet Endpoints ============
 @router.get("/wallet", response=WalletSchema, auth=JWTAuth())
+@replica_reads
+@etag_from_version()
 def get_wallet(request):
     """Get user's wallet details"""
-    wallet, created = Wallet.objects.get_or_create(user=request.auth)
-    return wallet
+    return get_or_create_wallet(request.auth)
+
+
+BALANCE_HISTORY_MAX_DAYS = 366
+
+
+@router.get("/balance-history", response=List[BalanceHistorySchema], auth=JWTAuth())
+@replica_reads
+@etag_from_version(daily=True)
+def get_balance_history(request, start: date = Query(..., alias='from'), end: Optional[date] = Query(None, alias='to')):
+    """
+    Closing balance of each day from `from` to `to` (default and at most today,
+    whose balance is the current one), oldest first; up to 366 days
+    """
+    today = timezone.localdate()
+    end = min(end or today, today)
+    if start > end:
+        raise HttpError(400, "from must not be after to")
+    if (end - start).days >= BALANCE_HISTORY_MAX_DAYS:
+        raise HttpError(400, f"At most {BALANCE_HISTORY_MAX_DAYS} days per request")
+    return values_response(request, balance_history(request.auth, start, end))
 
 
 # ============ Card Endpoints ============
 @router.get("/cards", response=List[CardSchema], auth=JWTAuth())
-def list_cards(request):
+@replica_reads
+@etag_from_version()
+def list_cards(request, fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
     """Get all user's cards"""
-    cards = Card.objects.filter(user=request.auth)
-    return list(cards)
+    cards = request.auth.cards.values(*select_fields(CardSchema, fields))
+    return values_response(request, list(cards))
 
 
 @router.post("/cards", response={201: CardSchema, 400: MessageSchema}, auth=JWTAuth())
 def create_card(request, payload: CardCreateSchema):
     """Add a new card"""
     try:
-        card = Card.objects.create(
-            user=request.auth,
+        card = request.auth.cards.create(
             **payload.dict()
         )
         return 201, card
@@ -54,16 +115,18 @@ def create_card(request, payload: CardCreateSchema):
 
 
 @router.get("/cards/{card_id}", response=CardSchema, auth=JWTAuth())
+@replica_reads
+@etag_from_version()
 def get_card(request, card_id: int):
     """Get a specific card"""
-    card = get_object_or_404(Card, id=card_id, user=request.auth)
+    card = get_object_or_404(request.auth.cards, id=card_id)
     return card
 
 
 @router.put("/cards/{card_id}", response={200: CardSchema, 400: MessageSchema}, auth=JWTAuth())
 def update_card(request, card_id: int, payload: CardUpdateSchema):
     """Update a card"""
-    card = get_object_or_404(Card, id=card_id, user=request.auth)
+    card = get_object_or_404(request.auth.cards, id=card_id)
 
     for attr, value in payload.dict(exclude_unset=True).items():
         setattr(card, attr, value)
@@ -75,27 +138,42 @@ def update_card(request, card_id: int, payload: CardUpdateSchema):
 @router.delete("/cards/{card_id}", response={200: MessageSchema, 404: MessageSchema}, auth=JWTAuth())
 def delete_card(request, card_id: int):
     """Delete a card"""
-    card = get_object_or_404(Card, id=card_id, user=request.auth)
+    card = get_object_or_404(request.auth.cards, id=card_id)
     card.delete()
     return 200, {"message": "Card deleted successfully"}
 
 
 # ============ Transaction Endpoints ============
 @router.get("/transactions", response=List[TransactionSchema], auth=JWTAuth())
-def list_transactions(request, limit: int = 50, offset: int = 0):
-    """Get user's transactions"""
-    transactions = Transaction.objects.filter(user=request.auth)[offset:offset+limit]
-    # Convert UUID to string for each transaction
-    for txn in transactions:
-        txn.transaction_id = str(txn.transaction_id)
-    return list(transactions)
+@replica_reads
+@etag_from_version()
+def list_transactions(request, limit: int = 50, offset: int = 0,
+                      filters: TransactionFilterSchema = Query(...),
+                      fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
+    """Get user's transactions, optionally filtered by type, status, category, amount and date range"""
+    rows = page_transactions(request.auth, offset, limit, fields=select_fields(TransactionSchema, fields),
+                             filters=transaction_filter(**filters.model_dump()))
+    return values_response(request, rows)
+
+
+@router.get("/transactions/search", response=List[TransactionSchema], auth=JWTAuth())
+@replica_reads
+@etag_from_version()
+def search_transactions_endpoint(request, q: str, limit: int = 20,
+                                 fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
+    """Search the user's transactions by description, category or counterparty email, best match first"""
+    rows = search_transactions(request.auth, q, select_fields(TransactionSchema, fields), min(max(limit, 1), 100))
+    return values_response(request, rows)
 
 
 @router.get("/transactions/{transaction_id}", response=TransactionSchema, auth=JWTAuth())
-def get_transaction(request, transaction_id: str):
+@replica_reads
+@etag_from_version()
+def get_transaction(request, transaction_id: uuid.UUID):
     """Get a specific transaction"""
-    txn = get_object_or_404(Transaction, transaction_id=transaction_id, user=request.auth)
-    txn.transaction_id = str(txn.transaction_id)
+    txn = find_transaction(request.auth, transaction_id=transaction_id)
+    if txn is None:
+        raise HttpError(404, "Transaction not found")
     return txn
 
 
@@ -103,83 +181,78 @@ def get_transaction(request, transaction_id: str):
 def create_transaction(request, payload: TransactionCreateSchema):
     """Create a new transaction (income/expense)"""
     try:
-        with transaction.atomic():
-            # Create transaction
-            txn = Transaction.objects.create(
-                user=request.auth,
-                **payload.dict()
-            )
-
-            # Update wallet balance
-            wallet = request.auth.wallet
-            if payload.transaction_type in ['income', 'transfer_in']:
-                wallet.balance += payload.amount
-            elif payload.transaction_type in ['expense', 'transfer_out']:
-                if wallet.balance < payload.amount:
-                    return 400, {"message": "Insufficient balance"}
-                wallet.balance -= payload.amount
-
-            wallet.save()
-
-            # Convert UUID to string for response
-            txn.transaction_id = str(txn.transaction_id)
-            return 201, txn
+        # Create transaction and update wallet balance
+        txn = record_transaction(request.auth, **payload.dict())
+        return 201, txn
+    except InsufficientBalance as e:
+        return 400, {"message": str(e)}
     except Exception as e:
         return 400, {"message": f"Error creating transaction: {str(e)}"}
 
 
+# ============ Counterparty Endpoints ============
+COUNTERPARTY_ORDERS = {
+    'top': ('-sent_total', '-received_total'),
+    'recent': ('-last_transfer_at',),
+}
+
+
+@router.get("/counterparties", response=List[CounterpartySchema], auth=JWTAuth())
+@replica_reads
+@etag_from_version()
+def list_counterparties(request, order: str = 'top', limit: int = 20):
+    """
+    Users the caller has transferred money with and their running totals:
+    `order=top` by amount sent, then received; `order=recent` by last transfer.
+    The history with one of them is `/wallet/transactions?counterparty=<id>`.
+    """
+    if order not in COUNTERPARTY_ORDERS:
+        raise HttpError(400, f"order must be one of: {', '.join(COUNTERPARTY_ORDERS)}")
+    pairs = list(request.auth.counterparties.order_by(*COUNTERPARTY_ORDERS[order]).values(
+        'counterparty_id', 'sent_total', 'sent_count', 'received_total', 'received_count', 'last_transfer_at',
+    )[:min(max(limit, 1), 100)])
+    users = User.objects.in_bulk([pair['counterparty_id'] for pair in pairs])
+    result = []
+    for pair in pairs:
+        user = users.get(pair.pop('counterparty_id'))
+        if user is None:
+            # Deleted since; their transfers still count in the caller's history
+            continue
+        result.append({'id': user.id, 'email': user.email, 'first_name': user.first_name,
+                       'last_name': user.last_name, **pair})
+    return values_response(request, result)
+
+
 # ============ Send/Receive Money Endpoints ============
 @router.post("/send-money", response={200: TransactionSchema, 400: MessageSchema, 404: MessageSchema}, auth=JWTAuth())
+@rate_limit('send_money')
 def send_money(request, payload: SendMoneySchema):
     """Send money to another user"""
     try:
-        # Check if recipient exists
-        recipient = User.objects.filter(email=payload.recipient_email).first()
+        # Check if recipient exists; an id (e.g. from /wallet/counterparties) is a primary key lookup
+        if payload.recipient_id is not None:
+            recipient = User.objects.filter(pk=payload.recipient_id).first()
+        elif payload.recipient_email:
+            recipient = User.objects.filter(email=payload.recipient_email).first()
+        else:
+            return 400, {"message": "recipient_email or recipient_id is required"}
         if not recipient:
             return 404, {"message": "Recipient not found"}
 
         if recipient.id == request.auth.id:
             return 400, {"message": "Cannot send money to yourself"}
 
-        with transaction.atomic():
-            # Check sender balance
-            sender_wallet = request.auth.wallet
-            if sender_wallet.balance < payload.amount:
-                return 400, {"message": "Insufficient balance"}
-
-            # Create sender transaction (debit)
-            sender_txn = Transaction.objects.create(
-                user=request.auth,
-                transaction_type='transfer_out',
-                amount=payload.amount,
-                description=payload.description,
-                category=payload.category,
-                recipient_email=payload.recipient_email,
-                status='completed'
-            )
-
-            # Create recipient transaction (credit)
-            Transaction.objects.create(
-                user=recipient,
-                transaction_type='transfer_in',
-                amount=payload.amount,
-                description=f"Received from {request.auth.email}",
-                category=payload.category,
-                sender_email=request.auth.email,
-                status='completed'
-            )
-
-            # Update balances
-            sender_wallet.balance -= payload.amount
-            sender_wallet.save()
-
-            recipient_wallet, created = Wallet.objects.get_or_create(user=recipient)
-            recipient_wallet.balance += payload.amount
-            recipient_wallet.save()
-
-            # Convert UUID to string for response
-            sender_txn.transaction_id = str(sender_txn.transaction_id)
-            return 200, sender_txn
+        sender_txn = transfer_money(
+            request.auth,
+            recipient,
+            payload.amount,
+            description=payload.description,
+            recipient_description=f"Received from {request.auth.email}",
+            category=payload.category,
+        )
+        return 200, sender_txn
+    except InsufficientBalance as e:
+        return 400, {"message": str(e)}
     except Exception as e:
         return 400, {"message": f"Error sending money: {str(e)}"}
 
@@ -201,7 +274,17 @@ def generate_qr_code_image(data: str) -> str:
     return f"data:image/png;base64,{img_str}"
 
 
+def find_active_qr_code(qr_code):
+    """Look up an active QR code on whichever shard holds it"""
+    for shard in settings.WALLET_SHARDS:
+        qr_code_record = QRCodeModel.objects.using(shard).filter(qr_code=qr_code, is_active=True).first()
+        if qr_code_record:
+            return qr_code_record
+    return None
+
+
 @router.post("/qr-codes/generate", response={201: QRCodeSchema, 400: MessageSchema}, auth=JWTAuth())
+@rate_limit('generate_qr_code')
 def generate_qr_code(request, payload: QRCodeCreateSchema):
     """Generate a QR code for receiving money"""
     try:
@@ -214,8 +297,7 @@ def generate_qr_code(request, payload: QRCodeCreateSchema):
             expires_at = datetime.now() + timedelta(hours=payload.expires_in_hours)
 
         # Create QR code record
-        qr_code_record = QRCodeModel.objects.create(
-            user=request.auth,
+        qr_code_record = request.auth.qr_codes.create(
             qr_code=qr_code_str,
             amount=payload.amount,
             description=payload.description,
@@ -241,25 +323,24 @@ def generate_qr_code(request, payload: QRCodeCreateSchema):
 
 
 @router.get("/qr-codes", response=List[QRCodeSchema], auth=JWTAuth())
-def list_qr_codes(request):
+@replica_reads
+@etag_from_version()
+def list_qr_codes(request, fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
     """Get all user's QR codes"""
-    qr_codes = QRCodeModel.objects.filter(user=request.auth)
+    selected = select_fields(QRCodeSchema, fields)
+    # The image is rendered from the code, and only when asked for
+    columns = [name for name in selected if name != 'qr_code_image']
+    if 'qr_code_image' in selected and 'qr_code' not in columns:
+        columns.append('qr_code')
+    qr_codes = request.auth.qr_codes.values(*columns)
 
     result = []
     for qr_code_record in qr_codes:
-        qr_code_image = generate_qr_code_image(qr_code_record.qr_code)
-        result.append({
-            "id": qr_code_record.id,
-            "qr_code": qr_code_record.qr_code,
-            "qr_code_image": qr_code_image,
-            "amount": qr_code_record.amount,
-            "description": qr_code_record.description,
-            "is_active": qr_code_record.is_active,
-            "expires_at": qr_code_record.expires_at,
-            "created_at": qr_code_record.created_at
-        })
+        if 'qr_code_image' in selected:
+            qr_code_record['qr_code_image'] = generate_qr_code_image(qr_code_record['qr_code'])
+        result.append({name: qr_code_record[name] for name in selected})
 
-    return result
+    return values_response(request, result)
 
 
 @router.post("/qr-codes/scan", response={200: TransactionSchema, 400: MessageSchema, 404: MessageSchema}, auth=JWTAuth())
@@ -267,7 +348,7 @@ def scan_qr_code(request, payload: QRCodeScanSchema):
     """Scan a QR code and send money"""
     try:
         # Find QR code
-        qr_code_record = QRCodeModel.objects.filter(qr_code=payload.qr_code, is_active=True).first()
+        qr_code_record = find_active_qr_code(payload.qr_code)
 
         if not qr_code_record:
             return 404, {"message": "QR code not found or inactive"}
@@ -285,79 +366,92 @@ def scan_qr_code(request, payload: QRCodeScanSchema):
         if qr_code_record.user.id == request.auth.id:
             return 400, {"message": "Cannot send money to yourself"}
 
-        with transaction.atomic():
-            # Check sender balance
-            sender_wallet = request.auth.wallet
-            if sender_wallet.balance < amount:
-                return 400, {"message": "Insufficient balance"}
-
-            # Create sender transaction (debit)
-            sender_txn = Transaction.objects.create(
-                user=request.auth,
-                transaction_type='transfer_out',
-                amount=amount,
-                description=qr_code_record.description or f"Payment via QR code",
-                recipient_email=qr_code_record.user.email,
-                status='completed'
-            )
-
-            # Create recipient transaction (credit)
-            Transaction.objects.create(
-                user=qr_code_record.user,
-                transaction_type='transfer_in',
-                amount=amount,
-                description=f"Received from {request.auth.email} via QR code",
-                sender_email=request.auth.email,
-                status='completed'
-            )
-
-            # Update balances
-            sender_wallet.balance -= amount
-            sender_wallet.save()
-
-            recipient_wallet = qr_code_record.user.wallet
-            recipient_wallet.balance += amount
-            recipient_wallet.save()
-
-            # Convert UUID to string for response
-            sender_txn.transaction_id = str(sender_txn.transaction_id)
-            return 200, sender_txn
+        sender_txn = transfer_money(
+            request.auth,
+            qr_code_record.user,
+            amount,
+            description=qr_code_record.description or f"Payment via QR code",
+            recipient_description=f"Received from {request.auth.email} via QR code",
+        )
+        return 200, sender_txn
+    except InsufficientBalance as e:
+        return 400, {"message": str(e)}
     except Exception as e:
         return 400, {"message": f"Error scanning QR code: {str(e)}"}
 
 
+# ============ Delta Sync ============
+@router.get("/sync", response=SyncSchema, auth=JWTAuth())
+@replica_reads
+@etag_from_version()
+def sync(request, since: int = 0, limit: int = 500):
+    """
+    Cards, transactions and QR codes changed after `since`, and the ids of those
+    deleted since then. Start with `since=0` (everything) and pass the returned
+    `seq` next time; repeat at once while `has_more` is true.
+    """
+    changes = changes_since(request.auth, since, min(max(limit, 1), 1000))
+    for qr_code_record in changes['qr_codes']:
+        qr_code_record['qr_code_image'] = generate_qr_code_image(qr_code_record['qr_code'])
+    return values_response(request, changes)
+
+
+# ============ Live Events ============
+@router.get("/events", auth=AsyncJWTAuth())
+async def wallet_events(request):
+    """
+    Server-sent event stream of the user's wallet: a `balance` event on connect,
+    then `transaction` and `balance` events as changes commit. Needs an ASGI server.
+    """
+    response = StreamingHttpResponse(event_stream(request.auth), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # ============ Statistics and Analytics ============
 @router.get("/stats", response=StatsSchema, auth=JWTAuth())
+@replica_reads
+@etag_from_version(daily=True)
 def get_statistics(request, months: int = 6):
     """Get income/expense statistics"""
     from django.db.models.functions import TruncMonth
     from collections import defaultdict
 
     user = request.auth
+    stats = column_statistics(user, months)
+    if stats is not None:
+        return stats
+
+    # Hot transactions, plus the archive when the user has archived history
+    sources = transaction_sources(user)
+
+    def total(queryset):
+        amount = queryset.aggregate(total=Sum('amount'))['total']
+        return Decimal('0') if amount is None else to_cents(amount)
 
     # Get total income and expense
-    total_income = Transaction.objects.filter(
-        user=user,
-        transaction_type__in=['income', 'transfer_in']
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    total_income = sum((
+        total(source.filter(transaction_type__in=['income', 'transfer_in'])) for source in sources
+    ), Decimal('0'))
 
-    total_expense = Transaction.objects.filter(
-        user=user,
-        transaction_type__in=['expense', 'transfer_out']
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    total_expense = sum((
+        total(source.filter(transaction_type__in=['expense', 'transfer_out'])) for source in sources
+    ), Decimal('0'))
 
     net_balance = total_income - total_expense
 
     # Get monthly stats
     start_date = datetime.now() - timedelta(days=30 * months)
-    monthly_transactions = Transaction.objects.filter(
-        user=user,
-        created_at__gte=start_date
-    ).annotate(month=TruncMonth('created_at'))
+    monthly_transactions = [
+        source.filter(created_at__gte=start_date).annotate(month=TruncMonth('created_at'))
+        for source in transaction_sources(user, since=timezone.make_aware(start_date))
+    ]
 
     monthly_data = defaultdict(lambda: {'income': Decimal('0'), 'expense': Decimal('0')})
 
-    for txn in monthly_transactions:
+    for txn in chain.from_iterable(monthly_transactions):
         month_key = txn.month.strftime('%Y-%m')
         if txn.transaction_type in ['income', 'transfer_in']:
             monthly_data[month_key]['income'] += txn.amount
@@ -375,13 +469,19 @@ def get_statistics(request, months: int = 6):
     ]
 
     # Get top spending categories
-    top_categories = Transaction.objects.filter(
-        user=user,
-        transaction_type='expense',
-        category__isnull=False
-    ).values('category').annotate(
-        total=Sum('amount')
-    ).order_by('-total')[:5]
+    category_totals = defaultdict(Decimal)
+    for source in sources:
+        for row in source.filter(
+            transaction_type='expense',
+            category__isnull=False
+        ).values('category').annotate(
+            total=Sum('amount')
+        ):
+            category_totals[row['category']] += to_cents(row['total'])
+    top_categories = [
+        {"category": category, "total": amount}
+        for category, amount in sorted(category_totals.items(), key=lambda item: (-item[1], item[0]))[:5]
+    ]
 
     return {
         "total_income": total_income,
@@ -393,15 +493,13 @@ def get_statistics(request, months: int = 6):
 
 
 @router.get("/dashboard", response=DashboardSchema, auth=JWTAuth())
+@replica_reads
+@etag_from_version(daily=True)
 def get_dashboard(request):
     """Get dashboard data with wallet, recent transactions, and stats"""
-    wallet, created = Wallet.objects.get_or_create(user=request.auth)
-
-    recent_transactions = Transaction.objects.filter(user=request.auth)[:10]
+    wallet = get_or_create_wallet(request.auth)
 
-    # Convert UUID to string for each transaction
-    for txn in recent_transactions:
-        txn.transaction_id = str(txn.transaction_id)
+    recent_transactions = page_transactions(request.auth, 0, 10)
 
     stats = get_statistics(request, months=6)
 
@@ -0,0 +1,173 @@
+"""
+Hot/cold split of transaction history.
+
+Transactions older than ``TRANSACTION_ARCHIVE_AFTER_DAYS`` are moved from
+``transactions`` to ``transactions_archive`` by ``python manage.py
+archive_transactions``, oldest first and a chunk at a time. Each chunk moves
+the rows, deletes them from the hot table and advances the user's
+``Wallet.archived_before`` in one transaction, so at any moment a user's
+history is exactly: hot rows, plus archived rows created before
+``archived_before``.
+
+Readers use ``transaction_sources`` / ``page_transactions`` and only touch the
+archive when the range they ask for reaches back before ``archived_before``.
+"""
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .ids import uuid7_time
+from .models import Wallet, Transaction, ArchivedTransaction
+
+ARCHIVED_FIELDS = [
+    'id', 'user_id', 'transaction_id', 'transaction_type', 'amount', 'description', 'category',
+    'status', 'recipient_email', 'sender_email', 'counterparty_id', 'created_at', 'seq',
+]
+
+
+def archived_before(user):
+    """Moment before which the user's transactions live in the archive, or None"""
+    try:
+        return user.wallet.archived_before
+    except Wallet.DoesNotExist:
+        return None
+
+
+def transaction_sources(user, since=None):
+    """Querysets that together hold the user's transactions created at or after ``since`` (all if None)"""
+    sources = [user.transactions.all()]
+    boundary = archived_before(user)
+    if boundary is not None and (since is None or since < boundary):
+        sources.append(user.archived_transactions.all())
+    return sources
+
+
+# ``list_transactions`` filters and the lookups they map to; each filter has an
+# index starting (user, <filter column>, created_at) or, for amounts, (user, created_at, amount)
+FILTER_LOOKUPS = {
+    'transaction_type': 'transaction_type',
+    'status': 'status',
+    'category': 'category',
+    'counterparty': 'counterparty_id',
+    'min_amount': 'amount__gte',
+    'max_amount': 'amount__lte',
+    'created_from': 'created_at__gte',
+    'created_to': 'created_at__lt',
+}
+
+
+def transaction_filter(**filters):
+    """``Q`` for the given ``FILTER_LOOKUPS`` filters, ignoring those that are None"""
+    condition = Q()
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name in ('created_from', 'created_to') and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        condition &= Q(**{FILTER_LOOKUPS[name]: value})
+    return condition
+
+
+def page_transactions(user, offset, limit, fields=None, filters=None):
+    """
+    Newest-first page of the user's history, reading the archive only past the
+    end of the hot rows. Returns ``.values(*fields)`` dicts if ``fields`` is given,
+    and only rows matching ``filters`` (a ``Q``) if that is given.
+    """
+    hot = user.transactions.all()
+    archived = user.archived_transactions.all()
+    if filters:
+        hot, archived = hot.filter(filters), archived.filter(filters)
+    if fields:
+        hot, archived = hot.values(*fields), archived.values(*fields)
+
+    rows = list(hot[offset:offset + limit])
+    if len(rows) == limit or archived_before(user) is None:
+        return rows
+
+    # Every hot row sorts before every archived row, so the page continues in the archive
+    hot_count = offset + len(rows) if rows else hot.count()
+    archive_offset = max(0, offset - hot_count)
+    rows += archived[archive_offset:archive_offset + limit - len(rows)]
+    return rows
+
+
+def find_transaction(user, **lookup):
+    """
+    Single transaction of the user from the hot table or, failing that, the
+    archive. A UUIDv7 ``transaction_id`` carries the time it was made, which
+    tells which table to try first. It is only a hint: the id's clock can run
+    ahead of the row's ``created_at`` (see ``UUID7Generator``), so the other
+    table is still tried on a miss.
+    """
+    sources = transaction_sources(user)
+    made = uuid7_time(lookup['transaction_id']) if isinstance(lookup.get('transaction_id'), uuid.UUID) else None
+    if made is not None and len(sources) == 2 and made < archived_before(user):
+        sources = sources[::-1]
+    for source in sources:
+        txn = source.filter(**lookup).first()
+        if txn is not None:
+            return txn
+    return None
+
+
+def archive_user_transactions(user_id, cutoff, using, chunk_size=1000):
+    """Move the user's transactions created before ``cutoff`` to the archive; returns rows moved"""
+    moved = 0
+    while True:
+        with transaction.atomic(using=using):
+            old = Transaction.objects.using(using).filter(user_id=user_id, created_at__lt=cutoff)
+            oldest = list(old.order_by('created_at').values_list('created_at', flat=True)[:chunk_size + 1])
+            if not oldest:
+                break
+            if len(oldest) <= chunk_size:
+                upto = cutoff
+            elif oldest[-1] > oldest[0]:
+                upto = oldest[-1]
+            else:
+                # More than a chunk share one timestamp; take all of them
+                upto = oldest[0] + timedelta(microseconds=1)
+
+            rows = list(old.filter(created_at__lt=upto).values(*ARCHIVED_FIELDS))
+            ArchivedTransaction.objects.using(using).bulk_create(
+                [ArchivedTransaction(**row) for row in rows], batch_size=chunk_size
+            )
+            _delete_by_id(using, [row['id'] for row in rows])
+            Wallet.objects.using(using).filter(user_id=user_id).filter(
+                Q(archived_before__isnull=True) | Q(archived_before__lt=upto)
+            ).update(archived_before=upto)
+            moved += len(rows)
+        if upto == cutoff:
+            break
+    return moved
+
+
+def _delete_by_id(using, ids):
+    # A plain DELETE: Model.delete() would load every row to send post_delete
+    connection = connections[using]
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+def archive_transactions(cutoff, using, chunk_size=1000, pause=0.0, log=None):
+    """Archive every user's transactions created before ``cutoff`` on one database; returns rows moved"""
+    user_ids = list(
+        Transaction.objects.using(using).filter(created_at__lt=cutoff)
+        .order_by().values_list('user_id', flat=True).distinct()
+    )
+    moved = 0
+    for user_id in user_ids:
+        moved += archive_user_transactions(user_id, cutoff, using, chunk_size)
+        if log:
+            log(user_id, moved)
+        if pause:
+            # Give request traffic a turn at the write lock between users
+            time.sleep(pause)
+    return moved
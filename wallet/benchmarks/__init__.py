@@ -0,0 +1,98 @@
+"""
+Micro-benchmark harness for CPU-heavy functions.
+
+Benchmarks are registered with the ``@benchmark`` decorator in the suite modules
+listed in ``SUITE_MODULES``. A benchmark function receives the shared fixtures
+and returns the callable to time (optionally with a dict of extra metrics, such
+as payload sizes). Run them with ``python manage.py run_benchmarks``.
+"""
+import gc
+import importlib
+import statistics
+import time
+
+
+SUITE_MODULES = [
+    'wallet.benchmarks.hot_paths',
+    'wallet.benchmarks.formats',
+    'wallet.benchmarks.encoding',
+    'wallet.benchmarks.ids',
+]
+
+_registry = {}
+
+
+class Benchmark:
+    def __init__(self, name, suite, func, number, repeat, warmup):
+        self.name = name
+        self.suite = suite
+        self.func = func
+        self.number = number
+        self.repeat = repeat
+        self.warmup = warmup
+
+
+def benchmark(name, number=100, repeat=7, warmup=10):
+    """Register a benchmark factory under ``<suite>.<name>``"""
+    def decorator(func):
+        suite = func.__module__.rsplit('.', 1)[-1]
+        full_name = f"{suite}.{name}"
+        _registry[full_name] = Benchmark(full_name, suite, func, number, repeat, warmup)
+        return func
+    return decorator
+
+
+def load_suites():
+    for module in SUITE_MODULES:
+        importlib.import_module(module)
+    return dict(sorted(_registry.items()))
+
+
+def _time_calls(fn, number):
+    start = time.perf_counter_ns()
+    for _ in range(number):
+        fn()
+    return (time.perf_counter_ns() - start) / number
+
+
+def run_benchmark(bench, fixtures, repeat=None, warmup=None):
+    """Time a single benchmark and return its stats in microseconds per call"""
+    case = bench.func(fixtures)
+    fn, extra = case if isinstance(case, tuple) else (case, {})
+    repeat = repeat or bench.repeat
+    warmup = bench.warmup if warmup is None else warmup
+
+    for _ in range(warmup):
+        fn()
+
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        samples = [_time_calls(fn, bench.number) / 1000 for _ in range(repeat)]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    median = statistics.median(samples)
+    result = {
+        'suite': bench.suite,
+        'number': bench.number,
+        'repeat': repeat,
+        'min_us': round(min(samples), 3),
+        'median_us': round(median, 3),
+        'mean_us': round(statistics.fmean(samples), 3),
+        'stdev_us': round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+        'ops_per_sec': round(1_000_000 / median, 1) if median else None,
+    }
+    if extra:
+        result['extra'] = extra
+    return result
+
+
+def compare_results(old, new):
+    """Yield (name, old median, new median, change %) for benchmarks present in both runs"""
+    for name in sorted(set(old) & set(new)):
+        before, after = old[name]['median_us'], new[name]['median_us']
+        change = (after - before) / before * 100 if before else 0.0
+        yield name, before, after, change
@@ -0,0 +1,94 @@
+"""
+Size and GROUP BY time of the transactions table with its categorical columns
+as text (before migration 0009) against small-int codes (see wallet/fields.py).
+
+Both layouts are copied from the fixture rows into scratch tables and indexed
+like ``Transaction``, so they hold the same data, equally packed.
+``table_bytes`` counts the rows and ``index_bytes`` the ``Meta.indexes``. Use
+``--rows`` in the hundreds of thousands for figures that reflect a real table.
+"""
+from django.db import connection
+
+from wallet.models import Transaction, TransactionCategory
+
+from . import benchmark
+
+
+TEXT_TABLE = 'bench_transactions_text'
+CODE_TABLE = 'bench_transactions_codes'
+
+GROUP_BY = (
+    "SELECT category, SUM(amount) AS total FROM {table} "
+    "WHERE user_id = %s AND transaction_type = %s AND category IS NOT NULL GROUP BY category"
+)
+
+
+def _choice_text(column):
+    field = Transaction._meta.get_field(column)
+    whens = ' '.join(f"WHEN {field.code(value)} THEN '{value}'" for value in field.choice_values)
+    return f"CASE t.{column} {whens} END AS {column}"
+
+
+def _index_sql(table):
+    for index in Transaction._meta.indexes:
+        columns = ', '.join(
+            f"{Transaction._meta.get_field(name.lstrip('-')).column}{' DESC' if name.startswith('-') else ''}"
+            for name in index.fields
+        )
+        yield f"{table}_{index.name}", f"CREATE INDEX {table}_{index.name} ON {table} ({columns})"
+
+
+def _copy(fixtures, table, columns):
+    """Copy the fixture rows into ``table`` as ``columns`` and index it, once; returns its index names"""
+    fixtures.user
+    indexes = list(_index_sql(table))
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            cursor.execute(
+                f"CREATE TABLE {table} AS SELECT t.id, t.user_id, t.transaction_id, {columns}, t.amount, "
+                f"t.description, t.recipient_email, t.sender_email, t.counterparty_id, t.created_at, t.seq "
+                f"FROM {Transaction._meta.db_table} t "
+                f"LEFT JOIN {TransactionCategory._meta.db_table} c ON c.id = t.category ORDER BY t.id"
+            )
+            for name, sql in indexes:
+                cursor.execute(sql)
+    return [name for name, sql in indexes]
+
+
+def _bytes(names):
+    """Bytes taken by the named tables and indexes, or None where the database cannot tell"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({', '.join(['%s'] * len(names))})", names)
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT SUM(pg_relation_size(quote_ident(name))) FROM unnest(%s) AS name", [names])
+        else:
+            return None
+        return cursor.fetchone()[0]
+
+
+def _group_by(fixtures, table, indexes, sql, params):
+    def run():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+    return run, {'rows': fixtures.rows, 'table_bytes': _bytes([table]), 'index_bytes': _bytes(indexes)}
+
+
+@benchmark('group_by_text', number=20)
+def bench_group_by_text(fixtures):
+    columns = f"{_choice_text('transaction_type')}, {_choice_text('status')}, c.name AS category"
+    indexes = _copy(fixtures, TEXT_TABLE, columns)
+    return _group_by(fixtures, TEXT_TABLE, indexes, GROUP_BY.format(table=TEXT_TABLE), [fixtures.user.pk, 'expense'])
+
+
+@benchmark('group_by_codes', number=20)
+def bench_group_by_codes(fixtures):
+    indexes = _copy(fixtures, CODE_TABLE, 't.transaction_type, t.status, t.category')
+    code = Transaction._meta.get_field('transaction_type').code('expense')
+    # Names come from the lookup table, as the category field maps them
+    sql = (
+        f"SELECT c.name, g.total FROM ({GROUP_BY.format(table=CODE_TABLE)}) AS g "
+        f"JOIN {TransactionCategory._meta.db_table} c ON c.id = g.category"
+    )
+    return _group_by(fixtures, CODE_TABLE, indexes, sql, [fixtures.user.pk, code])
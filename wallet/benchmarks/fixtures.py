@@ -0,0 +1,79 @@
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from functools import cached_property
+
+from django.test import RequestFactory
+from django.utils import timezone
+
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from wallet.management.commands.seed_wallet_data import preserve_timestamps
+from wallet.models import Transaction
+from wallet.schemas import TransactionSchema
+
+
+CATEGORIES = ['Food', 'Transport', 'Airtime', 'Shopping', 'Utilities', None]
+TRANSACTION_TYPES = ['income', 'expense', 'expense', 'expense', 'transfer_in', 'transfer_out']
+
+
+class BenchmarkFixtures:
+    """Deterministic data shared by all benchmark suites, created lazily in the test database"""
+
+    email = 'bench@example.com'
+    page_size = 500
+
+    def __init__(self, rows=1000, seed=0):
+        self.rows = rows
+        self.seed = seed
+        self.factory = RequestFactory()
+
+    @cached_property
+    def user(self):
+        user = User.objects.create_user(
+            email=self.email, password='benchmark-password',
+            first_name='Bench', last_name='Mark',
+        )
+        self._create_transactions(user)
+        return user
+
+    def _create_transactions(self, user):
+        rng = random.Random(self.seed)
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        transactions = []
+        for _ in range(self.rows):
+            transaction_type = rng.choice(TRANSACTION_TYPES)
+            transactions.append(Transaction(
+                user=user,
+                transaction_id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                transaction_type=transaction_type,
+                amount=Decimal(rng.randint(100, 5_000_000)).scaleb(-2),
+                description=f"Benchmark {transaction_type}",
+                category=rng.choice(CATEGORIES),
+                recipient_email='merchant@example.com' if transaction_type == 'transfer_out' else None,
+                sender_email='friend@example.com' if transaction_type == 'transfer_in' else None,
+                created_at=today - timedelta(seconds=rng.randrange(180 * 24 * 3600)),
+            ))
+        with preserve_timestamps(Transaction):
+            Transaction.objects.bulk_create(transactions, batch_size=1000)
+
+    @cached_property
+    def access_token(self):
+        return generate_access_token(self.user)
+
+    def request(self, path='/api/', **extra):
+        """A GET request authenticated as the fixture user, as Ninja hands it to views"""
+        request = self.factory.get(path, HTTP_AUTHORIZATION=f"Bearer {self.access_token}", **extra)
+        request.auth = self.user
+        return request
+
+    @cached_property
+    def transaction_page(self):
+        """One page of transactions, prepared the way ``list_transactions`` returns them"""
+        return list(Transaction.objects.filter(user=self.user)[:self.page_size])
+
+    @cached_property
+    def transaction_values_page(self):
+        """The same page as ``.values()`` rows, as the fast path in ``list_transactions`` reads it"""
+        return list(Transaction.objects.filter(user=self.user).values(*TransactionSchema.model_fields)[:self.page_size])
@@ -0,0 +1,64 @@
+"""Encode time and payload size of JSON against MessagePack for the largest responses"""
+import gzip
+
+from pydantic import TypeAdapter
+
+from ethnosdemo.renderers import render_response, values_response
+from wallet.api import get_dashboard
+from wallet.schemas import DashboardSchema
+
+from . import benchmark
+
+
+MSGPACK = {'HTTP_ACCEPT': 'application/msgpack'}
+
+
+def _sizes(response):
+    return {
+        'content_type': response['Content-Type'],
+        'bytes': len(response.content),
+        'gzip_bytes': len(gzip.compress(response.content)),
+    }
+
+
+def _transactions(fixtures, **headers):
+    request = fixtures.request('/api/wallet/transactions', **headers)
+    rows = fixtures.transaction_values_page
+
+    def encode():
+        # values_response converts rows in place, so give it fresh ones each time
+        return values_response(request, [row.copy() for row in rows])
+
+    return encode, {'rows': len(rows), **_sizes(encode())}
+
+
+def _dashboard(fixtures, **headers):
+    request = fixtures.request('/api/wallet/dashboard', **headers)
+    adapter = TypeAdapter(DashboardSchema)
+    # What Ninja hands the renderer after validating the view's result
+    data = adapter.dump_python(adapter.validate_python(get_dashboard(request), from_attributes=True))
+
+    def encode():
+        return render_response(request, data)
+
+    return encode, _sizes(encode())
+
+
+@benchmark('transactions_json', number=5)
+def bench_transactions_json(fixtures):
+    return _transactions(fixtures)
+
+
+@benchmark('transactions_msgpack', number=5)
+def bench_transactions_msgpack(fixtures):
+    return _transactions(fixtures, **MSGPACK)
+
+
+@benchmark('dashboard_json', number=100)
+def bench_dashboard_json(fixtures):
+    return _dashboard(fixtures)
+
+
+@benchmark('dashboard_msgpack', number=100)
+def bench_dashboard_msgpack(fixtures):
+    return _dashboard(fixtures, **MSGPACK)
@@ -0,0 +1,82 @@
+"""Functions that dominate CPU time in request handling"""
+from typing import List
+
+from django.test import override_settings
+from ninja.renderers import JSONRenderer
+from pydantic import TypeAdapter
+
+from accounts.auth import JWTAuth
+from ethnosdemo.renderers import values_response
+from accounts.jwt_utils import decode_token, generate_access_token
+from wallet.api import generate_qr_code_image, get_statistics
+from wallet.schemas import TransactionSchema
+
+from . import benchmark
+
+
+QR_PAYLOAD = 'bench@example.com:6f1c7a52-8a9e-4b5b-9a55-1f0c2d3e4f50'
+
+
+@benchmark('generate_qr_code_image', number=20)
+def bench_generate_qr_code_image(fixtures):
+    return lambda: generate_qr_code_image(QR_PAYLOAD)
+
+
+@benchmark('generate_access_token', number=1000)
+def bench_generate_access_token(fixtures):
+    user = fixtures.user
+    return lambda: generate_access_token(user)
+
+
+@benchmark('decode_token', number=1000)
+def bench_decode_token(fixtures):
+    token = fixtures.access_token
+    return lambda: decode_token(token)
+
+
+@benchmark('jwt_auth_authenticate', number=200)
+def bench_jwt_auth_authenticate(fixtures):
+    auth = JWTAuth()
+    request = fixtures.request()
+    token = fixtures.access_token
+    return lambda: auth.authenticate(request, token)
+
+
+@benchmark('get_statistics', number=5)
+def bench_get_statistics(fixtures):
+    # The aggregate queries, whatever the column cache is configured to
+    request = fixtures.request('/api/wallet/stats')
+    stats = override_settings(TRANSACTION_COLUMN_CACHE_BYTES=0)(get_statistics)
+    return lambda: stats(request, months=6), {'rows': fixtures.rows}
+
+
+@benchmark('get_statistics_columns', number=5)
+def bench_get_statistics_columns(fixtures):
+    # The column cache, loaded by the warmup calls; the first call pays for loading
+    request = fixtures.request('/api/wallet/stats')
+    stats = override_settings(TRANSACTION_COLUMN_CACHE_BYTES=64 * 1024 * 1024)(get_statistics)
+    return lambda: stats(request, months=6), {'rows': fixtures.rows}
+
+
+@benchmark('serialize_transaction_page', number=5)
+def bench_serialize_transaction_page(fixtures):
+    page = fixtures.transaction_page
+    adapter = TypeAdapter(List[TransactionSchema])
+    renderer = JSONRenderer()
+
+    def serialize():
+        data = adapter.dump_python(adapter.validate_python(page, from_attributes=True))
+        return renderer.render(None, data, response_status=200)
+
+    return serialize, {'rows': len(page)}
+
+
+@benchmark('serialize_transaction_values_page', number=5)
+def bench_serialize_transaction_values_page(fixtures):
+    rows = fixtures.transaction_values_page
+
+    def serialize():
+        # values_response converts rows in place, so give it fresh ones each time
+        return values_response(None, [row.copy() for row in rows]).content
+
+    return serialize, {'rows': len(rows)}
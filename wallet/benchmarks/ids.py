@@ -0,0 +1,65 @@
+"""
+Generation cost and insert throughput of random (v4) against time-ordered (v7)
+transaction ids.
+
+Each insert benchmark writes batches of new ids into its own scratch table
+with a unique index on a ``transaction_id`` column like ``Transaction``'s.
+The tables are first filled with ``PRELOAD`` ids of the same kind, so the
+index is larger than the pages a batch touches.
+"""
+import uuid
+
+from django.db import connection, transaction
+
+from wallet.ids import uuid7
+from wallet.models import Transaction
+
+from . import benchmark
+
+
+PRELOAD = 200_000
+BATCH = 1000
+
+
+def _table(name, generate):
+    """Create and fill a scratch table of ids from ``generate``, once; returns the insert statement"""
+    field = Transaction._meta.get_field('transaction_id')
+    with connection.cursor() as cursor:
+        if name not in connection.introspection.table_names(cursor):
+            cursor.execute(f"CREATE TABLE {name} (transaction_id {field.db_type(connection)} NOT NULL UNIQUE)")
+            sql = f"INSERT INTO {name} (transaction_id) VALUES (%s)"
+            for start in range(0, PRELOAD, 10000):
+                cursor.executemany(sql, [(field.get_db_prep_value(generate(), connection),) for _ in range(10000)])
+    return f"INSERT INTO {name} (transaction_id) VALUES (%s)"
+
+
+def _insert(name, generate):
+    field = Transaction._meta.get_field('transaction_id')
+    sql = _table(name, generate)
+
+    def insert():
+        rows = [(field.get_db_prep_value(generate(), connection),) for _ in range(BATCH)]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    return insert, {'batch': BATCH, 'preloaded': PRELOAD}
+
+
+@benchmark('generate_uuid4', number=10000)
+def bench_generate_uuid4(fixtures):
+    return uuid.uuid4
+
+
+@benchmark('generate_uuid7', number=10000)
+def bench_generate_uuid7(fixtures):
+    return uuid7
+
+
+@benchmark('insert_uuid4', number=5, warmup=2)
+def bench_insert_uuid4(fixtures):
+    return _insert('bench_ids_uuid4', uuid.uuid4)
+
+
+@benchmark('insert_uuid7', number=5, warmup=2)
+def bench_insert_uuid7(fixtures):
+    return _insert('bench_ids_uuid7', uuid7)
@@ -0,0 +1,342 @@
+"""
+Optional in-memory columnar cache of users' transaction histories, for analytics.
+
+Each cached user's history (hot and archived) is held as five ``array.array``
+columns: id, creation time in microseconds since the epoch, amount in minor
+units, a type code and a category code, with the user's own table of category
+names. That is 29 bytes a transaction, where a model instance takes well over a
+kilobyte. Statistics are computed over NumPy views of those columns, without
+copying them and without touching the database, and are returned in exactly
+the form the query path in ``get_statistics`` returns them.
+
+* A user's columns are loaded on first use, from the same database the request
+  reads.
+* Transactions saved or deleted in this process are applied as they commit.
+* Before each use, the columns catch up with writes made anywhere else (other
+  workers, bulk loads) from the sync change feed: hot rows and tombstones whose
+  ``seq`` is past the newest change already applied (see wallet/sync.py). This
+  costs one indexed query when the user's change version has moved, and none
+  otherwise.
+* Users are evicted least recently used first, keeping the total under
+  ``TRANSACTION_COLUMN_CACHE_BYTES``. A history larger than the whole budget is
+  not cached. The budget is 0, which turns the cache off, unless configured.
+
+The cache is per process. Every worker holds the histories of the users it
+serves.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import transaction_sources
+from .models import Transaction
+from .reconcile import DECIMAL_PLACES
+from .sync import KINDS
+from .versioning import current_version
+
+TYPE_CODES = {kind: code for code, (kind, label) in enumerate(Transaction.TRANSACTION_TYPES)}
+CREDIT_CODES = [TYPE_CODES[kind] for kind in Transaction.CREDIT_TYPES]
+NO_CATEGORY = -1
+
+# (attribute, array typecode, NumPy dtype)
+COLUMNS = (
+    ('ids', 'q', np.int64),
+    ('created', 'q', np.int64),
+    ('amounts', 'q', np.int64),
+    ('types', 'b', np.int8),
+    ('categories', 'i', np.int32),
+)
+ROW_FIELDS = ('id', 'created_at', 'amount', 'transaction_type', 'category', 'seq')
+ROW_BYTES = sum(array(typecode).itemsize for name, typecode, dtype in COLUMNS)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class CategoryCodes:
+    """Dictionary encoding of one user's category names; goes with their columns"""
+
+    def __init__(self):
+        self.names = []
+        self._codes = {}
+
+    def code(self, name):
+        if name is None:
+            return NO_CATEGORY
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+
+def _micros(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def _minor(amount):
+    return int(amount.scaleb(DECIMAL_PLACES))
+
+
+def _amount(minor):
+    """A sum in minor units as the query path has it: ``Decimal('0')`` when nothing was summed (None)"""
+    if minor is None:
+        return Decimal('0')
+    return Decimal(int(minor)).scaleb(-DECIMAL_PLACES)
+
+
+def _sums(values, counts):
+    return [int(value) if count else None for value, count in zip(values, counts)]
+
+
+class TransactionColumns:
+    """One user's history as parallel columns, plus the change feed position they reflect"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        for name, typecode, dtype in COLUMNS:
+            setattr(self, name, array(typecode))
+        self.category_codes = CategoryCodes()
+        # Newest change (row or tombstone seq) applied, and the user's change version last checked
+        self.seq = 0
+        self.version = None
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).itemsize * len(getattr(self, name)) for name, typecode, dtype in COLUMNS)
+
+    def view(self, name):
+        """Zero-copy NumPy view of a column; do not keep it past the next append"""
+        column = getattr(self, name)
+        dtype = next(dtype for attribute, typecode, dtype in COLUMNS if attribute == name)
+        return np.frombuffer(column, dtype=dtype) if len(column) else np.empty(0, dtype=dtype)
+
+    def _encode(self, row):
+        pk, created_at, amount, transaction_type, category = row[:5]
+        category = self.category_codes.code(category)
+        return pk, _micros(created_at), _minor(amount), TYPE_CODES[transaction_type], category
+
+    def extend(self, rows):
+        for row in rows:
+            for (name, typecode, dtype), value in zip(COLUMNS, self._encode(row)):
+                getattr(self, name).append(value)
+
+    def upsert(self, rows):
+        """Add rows, overwriting those already present (updated, or applied before)"""
+        if not rows:
+            return
+        ids = self.view('ids')
+        present = np.flatnonzero(np.isin(ids, [row[0] for row in rows]))
+        positions = dict(zip(ids[present].tolist(), present.tolist()))
+        del ids
+        new = []
+        for row in rows:
+            index = positions.get(row[0])
+            if index is None:
+                new.append(row)
+                continue
+            for (name, typecode, dtype), value in zip(COLUMNS, self._encode(row)):
+                getattr(self, name)[index] = value
+        self.extend(new)
+
+    def remove(self, ids):
+        if not ids:
+            return
+        keep = ~np.isin(self.view('ids'), list(ids))
+        if not keep.all():
+            for name, typecode, dtype in COLUMNS:
+                setattr(self, name, array(typecode, self.view(name)[keep].tobytes()))
+
+
+class ColumnCache:
+    """Per-process LRU of ``TransactionColumns`` under a byte budget"""
+
+    def __init__(self, budget=None):
+        self._budget = budget
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def budget(self):
+        return settings.TRANSACTION_COLUMN_CACHE_BYTES if self._budget is None else self._budget
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, entry):
+        with self._lock:
+            self._entries[entry.user_id] = entry
+            self._entries.move_to_end(entry.user_id)
+        self.shrink()
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def shrink(self):
+        """Evict least recently used users until the cache fits its budget"""
+        with self._lock:
+            total = sum(entry.nbytes for entry in self._entries.values())
+            while self._entries and total > self.budget:
+                user_id, entry = self._entries.popitem(last=False)
+                total -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ColumnCache()
+
+
+def _load(user, entry):
+    """Fill a new entry with the user's whole history; returns False if it is over the budget"""
+    entry.version = current_version(user)
+    entry.seq = entry.version or 0
+    for source in transaction_sources(user):
+        if (len(entry.ids) + source.count()) * ROW_BYTES > cache.budget:
+            return False
+        entry.extend(source.order_by().values_list(*ROW_FIELDS).iterator(chunk_size=5000))
+    return True
+
+
+def _catch_up(user, entry):
+    """Apply changes made since the entry was last brought up to date, by any process"""
+    version = current_version(user)
+    if version == entry.version:
+        return
+    # Rows are only created, changed and deleted in the hot table; archiving keeps their seq
+    rows = list(user.transactions.filter(seq__gt=entry.seq).order_by().values_list(*ROW_FIELDS))
+    tombstones = list(user.tombstones.filter(kind=KINDS[Transaction], seq__gt=entry.seq).values_list('object_id', 'seq'))
+    deleted = {object_id for object_id, seq in tombstones}
+    entry.upsert([row for row in rows if row[0] not in deleted])
+    entry.remove(deleted)
+    entry.seq = max([entry.seq, *(row[-1] for row in rows), *(seq for object_id, seq in tombstones)])
+    entry.version = version
+
+
+def transaction_columns(user):
+    """
+    Up-to-date columns of the user's history, or None when the cache is off or
+    the history does not fit. Hold ``entry.lock`` while reading them.
+    """
+    if cache.budget <= 0:
+        return None
+    entry = cache.get(user.pk)
+    if entry is None:
+        entry = TransactionColumns(user.pk)
+        with entry.lock:
+            if not _load(user, entry):
+                return None
+        cache.put(entry)
+        return entry
+    with entry.lock:
+        _catch_up(user, entry)
+    cache.shrink()
+    return entry
+
+
+def note_saved(txn):
+    """Apply a committed save of a transaction to its owner's cached columns, if any"""
+    entry = cache.get(txn.user_id)
+    if entry is not None:
+        with entry.lock:
+            row = [getattr(txn, field) for field in ROW_FIELDS]
+            # Unsaved-then-saved instances hold whatever amount they were given
+            row[2] = Decimal(str(row[2]))
+            entry.upsert([tuple(row)])
+
+
+def note_deleted(txn):
+    entry = cache.get(txn.user_id)
+    if entry is not None:
+        with entry.lock:
+            entry.remove({txn.pk})
+
+
+def _month_starts(start, end):
+    """Local midnights starting each month from the one holding ``start`` to the one after ``end``"""
+    current = timezone.localtime(start).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    starts = []
+    while True:
+        starts.append(current)
+        if current > end:
+            return starts
+        year, month = divmod(current.month, 12)
+        current = timezone.make_aware(datetime(current.year + year, month + 1, 1))
+
+
+def _statistics(entry, start):
+    # NumPy views pin the columns' buffers, so they must all be gone before the lock is released
+    created, amounts = entry.view('created'), entry.view('amounts')
+    types, category_codes = entry.view('types'), entry.view('categories')
+    credit = np.isin(types, CREDIT_CODES)
+    income, expense = _sums([amounts[credit].sum(), amounts[~credit].sum()], [credit.any(), (~credit).any()])
+    totals = {'income': income, 'expense': expense}
+
+    monthly = []
+    recent = created >= _micros(start)
+    if recent.any():
+        starts = _month_starts(start, EPOCH + timedelta(microseconds=int(created[recent].max())))
+        month = np.searchsorted([_micros(moment) for moment in starts], created[recent], side='right') - 1
+        recent_credit = credit[recent]
+        income = np.zeros(len(starts), dtype=np.int64)
+        expense = np.zeros(len(starts), dtype=np.int64)
+        np.add.at(income, month[recent_credit], amounts[recent][recent_credit])
+        np.add.at(expense, month[~recent_credit], amounts[recent][~recent_credit])
+        incomes = _sums(income, np.bincount(month[recent_credit], minlength=len(starts)))
+        expenses = _sums(expense, np.bincount(month[~recent_credit], minlength=len(starts)))
+        monthly = [(starts[index], incomes[index], expenses[index]) for index in np.unique(month)]
+
+    spent = (types == TYPE_CODES['expense']) & (category_codes != NO_CATEGORY)
+    names = entry.category_codes.names
+    by_category = np.zeros(len(names), dtype=np.int64)
+    np.add.at(by_category, category_codes[spent], amounts[spent])
+    spending = [(names[code], int(by_category[code])) for code in np.unique(category_codes[spent])]
+    return totals, monthly, spending
+
+
+def column_statistics(user, months=6):
+    """The ``/wallet/stats`` figures computed from the user's cached columns, or None if they are not cached"""
+    entry = transaction_columns(user)
+    if entry is None:
+        return None
+    start = timezone.make_aware(datetime.now() - timedelta(days=30 * months))
+    with entry.lock:
+        totals, monthly, spending = _statistics(entry, start)
+
+    top_categories = sorted(spending, key=lambda item: (-item[1], item[0]))[:5]
+    total_income, total_expense = _amount(totals['income']), _amount(totals['expense'])
+    return {
+        "total_income": total_income,
+        "total_expense": total_expense,
+        "net_balance": total_income - total_expense,
+        "monthly_stats": [
+            {
+                "month": month.strftime('%Y-%m'),
+                "income": _amount(income),
+                "expense": _amount(expense),
+                "net": _amount(income) - _amount(expense),
+            }
+            for month, income, expense in monthly
+        ],
+        "top_categories": [{"category": category, "total": _amount(total)} for category, total in top_categories],
+    }
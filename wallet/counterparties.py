@@ -0,0 +1,137 @@
+"""
+Who a user transfers money with.
+
+Every transfer row records the other user in ``counterparty`` (the recipient
+of a ``transfer_out``, the sender of a ``transfer_in``), so a user's history
+with one person is an index range on (user, counterparty, created_at).
+
+``Counterparty`` holds one row of running totals per (user, other user) pair,
+on the owner's shard. ``record_transfer`` adds each transfer to it in the same
+transaction as the transfer row, so ``/wallet/counterparties`` reads at most
+``limit`` rows from an index instead of aggregating the history.
+
+Rows written before the column existed are filled by ``python manage.py
+backfill_counterparties``: ``backfill_transfer_parties`` resolves their email
+addresses a batch at a time, then ``rebuild_counterparties`` recomputes the
+totals from the transactions.
+"""
+import time
+
+from django.db import connections, transaction, IntegrityError
+from django.db.models import Case, F, Q, Value, When
+
+from accounts.models import User
+from .models import Counterparty, Transaction, ArchivedTransaction
+from .reconcile import user_id_bounds
+
+TRANSFER_TYPES = ('transfer_out', 'transfer_in')
+
+
+def record_transfer(using, user_id, counterparty_id, amount, *, sent, at):
+    """Add one transfer to the user's totals with a counterparty; call inside the transfer's transaction"""
+    prefix = 'sent' if sent else 'received'
+    changes = {
+        f'{prefix}_total': F(f'{prefix}_total') + amount,
+        f'{prefix}_count': F(f'{prefix}_count') + 1,
+        'last_transfer_at': at,
+    }
+    pairs = Counterparty.objects.using(using).filter(user_id=user_id, counterparty_id=counterparty_id)
+    if pairs.update(**changes):
+        return
+    try:
+        with transaction.atomic(using=using):
+            Counterparty.objects.using(using).create(
+                user_id=user_id, counterparty_id=counterparty_id, last_transfer_at=at,
+                **{f'{prefix}_total': amount, f'{prefix}_count': 1},
+            )
+    except IntegrityError:
+        # A concurrent first transfer between the pair created the row
+        pairs.update(**changes)
+
+
+def _transfers_sql(model):
+    field = Transaction._meta.get_field('transaction_type')
+    sent, received = (field.code(kind) for kind in TRANSFER_TYPES)
+    return (
+        f"SELECT user_id, counterparty_id, "
+        f"CASE WHEN transaction_type = {sent} THEN amount ELSE 0 END AS sent, "
+        f"CASE WHEN transaction_type = {sent} THEN 1 ELSE 0 END AS sent_count, "
+        f"CASE WHEN transaction_type = {received} THEN amount ELSE 0 END AS received, "
+        f"CASE WHEN transaction_type = {received} THEN 1 ELSE 0 END AS received_count, "
+        f"created_at FROM {model._meta.db_table} "
+        f"WHERE user_id >= %s AND user_id < %s AND counterparty_id IS NOT NULL "
+        f"AND transaction_type IN ({sent}, {received})"
+    )
+
+
+def rebuild_counterparties(using, low, high):
+    """Recompute the counterparty totals of users ``low <= user_id < high`` from their transactions"""
+    table = Counterparty._meta.db_table
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Transfers committing meanwhile wait, then add to the rebuilt rows
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"DELETE FROM {table} WHERE user_id >= %s AND user_id < %s", [low, high])
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, counterparty_id, sent_total, sent_count, received_total, "
+            f"received_count, last_transfer_at) "
+            f"SELECT user_id, counterparty_id, ROUND(SUM(sent), 2), SUM(sent_count), ROUND(SUM(received), 2), "
+            f"SUM(received_count), MAX(created_at) "
+            f"FROM ({_transfers_sql(Transaction)} UNION ALL {_transfers_sql(ArchivedTransaction)}) AS transfers "
+            f"GROUP BY user_id, counterparty_id",
+            [low, high, low, high],
+        )
+        return cursor.rowcount
+
+
+def rebuild_all_counterparties(using, range_size=50000):
+    """Recompute every counterparty total on one database, a user id range per transaction; returns rows written"""
+    bounds = user_id_bounds(using)
+    if bounds is None:
+        return 0
+    low, high = bounds
+    return sum(
+        rebuild_counterparties(using, start, min(start + range_size, high + 1))
+        for start in range(low, high + 1, range_size)
+    )
+
+
+def _fill_batch(model, using, rows):
+    """Set ``counterparty`` on one batch of ``(id, type, recipient_email, sender_email)`` rows; returns rows set"""
+    emails = {recipient if kind == 'transfer_out' else sender for pk, kind, recipient, sender in rows} - {None}
+    # Users all live on the default database; addresses of deleted users stay unresolved
+    user_ids = dict(User.objects.using('default').filter(email__in=emails).values_list('email', 'id'))
+    if not user_ids:
+        return 0
+    whens = [
+        When(Q(transaction_type='transfer_out', recipient_email=email) |
+             Q(transaction_type='transfer_in', sender_email=email), then=Value(user_id))
+        for email, user_id in user_ids.items()
+    ]
+    return model.objects.using(using).filter(pk__in=[row[0] for row in rows], counterparty__isnull=True).update(
+        counterparty=Case(*whens, default=None)
+    )
+
+
+def backfill_transfer_parties(model, using, batch_size=1000, pause=0.0):
+    """
+    Fill ``counterparty`` on a database's transfer rows of ``model`` that lack
+    it, in batches of ``batch_size`` by id, each its own short write. Returns
+    ``(scanned, filled)``.
+    """
+    rows = model.objects.using(using).filter(transaction_type__in=TRANSFER_TYPES, counterparty__isnull=True)
+    scanned = filled = 0
+    last_id = None
+    while True:
+        batch = rows if last_id is None else rows.filter(pk__gt=last_id)
+        batch = list(batch.order_by('pk').values_list('pk', 'transaction_type', 'recipient_email', 'sender_email')
+                     [:batch_size])
+        if not batch:
+            return scanned, filled
+        filled += _fill_batch(model, using, batch)
+        scanned += len(batch)
+        last_id = batch[-1][0]
+        if pause:
+            # Give request traffic a turn at the write lock between batches
+            time.sleep(pause)
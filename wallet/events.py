@@ -0,0 +1,53 @@
+"""
+Live wallet events for the ``/api/wallet/events`` server-sent event stream.
+
+Every committed ``Transaction`` is published to its owner's channel as a
+``transaction`` event, followed by a ``balance`` event with the wallet balance
+after the commit. A transfer therefore reaches both the sender's and the
+recipient's streams, on whichever shard each of them lives. Nothing is read
+or serialized for users with no open stream.
+"""
+import asyncio
+
+from django.conf import settings
+
+from ethnosdemo import pubsub
+from ethnosdemo.renderers import dumps
+from .models import Wallet
+from .schemas import TransactionSchema
+
+
+def user_channel(user_id):
+    return f"wallet:{user_id}"
+
+
+def sse_event(event, data):
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), dumps(data))
+
+
+def publish_transaction(txn):
+    """Push a committed transaction and the resulting balance to its owner's streams"""
+    channel = user_channel(txn.user_id)
+    if not pubsub.has_subscribers(channel):
+        return
+    pubsub.publish(channel, sse_event('transaction', TransactionSchema.model_validate(txn).model_dump()))
+    wallet = Wallet.objects.using(txn._state.db).filter(user_id=txn.user_id).values('balance', 'currency').first()
+    if wallet:
+        pubsub.publish(channel, sse_event('balance', wallet))
+
+
+async def event_stream(user):
+    """The user's events as SSE frames: current balance first, then changes as they commit"""
+    async with pubsub.subscribe(user_channel(user.pk)) as messages:
+        # Subscribed before reading, so no change can fall between the two
+        wallet = await Wallet.objects.db_manager(hints={'instance': user}).filter(
+            user_id=user.pk
+        ).values('balance', 'currency').afirst()
+        if wallet:
+            yield sse_event('balance', wallet)
+        while True:
+            try:
+                yield await asyncio.wait_for(messages.get(), settings.SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection and lets us notice a gone client
+                yield b": keep-alive\n\n"
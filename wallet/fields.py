@@ -0,0 +1,165 @@
+"""
+Compact storage for the categorical columns of transactions.
+
+Both fields keep a string value everywhere in Python: on instances, in
+lookups, in ``.values()`` rows and so in the API schemas. Rows and their
+indexes store a small integer instead.
+
+* ``ChoiceCodeField`` stores the position of the value in the field's fixed
+  ``choices`` (``transaction_type``, ``status``). New choices must be appended,
+  never inserted or reordered.
+* ``DictionaryField`` stores the id of the value's row in a lookup table
+  (``category`` -> ``TransactionCategory``), one dictionary per database. A row
+  is added the first time a value is saved. Rows are never changed or deleted.
+
+Filtering on a value that has no code matches nothing. Raw SQL sees the
+integers, so use ``ChoiceCodeField.code()`` or join the lookup table.
+"""
+import threading
+
+from django import forms
+from django.db import connections, models, transaction
+
+# Lookup parameter of a value without a code; no row stores it
+NO_MATCH = -1
+
+
+class StringValueMixin:
+    """An integer column holding string values: no numeric range validators or number inputs"""
+
+    @property
+    def validators(self):
+        return [*self.default_validators, *self._validators]
+
+    def to_python(self, value):
+        return value
+
+    def get_prep_value(self, value):
+        return value
+
+
+class ChoiceCodeField(StringValueMixin, models.PositiveSmallIntegerField):
+    """A choice stored as its index in ``choices``"""
+
+    def __init__(self, *args, choices, **kwargs):
+        super().__init__(*args, choices=choices, **kwargs)
+        self.choice_values = [value for value, label in self.choices]
+        self.codes = {value: code for code, value in enumerate(self.choice_values)}
+
+    def code(self, value):
+        """The stored code of a choice, for raw SQL"""
+        return self.codes[value]
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else self.choice_values[value]
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            return self.codes.get(value, NO_MATCH)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, str) and value not in self.codes:
+            raise ValueError(f"{value!r} is not one of the choices of {self.model.__name__}.{self.name}")
+        return super().get_db_prep_save(value, connection)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'wallet.fields.ChoiceCodeField', args, kwargs
+
+
+class Dictionary:
+    """Cached ``value <-> id`` pairs of one lookup table on one database; only committed rows are cached"""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = {}
+        self.loaded = False
+
+    def remember(self, pairs, using):
+        def remember():
+            for pk, value in pairs:
+                self.ids[value] = pk
+                self.values[pk] = value
+        # A row created or read inside a transaction that rolls back must not be
+        # cached: SQLite hands its id out again
+        transaction.on_commit(remember, using=using)
+
+
+class DictionaryField(StringValueMixin, models.PositiveIntegerField):
+    """A string stored as the id of its row in the lookup model ``to`` (a ``name`` column)"""
+
+    def __init__(self, *args, to, **kwargs):
+        self.to = to
+        super().__init__(*args, **kwargs)
+        self._dictionaries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def lookup_model(self):
+        return self.model._meta.apps.get_model(self.to)
+
+    def dictionary(self, connection):
+        # Keyed by the database name too, as tests swap the database behind an alias
+        key = (connection.alias, connection.settings_dict['NAME'])
+        with self._lock:
+            dictionary = self._dictionaries.get(key)
+            if dictionary is None:
+                dictionary = self._dictionaries[key] = Dictionary()
+        if not dictionary.loaded and not connection.in_atomic_block:
+            # The table is small; outside a transaction every row read is committed
+            dictionary.remember(list(self.lookup_model.objects.using(connection.alias).values_list('id', 'name')),
+                                connection.alias)
+            dictionary.loaded = True
+        return dictionary
+
+    def intern(self, values, using):
+        """Give each value a row on the ``using`` database, ahead of saving it; returns their ids"""
+        connection = connections[using]
+        return {value: self._id(value, connection, create=True) for value in values}
+
+    def _id(self, value, connection, create):
+        dictionary = self.dictionary(connection)
+        pk = dictionary.ids.get(value)
+        if pk is not None:
+            return pk
+        rows = self.lookup_model.objects.using(connection.alias)
+        if create:
+            pk = rows.get_or_create(name=value)[0].pk
+        else:
+            pk = rows.filter(name=value).values_list('id', flat=True).first()
+            if pk is None:
+                return NO_MATCH
+        dictionary.remember([(pk, value)], connection.alias)
+        return pk
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        dictionary = self.dictionary(connection)
+        name = dictionary.values.get(value)
+        if name is None:
+            rows = self.lookup_model.objects.using(connection.alias).filter(pk=value)
+            name = rows.values_list('name', flat=True).first()
+            if name is not None:
+                dictionary.remember([(value, name)], connection.alias)
+        return name
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            return self._id(value, connection, create=False)
+        return value
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, str):
+            return self._id(value, connection, create=True)
+        return value
+
+    def formfield(self, **kwargs):
+        max_length = self.lookup_model._meta.get_field('name').max_length
+        return models.Field.formfield(self, **{'form_class': forms.CharField, 'max_length': max_length, **kwargs})
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['to'] = self.to
+        return name, 'wallet.fields.DictionaryField', args, kwargs
@@ -0,0 +1,43 @@
+"""
+Move old transactions from the hot table to the archive.
+
+Safe to run while the API is serving traffic: each chunk is its own short
+transaction, and readers switch to the archive by the per-wallet watermark
+that moves in the same transaction. Run it from cron, e.g. nightly.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from wallet.archive import archive_transactions
+
+
+class Command(BaseCommand):
+    help = 'Archive transactions older than TRANSACTION_ARCHIVE_AFTER_DAYS in chunked batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.TRANSACTION_ARCHIVE_AFTER_DAYS,
+                            help='Archive transactions created more than this many days ago')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows moved per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between users, to leave room for request traffic')
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 1:
+            raise CommandError('--older-than-days must be at least 1')
+
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        started = time.perf_counter()
+        total = 0
+        for shard in settings.WALLET_SHARDS:
+            moved = archive_transactions(cutoff, shard, chunk_size=options['chunk_size'], pause=options['pause'])
+            self.stdout.write(f"{shard}: archived {moved} transactions")
+            total += moved
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total} transactions created before {cutoff:%Y-%m-%d %H:%M} "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,43 @@
+"""
+Fill ``counterparty`` on transfers recorded before the column existed, then
+recompute every user's per-counterparty totals from their transfers.
+
+Safe to run while the API is serving traffic: each batch of rows is its own
+short write, new transfers already carry their counterparty, and each user id
+range's totals are rebuilt in one transaction (see wallet/counterparties.py).
+Run it once after migrating; running it again only rebuilds the totals.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wallet.counterparties import backfill_transfer_parties, rebuild_all_counterparties
+from wallet.models import Transaction, ArchivedTransaction
+
+
+class Command(BaseCommand):
+    help = 'Resolve the counterparty of existing transfers by email and rebuild the counterparty totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Transfer rows updated per transaction')
+        parser.add_argument('--range-size', type=int, default=50000, help='User ids whose totals are rebuilt at once')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches, to leave room for request traffic')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['range_size'] < 1:
+            raise CommandError('--batch-size and --range-size must be at least 1')
+
+        started = time.perf_counter()
+        for shard in settings.WALLET_SHARDS:
+            for model in (Transaction, ArchivedTransaction):
+                scanned, filled = backfill_transfer_parties(model, shard, options['batch_size'], options['pause'])
+                self.stdout.write(
+                    f"{shard}: {model._meta.db_table}: resolved {filled} of {scanned} transfers "
+                    f"without a counterparty"
+                )
+            pairs = rebuild_all_counterparties(shard, options['range_size'])
+            self.stdout.write(f"{shard}: rebuilt {pairs} counterparty totals")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled counterparties in {time.perf_counter() - started:.1f}s"))
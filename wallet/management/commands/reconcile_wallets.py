@@ -0,0 +1,111 @@
+"""
+Check that every wallet balance equals the signed sum of its transactions.
+
+User ids on each database are split into ranges of ``--range-size`` and the
+ranges are checked in parallel by ``--workers`` processes (see
+wallet/reconcile.py). Meant to run nightly from cron: it exits with status 1
+when any wallet is out of balance, after printing the worst offenders and,
+with ``--report``, writing every discrepancy to a CSV file.
+"""
+import csv
+import multiprocessing
+import time
+from decimal import Decimal
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from wallet.reconcile import DECIMAL_PLACES, reconcile_range, user_id_bounds
+
+
+def _worker_init():
+    if not apps.ready:
+        django.setup()
+
+
+def _worker_reconcile(args):
+    try:
+        return args, reconcile_range(*args)
+    finally:
+        connections.close_all()
+
+
+def _amount(minor):
+    return None if minor is None else Decimal(minor).scaleb(-DECIMAL_PLACES)
+
+
+class Command(BaseCommand):
+    help = 'Compare every wallet balance with the signed sum of its transactions and report discrepancies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(1, min(8, multiprocessing.cpu_count())),
+                            help='Processes checking user ranges in parallel')
+        parser.add_argument('--range-size', type=int, default=50000, help='User ids per task')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows fetched per round trip')
+        parser.add_argument('--report', help='Write every discrepancy to this CSV file')
+        parser.add_argument('--show', type=int, default=20, help='Discrepancies to print, largest first')
+
+    def handle(self, *args, **options):
+        if options['range_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--range-size and --chunk-size must be at least 1')
+
+        tasks = []
+        for shard in settings.WALLET_SHARDS:
+            bounds = user_id_bounds(shard)
+            if bounds is None:
+                continue
+            low, high = bounds
+            for start in range(low, high + 1, options['range_size']):
+                tasks.append((shard, start, min(start + options['range_size'], high + 1), options['chunk_size']))
+
+        started = time.perf_counter()
+        wallets = rows = 0
+        discrepancies = []
+        for (shard, low, high, chunk_size), result in self._run(tasks, options['workers']):
+            wallets += result[0]
+            rows += result[1]
+            discrepancies += [(shard, *discrepancy) for discrepancy in result[2]]
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Checked {wallets} wallets against {rows} transactions in {elapsed:.1f}s "
+            f"({rows / max(elapsed, 1e-9):,.0f} rows/s)"
+        )
+        if options['report']:
+            self._write_report(options['report'], discrepancies)
+        if not discrepancies:
+            self.stdout.write(self.style.SUCCESS('Every wallet balance matches its transactions'))
+            return
+
+        discrepancies.sort(key=lambda item: -abs((item[2] or 0) - item[3]))
+        self.stdout.write(f"{'shard':<10} {'user':>10} {'balance':>16} {'ledger':>16} {'difference':>16}")
+        for shard, user_id, balance, ledger in discrepancies[:options['show']]:
+            difference = _amount((balance or 0) - ledger)
+            balance = 'no wallet' if balance is None else _amount(balance)
+            self.stdout.write(f"{shard:<10} {user_id:>10} {balance!s:>16} {_amount(ledger)!s:>16} {difference!s:>16}")
+        drift = _amount(sum((balance or 0) - ledger for shard, user_id, balance, ledger in discrepancies))
+        raise CommandError(f"{len(discrepancies)} wallets out of balance, net difference {drift}")
+
+    def _run(self, tasks, workers):
+        if workers == 1 or len(tasks) <= 1:
+            return (_worker_reconcile(task) for task in tasks)
+        # Children must not share the parent's database connections
+        connections.close_all()
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        return self._imap(context, tasks, workers)
+
+    def _imap(self, context, tasks, workers):
+        with context.Pool(processes=min(workers, len(tasks)), initializer=_worker_init) as pool:
+            yield from pool.imap_unordered(_worker_reconcile, tasks)
+
+    def _write_report(self, path, discrepancies):
+        with open(path, 'w', newline='') as report:
+            writer = csv.writer(report)
+            writer.writerow(['shard', 'user_id', 'balance', 'ledger', 'difference'])
+            for shard, user_id, balance, ledger in discrepancies:
+                writer.writerow([shard, user_id, _amount(balance), _amount(ledger), _amount((balance or 0) - ledger)])
+        self.stdout.write(f"Wrote {len(discrepancies)} discrepancies to {path}")
@@ -0,0 +1,36 @@
+"""
+Deliver cross-shard transfer credits left in the outbox.
+
+A transfer between users on different shards is normally credited right after
+the sender's side commits; if that step fails (crash, recipient shard down) the
+entry stays ``pending`` until this command delivers it. Run it from cron, or
+with ``--loop`` as a long-lived worker.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from wallet.services import deliver_pending_transfers
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending cross-shard transfer credits from the transfer outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=5.0,
+                            help='Only retry entries at least this many seconds old, '
+                                 'leaving fresh ones to the inline delivery')
+        parser.add_argument('--limit', type=int, default=1000, help='Entries per shard per pass')
+        parser.add_argument('--loop', action='store_true', help='Keep relaying until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        older_than = timedelta(seconds=options['older_than'])
+        while True:
+            delivered = deliver_pending_transfers(older_than=older_than, limit=options['limit'])
+            if delivered or not options['loop']:
+                self.stdout.write(f"Delivered {delivered} pending transfers")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
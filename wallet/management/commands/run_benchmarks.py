@@ -0,0 +1,103 @@
+import json
+import platform
+import subprocess
+import sys
+import warnings
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from wallet.benchmarks import compare_results, load_suites, run_benchmark
+from wallet.benchmarks.fixtures import BenchmarkFixtures
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Run micro-benchmarks against a throwaway test database and report timings as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help='Suites or benchmark names to run (default: all)')
+        parser.add_argument('--rows', type=int, default=1000,
+                            help='Transactions created for the fixture user')
+        parser.add_argument('--repeat', type=int, default=None, help='Override samples per benchmark')
+        parser.add_argument('--warmup', type=int, default=None, help='Override warmup calls per benchmark')
+        parser.add_argument('--output', type=str, default=None, help='Write JSON results to this file')
+        parser.add_argument('--compare', type=str, default=None,
+                            help='Print the change against a previous JSON results file')
+        parser.add_argument('--list', action='store_true', help='List available benchmarks and exit')
+
+    def handle(self, *args, **options):
+        benchmarks = load_suites()
+        if options['list']:
+            for name in benchmarks:
+                self.stdout.write(name)
+            return
+
+        selected = options['names']
+        if selected:
+            benchmarks = {
+                name: bench for name, bench in benchmarks.items()
+                if name in selected or bench.suite in selected
+            }
+            if not benchmarks:
+                raise CommandError(f"No benchmarks match {', '.join(selected)}")
+
+        # Naive-datetime warnings from the code under test would otherwise flood the output
+        warnings.filterwarnings('ignore', message='DateTimeField .* received a naive datetime',
+                                category=RuntimeWarning)
+
+        # Benchmarks create their fixtures in a test database, never in the real one
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            fixtures = BenchmarkFixtures(rows=options['rows'])
+            results = {}
+            for name, bench in benchmarks.items():
+                results[name] = run_benchmark(bench, fixtures, options['repeat'], options['warmup'])
+                self.stdout.write(
+                    f"{name:<45} {results[name]['median_us']:>12.1f} us/call "
+                    f"(min {results[name]['min_us']:.1f}, stdev {results[name]['stdev_us']:.1f})"
+                )
+                for key, value in results[name].get('extra', {}).items():
+                    self.stdout.write(f"    {key}: {value}")
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'meta': {
+                'commit': _git_commit(),
+                'created_at': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'database': settings.DATABASES['default']['ENGINE'],
+                'rows': options['rows'],
+            },
+            'results': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"\nCompared with {baseline['meta'].get('commit') or options['compare']}:")
+            for name, before, after, change in compare_results(baseline['results'], results):
+                style = self.style.ERROR if change > 5 else self.style.SUCCESS if change < -5 else str
+                self.stdout.write(style(f"{name:<45} {before:>12.1f} -> {after:>12.1f} us ({change:+.1f}%)"))
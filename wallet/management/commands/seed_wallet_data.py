@@ -0,0 +1,477 @@
+"""
+Generate large, realistic wallet datasets for load and scale testing.
+
+Every user's data is produced from its own RNG seeded with ``(seed, email prefix,
+user index)``, so the output is identical whether it is generated by one process or
+split across ``--workers`` processes, and identical between runs with the same
+``--seed`` and ``--end`` date.
+"""
+import multiprocessing
+import random
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+from accounts.models import User
+from wallet.counterparties import rebuild_counterparties
+from wallet.ids import uuid7_at
+from wallet.models import Wallet, Card, Transaction, QRCode
+from wallet.sharding import shard_for_user
+from wallet.sync import sequence_bulk_rows
+
+
+FIRST_NAMES = [
+    'Adaeze', 'Bola', 'Chinedu', 'Deji', 'Emeka', 'Funmi', 'Gbenga', 'Halima',
+    'Ifeoma', 'Jide', 'Kemi', 'Lola', 'Musa', 'Ngozi', 'Ope', 'Tunde',
+]
+LAST_NAMES = [
+    'Adeyemi', 'Bello', 'Chukwu', 'Danjuma', 'Eze', 'Fashola', 'Garba', 'Ibrahim',
+    'Okafor', 'Olawale', 'Onyeka', 'Sanni', 'Usman', 'Yusuf',
+]
+BANKS = ['First Bank', 'GTBank', 'Access Bank', 'Zenith Bank', 'UBA', 'Kuda']
+
+# (category, relative weight, median amount in NGN)
+EXPENSE_CATEGORIES = [
+    ('Food', 30, 4500),
+    ('Transport', 20, 2500),
+    ('Airtime', 15, 1000),
+    ('Shopping', 12, 15000),
+    ('Utilities', 8, 12000),
+    ('Entertainment', 7, 8000),
+    ('Health', 4, 20000),
+    ('Rent', 2, 250000),
+    (None, 2, 3000),
+]
+INCOME_CATEGORIES = ['Salary', 'Freelance', 'Gift', 'Refund']
+SEED_CATEGORIES = [name for name, weight, median in EXPENSE_CATEGORIES if name] + INCOME_CATEGORIES + ['Transfer']
+
+# Share of generated transactions per kind; the remainder are plain expenses
+INCOME_SHARE = 0.08
+MERCHANT_PAYMENT_SHARE = 0.25
+P2P_SHARE = 0.12
+
+# User ids per transaction when totalling transfers by counterparty
+COUNTERPARTY_RANGE = 50000
+
+# Zipf exponent for picking a merchant: a handful of merchants receive most payments
+MERCHANT_SKEW = 1.2
+
+
+def _user_rng(seed, prefix, index):
+    return random.Random(f"{seed}:{prefix}:{index}")
+
+
+def _user_email(prefix, index):
+    return f"{prefix}-{index:08d}@example.com"
+
+
+def _money(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def _lognormal_cents(rng, median, sigma=0.8):
+    return max(100, int(rng.lognormvariate(0, sigma) * median * 100))
+
+
+def _deterministic_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+@contextmanager
+def preserve_timestamps(*models):
+    """Let ``bulk_create`` keep our generated ``created_at`` values instead of now()"""
+    fields = [model._meta.get_field('created_at') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _raw_bulk_insert(model, objs, chunk_size, using):
+    """Insert model instances with cursor.executemany, bypassing the ORM insert compiler"""
+    connection = connections[using]
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), chunk_size):
+            rows = [
+                tuple(f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields)
+                for obj in objs[start:start + chunk_size]
+            ]
+            cursor.executemany(sql, rows)
+
+
+def _insert(model, objs, chunk_size, raw, using):
+    if not objs:
+        return
+    if raw:
+        _raw_bulk_insert(model, objs, chunk_size, using)
+    else:
+        model.objects.using(using).bulk_create(objs, batch_size=chunk_size)
+
+
+def _by_shard(objs, key=lambda obj: obj.user_id):
+    """Group rows (or user ids, with ``key``) by the shard of their owning user"""
+    shards = defaultdict(list)
+    for obj in objs:
+        shards[shard_for_user(key(obj))].append(obj)
+    return shards
+
+
+class UserDataGenerator:
+    """Builds (unsaved) cards, QR codes and transactions for one user index"""
+
+    def __init__(self, options, user_ids, end):
+        self.seed = options['seed']
+        self.prefix = options['email_prefix']
+        self.avg_transactions = options['transactions']
+        self.hot_merchants = min(options['hot_merchants'], len(user_ids))
+        self.user_ids = user_ids
+        self.end = end
+        self.start = end - timedelta(days=30 * options['months'])
+
+        self.merchant_cum_weights = []
+        total = 0.0
+        for rank in range(self.hot_merchants):
+            total += 1.0 / (rank + 1) ** MERCHANT_SKEW
+            self.merchant_cum_weights.append(total)
+
+        self.expense_categories = [c for c, _, _ in EXPENSE_CATEGORIES]
+        self.expense_medians = {c: m for c, _, m in EXPENSE_CATEGORIES}
+        self.expense_cum_weights = []
+        total = 0
+        for _, weight, _ in EXPENSE_CATEGORIES:
+            total += weight
+            self.expense_cum_weights.append(total)
+
+    def email(self, index):
+        return _user_email(self.prefix, index)
+
+    def generate(self, index):
+        rng = _user_rng(self.seed, self.prefix, index)
+        user_id = self.user_ids[index]
+        cards = self._cards(rng, user_id, index)
+        qr_codes = self._qr_codes(rng, user_id, index)
+        transactions = self._transactions(rng, user_id, index)
+        return cards, qr_codes, transactions
+
+    def _timestamp(self, rng):
+        span = (self.end - self.start).total_seconds()
+        return self.start + timedelta(seconds=rng.random() * span)
+
+    def _cards(self, rng, user_id, index):
+        cards = []
+        for n in range(rng.choices([0, 1, 2, 3], weights=[15, 50, 25, 10])[0]):
+            card_type = rng.choice(['credit', 'debit', 'bank'])
+            number = ''.join(str(rng.randrange(10)) for _ in range(16 if card_type != 'bank' else 10))
+            cards.append(Card(
+                user_id=user_id,
+                card_number=number,
+                card_type=card_type,
+                card_holder_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                expiry_date=f"{rng.randint(1, 12):02d}/{rng.randint(26, 31)}" if card_type != 'bank' else None,
+                bank_name=rng.choice(BANKS),
+                is_primary=n == 0,
+                created_at=self._timestamp(rng),
+            ))
+        return cards
+
+    def _qr_codes(self, rng, user_id, index):
+        qr_codes = []
+        count = 5 if index < self.hot_merchants else rng.choices([0, 1, 2], weights=[60, 30, 10])[0]
+        for _ in range(count):
+            created_at = self._timestamp(rng)
+            fixed_amount = rng.random() < 0.4
+            qr_codes.append(QRCode(
+                user_id=user_id,
+                qr_code=f"{self.email(index)}:{_deterministic_uuid(rng)}",
+                amount=_money(_lognormal_cents(rng, 5000)) if fixed_amount else None,
+                description='Payment request' if fixed_amount else None,
+                is_active=rng.random() < 0.8,
+                expires_at=created_at + timedelta(hours=24) if rng.random() < 0.5 else None,
+                created_at=created_at,
+            ))
+        return qr_codes
+
+    def _pick_counterparty(self, rng, index):
+        if self.hot_merchants and rng.random() < MERCHANT_PAYMENT_SHARE / (MERCHANT_PAYMENT_SHARE + P2P_SHARE):
+            other = rng.choices(range(self.hot_merchants), cum_weights=self.merchant_cum_weights)[0]
+        else:
+            other = rng.randrange(len(self.user_ids))
+        return None if other == index else other
+
+    def _transactions(self, rng, user_id, index):
+        # Heavy-tailed activity: most users are light, a few are very active
+        count = int(rng.paretovariate(2.0) * self.avg_transactions / 2)
+        timestamps = sorted(self._timestamp(rng) for _ in range(count))
+
+        # Start each user off with a salary so outgoing payments are covered
+        salary_cents = _lognormal_cents(rng, 250000, sigma=0.6)
+        rows = [Transaction(
+            user_id=user_id,
+            transaction_id=uuid7_at(self.start, rng),
+            transaction_type='income',
+            amount=_money(salary_cents),
+            description='Monthly Salary',
+            category='Salary',
+            status='completed',
+            created_at=self.start,
+        )]
+        balance = salary_cents
+        my_email = self.email(index)
+
+        for created_at in timestamps:
+            roll = rng.random()
+            if roll < INCOME_SHARE:
+                category = rng.choice(INCOME_CATEGORIES)
+                cents = salary_cents if category == 'Salary' else _lognormal_cents(rng, 20000)
+                balance += cents
+                rows.append(Transaction(
+                    user_id=user_id, transaction_id=uuid7_at(created_at, rng),
+                    transaction_type='income', amount=_money(cents),
+                    description=category, category=category,
+                    status='completed', created_at=created_at,
+                ))
+                continue
+
+            if roll < INCOME_SHARE + MERCHANT_PAYMENT_SHARE + P2P_SHARE:
+                other = self._pick_counterparty(rng, index)
+                if other is not None:
+                    cents = _lognormal_cents(rng, 7000)
+                    if cents > balance:
+                        continue
+                    balance -= cents
+                    other_email = self.email(other)
+                    rows.append(Transaction(
+                        user_id=user_id, transaction_id=uuid7_at(created_at, rng),
+                        transaction_type='transfer_out', amount=_money(cents),
+                        description='Payment', category='Transfer',
+                        recipient_email=other_email, counterparty_id=self.user_ids[other],
+                        status='completed', created_at=created_at,
+                    ))
+                    rows.append(Transaction(
+                        user_id=self.user_ids[other], transaction_id=uuid7_at(created_at, rng),
+                        transaction_type='transfer_in', amount=_money(cents),
+                        description=f"Received from {my_email}", category='Transfer',
+                        sender_email=my_email, counterparty_id=user_id,
+                        status='completed', created_at=created_at,
+                    ))
+                    continue
+
+            category = rng.choices(self.expense_categories, cum_weights=self.expense_cum_weights)[0]
+            cents = _lognormal_cents(rng, self.expense_medians[category])
+            if cents > balance:
+                continue
+            balance -= cents
+            rows.append(Transaction(
+                user_id=user_id, transaction_id=uuid7_at(created_at, rng),
+                transaction_type='expense', amount=_money(cents),
+                description=category or 'Expense', category=category,
+                status='completed', created_at=created_at,
+            ))
+        return rows
+
+
+def _seed_user_range(options, user_ids, end, start_index, stop_index):
+    """Generate and insert cards, QR codes and transactions for users [start_index, stop_index)"""
+    generator = UserDataGenerator(options, user_ids, end)
+    chunk_size = options['chunk_size']
+    raw = options['raw']
+    counts = {'cards': 0, 'qr_codes': 0, 'transactions': 0}
+
+    cards, qr_codes, transactions = [], [], []
+    # Create the category rows outside the insert transactions, so inserts find their ids cached
+    for shard in settings.WALLET_SHARDS:
+        Transaction._meta.get_field('category').intern(SEED_CATEGORIES, shard)
+
+    def flush():
+        shard_cards = _by_shard(cards)
+        shard_qr_codes = _by_shard(qr_codes)
+        shard_transactions = _by_shard(transactions)
+        with preserve_timestamps(Card, QRCode, Transaction):
+            for shard in shard_cards.keys() | shard_qr_codes.keys() | shard_transactions.keys():
+                with transaction.atomic(using=shard):
+                    _insert(Card, shard_cards[shard], chunk_size, raw, shard)
+                    _insert(QRCode, shard_qr_codes[shard], chunk_size, raw, shard)
+                    _insert(Transaction, shard_transactions[shard], chunk_size, raw, shard)
+        counts['cards'] += len(cards)
+        counts['qr_codes'] += len(qr_codes)
+        counts['transactions'] += len(transactions)
+        cards.clear()
+        qr_codes.clear()
+        transactions.clear()
+
+    for index in range(start_index, stop_index):
+        user_cards, user_qr_codes, user_transactions = generator.generate(index)
+        cards.extend(user_cards)
+        qr_codes.extend(user_qr_codes)
+        transactions.extend(user_transactions)
+        if len(transactions) >= chunk_size:
+            flush()
+    flush()
+    return counts
+
+
+def _worker_init():
+    if not apps.ready:
+        django.setup()
+
+
+def _worker_seed(args):
+    try:
+        return _seed_user_range(*args)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Generate users, wallets, cards, QR codes and transaction histories for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create')
+        parser.add_argument('--transactions', type=int, default=100,
+                            help='Average number of transactions per user (heavy-tailed)')
+        parser.add_argument('--months', type=int, default=12, help='Length of generated history in months')
+        parser.add_argument('--hot-merchants', type=int, default=20,
+                            help='Number of users acting as merchants that receive most payments')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+        parser.add_argument('--end', type=str, default=None,
+                            help='Last day of generated history (YYYY-MM-DD, default: today)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per bulk insert')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating data in parallel, each for a range of users')
+        parser.add_argument('--raw', action='store_true',
+                            help='Insert with cursor.executemany instead of bulk_create')
+        parser.add_argument('--email-prefix', type=str, default='seed',
+                            help='Generated users get <prefix>-<n>@example.com emails')
+        parser.add_argument('--password', type=str, default='password123',
+                            help='Password set for every generated user')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+
+        prefix = options['email_prefix']
+        if User.objects.filter(email__startswith=f"{prefix}-").exists():
+            raise CommandError(f"Users with the '{prefix}-' email prefix already exist; "
+                               f"pick another --email-prefix")
+
+        if options['end']:
+            end_date = datetime.strptime(options['end'], '%Y-%m-%d').date()
+        else:
+            end_date = datetime.now(dt_timezone.utc).date()
+        end = datetime.combine(end_date, dt_time.min, tzinfo=dt_timezone.utc)
+
+        started = time.perf_counter()
+        user_ids = self._create_users(options, end)
+        self.stdout.write(f"Created {len(user_ids)} users and wallets "
+                          f"in {time.perf_counter() - started:.1f}s")
+
+        counts = self._create_user_data(options, user_ids, end)
+        self._recompute_balances(user_ids, options['chunk_size'])
+        # bulk inserts skip SyncedModel.save(), so number the rows for /wallet/sync here
+        for shard, shard_user_ids in _by_shard(user_ids, key=lambda user_id: user_id).items():
+            sequence_bulk_rows(shard, shard_user_ids, options['chunk_size'])
+            # and total up each user's transfers per counterparty
+            for start in range(min(shard_user_ids), max(shard_user_ids) + 1, COUNTERPARTY_RANGE):
+                rebuild_counterparties(shard, start, start + COUNTERPARTY_RANGE)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(user_ids)} users, {counts['cards']} cards, {counts['qr_codes']} QR codes and "
+            f"{counts['transactions']} transactions in {elapsed:.1f}s "
+            f"({counts['transactions'] / max(elapsed, 1e-9):,.0f} transactions/s)"
+        ))
+
+    def _create_users(self, options, end):
+        rng = random.Random(f"{options['seed']}:{options['email_prefix']}:users")
+        prefix = options['email_prefix']
+        chunk_size = options['chunk_size']
+        start = end - timedelta(days=30 * options['months'])
+        # Hashing once keeps user creation fast; every user shares the same password
+        password = make_password(options['password'], salt=f"seed{options['seed']}")
+
+        users = []
+        for index in range(options['users']):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            users.append(User(
+                email=_user_email(prefix, index),
+                password=password,
+                first_name=first_name,
+                last_name=last_name,
+                phone_number=f"+234 80{rng.randint(0, 9)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+                date_joined=start - timedelta(days=rng.randint(1, 365)),
+            ))
+
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=chunk_size)
+            id_by_email = dict(
+                User.objects.filter(email__startswith=f"{prefix}-").values_list('email', 'id')
+            )
+        user_ids = [id_by_email[_user_email(prefix, index)] for index in range(options['users'])]
+        # bulk_create does not send post_save, so wallets are created here
+        for shard, wallets in _by_shard([Wallet(user_id=user_id) for user_id in user_ids]).items():
+            Wallet.objects.using(shard).bulk_create(wallets, batch_size=chunk_size)
+        return user_ids
+
+    def _create_user_data(self, options, user_ids, end):
+        workers = max(1, options['workers'])
+        total = len(user_ids)
+        step = -(-total // workers)
+        ranges = [(start, min(start + step, total)) for start in range(0, total, step)]
+
+        if workers == 1:
+            return _seed_user_range(options, user_ids, end, 0, total)
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        counts = {'cards': 0, 'qr_codes': 0, 'transactions': 0}
+        with context.Pool(processes=len(ranges), initializer=_worker_init) as pool:
+            tasks = [(options, user_ids, end, start, stop) for start, stop in ranges]
+            for result in pool.imap_unordered(_worker_seed, tasks):
+                for key in counts:
+                    counts[key] += result[key]
+                self.stdout.write(f"  ... {counts['transactions']} transactions written")
+        return counts
+
+    def _recompute_balances(self, user_ids, chunk_size):
+        """Set each seeded wallet's balance to the signed sum of its transaction history"""
+        signed_amount = Case(
+            When(transaction_type__in=Transaction.CREDIT_TYPES, then=F('amount')),
+            default=-F('amount'),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+        totals = (
+            Transaction.objects.filter(user=OuterRef('user'))
+            .order_by()
+            .values('user')
+            .annotate(total=Sum(signed_amount))
+            .values('total')
+        )
+        balance = Coalesce(Subquery(totals), Decimal('0'), output_field=DecimalField(max_digits=15, decimal_places=2))
+        for shard, shard_user_ids in _by_shard(user_ids, key=lambda user_id: user_id).items():
+            for start in range(0, len(shard_user_ids), chunk_size):
+                Wallet.objects.using(shard).filter(
+                    user_id__in=shard_user_ids[start:start + chunk_size]
+                ).update(balance=balance)
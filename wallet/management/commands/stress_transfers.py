@@ -0,0 +1,265 @@
+"""
+Concurrent transfer stress test.
+
+Runs many threads that each drive random ``send-money`` and ``qr-codes/scan``
+requests through the full API stack among a pool of users, then checks that no
+update was lost: the pool's total balance is unchanged and every wallet balance
+equals the signed sum of its transaction history.
+
+Rate limits are switched off for the run, since a single sender would
+otherwise spend most of it on 429s. With ``--rate-limit`` they stay on and
+429s are reported apart from failures.
+
+Point it at a scratch database, e.g.::
+
+    DATABASE_URL=sqlite:///stress.sqlite3 python manage.py migrate
+    DATABASE_URL=sqlite:///stress.sqlite3 python manage.py stress_transfers --threads 16
+"""
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Sum, When
+from django.test import Client, override_settings
+
+from accounts.jwt_utils import generate_access_token
+from accounts.models import User
+from wallet.models import Wallet, Transaction
+from wallet.services import deliver_pending_transfers
+from wallet.sharding import shard_for_user
+
+
+# Error messages (surfaced in 400 responses) that mean the transfer should be retried
+RETRYABLE_ERRORS = ('database is locked', 'deadlock', 'could not serialize', 'lock timeout')
+
+CENT = Decimal('0.01')
+
+
+class TransferStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.committed = 0
+        self.insufficient = 0
+        self.limited = 0
+        self.retries = 0
+        self.failed = 0
+        self.errors = {}
+        self.latencies = []
+
+    def record(self, outcome, latency=None, message=None):
+        with self.lock:
+            if outcome == 'committed':
+                self.committed += 1
+                self.latencies.append(latency)
+            elif outcome == 'insufficient':
+                self.insufficient += 1
+            elif outcome == 'limited':
+                self.limited += 1
+            elif outcome == 'retry':
+                self.retries += 1
+            else:
+                self.failed += 1
+                self.errors[message] = self.errors.get(message, 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Stress send-money and QR payments concurrently and verify that no updates are lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='Size of the user pool')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent client threads')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+        parser.add_argument('--initial-balance', type=int, default=100000, help='Starting balance per user')
+        parser.add_argument('--max-amount', type=int, default=5000, help='Largest single transfer')
+        parser.add_argument('--qr-share', type=float, default=0.3,
+                            help='Fraction of transfers made by scanning a QR code')
+        parser.add_argument('--max-retries', type=int, default=10,
+                            help='Retries per transfer on lock/serialization errors')
+        parser.add_argument('--rate-limit', action='store_true',
+                            help='Keep RATE_LIMITS in force and count 429s apart from failures')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed')
+        parser.add_argument('--email-prefix', type=str, default='stress',
+                            help='Pool users get <prefix>-<n>@example.com emails')
+        parser.add_argument('--reset', action='store_true',
+                            help='Delete an existing pool with the same prefix first')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2')
+
+        pool = self._create_pool(options)
+        before = self._pool_total(pool)
+        self.stdout.write(f"Pool of {len(pool)} users holding {before} in total; "
+                          f"running {options['threads']} threads for {options['duration']}s")
+
+        stats = TransferStats()
+        deadline = time.monotonic() + options['duration']
+        threads = [
+            threading.Thread(target=self._worker, args=(n, pool, stats, deadline, options))
+            for n in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        with override_settings(RATE_LIMIT_ENABLED=settings.RATE_LIMIT_ENABLED and options['rate_limit']):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        self._report(stats, elapsed)
+        self._verify(pool, before)
+
+    def _create_pool(self, options):
+        prefix = options['email_prefix']
+        existing = User.objects.filter(email__startswith=f"{prefix}-")
+        if existing.exists():
+            if not options['reset']:
+                raise CommandError(f"A '{prefix}-' pool already exists; pass --reset to replace it")
+            existing.delete()
+
+        password = make_password('stress-password')
+        amount = Decimal(options['initial_balance'])
+        pool = []
+        with transaction.atomic():
+            for n in range(options['users']):
+                user = User.objects.create(
+                    email=f"{prefix}-{n:04d}@example.com", password=password,
+                    first_name='Stress', last_name=str(n),
+                )
+                # The opening balance is recorded as income so history and balance agree
+                user.transactions.create(
+                    transaction_type='income', amount=amount,
+                    description='Stress test opening balance', category='Stress',
+                )
+                Wallet.objects.using(shard_for_user(user)).filter(user_id=user.pk).update(balance=amount)
+                qr_code = user.qr_codes.create(qr_code=f"{user.email}:stress")
+                pool.append({
+                    'user': user,
+                    'token': generate_access_token(user),
+                    'qr_code': qr_code.qr_code,
+                })
+        return pool
+
+    def _worker(self, number, pool, stats, deadline, options):
+        seed = options['seed']
+        rng = random.Random(None if seed is None else f"{seed}:{number}")
+        client = Client(HTTP_HOST='localhost')
+        try:
+            while time.monotonic() < deadline:
+                sender, recipient = rng.sample(pool, 2)
+                amount = f"{rng.randint(1, options['max_amount'] * 100) / 100:.2f}"
+                if rng.random() < options['qr_share']:
+                    path = '/api/wallet/qr-codes/scan'
+                    body = {'qr_code': recipient['qr_code'], 'amount': amount}
+                else:
+                    path = '/api/wallet/send-money'
+                    body = {
+                        'recipient_email': recipient['user'].email,
+                        'amount': amount,
+                        'description': 'Stress transfer',
+                    }
+                self._transfer(client, path, body, sender['token'], stats, options['max_retries'], rng)
+        finally:
+            connection.close()
+
+    def _transfer(self, client, path, body, token, stats, max_retries, rng):
+        for attempt in range(max_retries + 1):
+            started = time.perf_counter()
+            response = client.post(
+                path, data=json.dumps(body), content_type='application/json',
+                HTTP_AUTHORIZATION=f"Bearer {token}",
+            )
+            latency = time.perf_counter() - started
+            if response.status_code == 200:
+                stats.record('committed', latency)
+                return
+            if response.status_code == 429:
+                stats.record('limited')
+                return
+
+            message = response.json().get('message', '') if response.content else ''
+            if 'Insufficient balance' in message:
+                stats.record('insufficient')
+                return
+            if any(error in message.lower() for error in RETRYABLE_ERRORS) and attempt < max_retries:
+                stats.record('retry')
+                time.sleep(rng.uniform(0, 0.002 * 2 ** attempt))
+                continue
+            stats.record('failed', message=f"{response.status_code}: {message}")
+            return
+
+    def _report(self, stats, elapsed):
+        latencies = sorted(stats.latencies)
+        self.stdout.write(f"Elapsed:               {elapsed:.2f}s")
+        self.stdout.write(f"Committed transfers:   {stats.committed} ({stats.committed / elapsed:,.1f}/s)")
+        self.stdout.write(f"Insufficient balance:  {stats.insufficient}")
+        self.stdout.write(f"Rate limited (429):    {stats.limited}")
+        self.stdout.write(f"Retries (lock/deadlock): {stats.retries}")
+        self.stdout.write(f"Failed:                {stats.failed}")
+        if latencies:
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f"Latency p50/p95:       {statistics.median(latencies) * 1000:.1f} / "
+                              f"{p95 * 1000:.1f} ms")
+        for message, count in sorted(stats.errors.items(), key=lambda item: -item[1]):
+            self.stdout.write(self.style.WARNING(f"  {count} x {message}"))
+
+    def _users_by_shard(self, pool):
+        shards = defaultdict(list)
+        for p in pool:
+            shards[shard_for_user(p['user'])].append(p['user'].pk)
+        return shards
+
+    def _pool_total(self, pool):
+        total = Decimal('0')
+        for shard, user_ids in self._users_by_shard(pool).items():
+            total += Wallet.objects.using(shard).filter(user_id__in=user_ids).aggregate(
+                total=Sum('balance'))['total'] or 0
+        return total.quantize(CENT)
+
+    def _verify(self, pool, before):
+        # Cross-shard credits still in the outbox would show up as missing money
+        deliver_pending_transfers()
+        after = self._pool_total(pool)
+
+        signed_amount = Case(
+            When(transaction_type__in=Transaction.CREDIT_TYPES, then=F('amount')),
+            default=-F('amount'),
+            output_field=DecimalField(max_digits=15, decimal_places=2),
+        )
+        emails = {p['user'].pk: p['user'].email for p in pool}
+        mismatches = []
+        for shard, user_ids in self._users_by_shard(pool).items():
+            # SQLite sums decimals as floats, so compare to the cent
+            history = {
+                user_id: total.quantize(CENT)
+                for user_id, total in Transaction.objects.using(shard).filter(user_id__in=user_ids)
+                .order_by()
+                .values('user')
+                .annotate(total=Sum(signed_amount))
+                .values_list('user', 'total')
+            }
+            mismatches += [
+                (emails[user_id], balance, history.get(user_id, Decimal('0')))
+                for user_id, balance in Wallet.objects.using(shard).filter(user_id__in=user_ids)
+                .values_list('user', 'balance')
+                if balance != history.get(user_id, Decimal('0'))
+            ]
+
+        ok = after == before and not mismatches
+        if after != before:
+            self.stdout.write(self.style.ERROR(f"Pool total changed: {before} -> {after}"))
+        for email, balance, expected in mismatches:
+            self.stdout.write(self.style.ERROR(f"{email}: balance {balance} != history {expected}"))
+        if not ok:
+            raise CommandError('Lost or phantom updates detected')
+        self.stdout.write(self.style.SUCCESS(
+            f"OK: pool total unchanged ({after}) and all {len(pool)} balances match their history"
+        ))
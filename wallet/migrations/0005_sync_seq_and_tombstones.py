@@ -0,0 +1,108 @@
+# Generated by Django 5.1.5 on 2026-10-19 05:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+def _update_column(connection, model, column, key, updates):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {quote(model._meta.db_table)} SET {quote(column)} = %s WHERE {quote(key)} = %s", updates
+        )
+
+
+def number_existing_rows(apps, schema_editor, chunk_size=1000):
+    """Number existing rows with fresh change versions of their users, oldest first (wallet.sync.sequence_bulk_rows as of this migration)"""
+    connection = schema_editor.connection
+    using = connection.alias
+    Wallet = apps.get_model('wallet', 'Wallet')
+    models = [apps.get_model('wallet', name) for name in ('Card', 'QRCode', 'ArchivedTransaction', 'Transaction')]
+    user_ids = list(Wallet.objects.using(using).order_by('user_id').values_list('user_id', flat=True))
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        with transaction.atomic(using=using):
+            versions = dict(
+                Wallet.objects.using(using).select_for_update().filter(user_id__in=chunk)
+                .values_list('user_id', 'version')
+            )
+            for model in models:
+                unnumbered = model.objects.using(using).filter(user_id__in=chunk, seq=0)
+                updates = []
+                for user_id, pk in unnumbered.order_by('created_at', 'id').values_list('user_id', 'id'):
+                    if user_id in versions:
+                        versions[user_id] += 1
+                        updates.append((versions[user_id], pk))
+                _update_column(connection, model, 'seq', 'id', updates)
+            _update_column(connection, Wallet, 'version', 'user_id', [(v, user_id) for user_id, v in versions.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0004_wallet_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('seq', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedtransaction',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='qrcode',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['user', 'seq'], name='archive_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'seq'], name='card_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='qrcode',
+            index=models.Index(fields=['user', 'seq'], name='qr_code_user_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'seq'], name='transaction_user_seq_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'seq'], name='tombstone_user_seq_idx'),
+        ),
+        migrations.RunPython(number_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,140 @@
+"""
+The full-text search index of hot and archived transactions (see wallet/search.py).
+
+The statements are frozen as they were when the index was added, so later
+changes to wallet/search.py cannot change what this migration does.
+"""
+from django.db import migrations
+
+CREATE_SEARCH_INDEX = {
+    'sqlite': [
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(owner, description, "
+            "category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN "
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) VALUES (new.id, 'u' || new.user_id, new.description, new.category, "
+            "new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN "
+            "INSERT INTO transactions_fts(transactions_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, old.category, old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions BEGIN INSERT INTO "
+            "transactions_fts(transactions_fts, rowid, owner, description, category, recipient_email,"
+            " sender_email) VALUES ('delete', old.id, 'u' || old.user_id, old.description, "
+            "old.category, old.recipient_email, old.sender_email); INSERT INTO "
+            "transactions_fts(rowid, owner, description, category, recipient_email, sender_email) "
+            "VALUES (new.id, 'u' || new.user_id, new.description, new.category, new.recipient_email, "
+            "new.sender_email); END"
+        ),
+        (
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) SELECT id, 'u' || transactions.user_id, transactions.description, "
+            "transactions.category, transactions.recipient_email, transactions.sender_email FROM "
+            "transactions"
+        ),
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_archive_fts USING fts5(owner, "
+            "description, category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_insert AFTER INSERT ON "
+            "transactions_archive BEGIN INSERT INTO transactions_archive_fts(rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES (new.id, 'u' || "
+            "new.user_id, new.description, new.category, new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_delete AFTER DELETE ON "
+            "transactions_archive BEGIN INSERT INTO "
+            "transactions_archive_fts(transactions_archive_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, old.category, old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions_archive BEGIN "
+            "INSERT INTO transactions_archive_fts(transactions_archive_fts, rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES ('delete', old.id, 'u' || "
+            "old.user_id, old.description, old.category, old.recipient_email, old.sender_email); "
+            "INSERT INTO transactions_archive_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES (new.id, 'u' || new.user_id, new.description, "
+            "new.category, new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "INSERT INTO transactions_archive_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) SELECT id, 'u' || transactions_archive.user_id, "
+            "transactions_archive.description, transactions_archive.category, "
+            "transactions_archive.recipient_email, transactions_archive.sender_email FROM "
+            "transactions_archive"
+        ),
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_search_idx ON transactions USING GIN (user_id, "
+            "(to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(category, '') || ' '"
+            " || coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_email_trgm_idx ON transactions USING GIN "
+            "(((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) gin_trgm_ops)"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_search_idx ON transactions_archive USING"
+            " GIN (user_id, (to_tsvector('simple', coalesce(description, '') || ' ' || "
+            "coalesce(category, '') || ' ' || coalesce(recipient_email, '') || ' ' || "
+            "coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_email_trgm_idx ON transactions_archive "
+            "USING GIN (((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) "
+            "gin_trgm_ops)"
+        ),
+    ],
+}
+
+DROP_SEARCH_INDEX = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS transactions_fts_insert",
+        "DROP TRIGGER IF EXISTS transactions_fts_delete",
+        "DROP TRIGGER IF EXISTS transactions_fts_update",
+        "DROP TABLE IF EXISTS transactions_fts",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_insert",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_delete",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_update",
+        "DROP TABLE IF EXISTS transactions_archive_fts",
+    ],
+    'postgresql': [
+        "DROP INDEX IF EXISTS transactions_search_idx",
+        "DROP INDEX IF EXISTS transactions_email_trgm_idx",
+        "DROP INDEX IF EXISTS transactions_archive_search_idx",
+        "DROP INDEX IF EXISTS transactions_archive_email_trgm_idx",
+    ],
+}
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        # Other databases have no search index
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0005_sync_seq_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.RunPython(_run(CREATE_SEARCH_INDEX), _run(DROP_SEARCH_INDEX)),
+    ]
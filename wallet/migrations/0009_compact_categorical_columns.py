@@ -0,0 +1,336 @@
+"""
+Store transaction types and statuses as small-int codes and categories as ids
+into ``transaction_categories`` (see wallet/fields.py).
+
+The columns are first rewritten in place to the text of their new values,
+then altered to integers, which casts them. The search index reads the
+category text, so it is dropped around the change and rebuilt on top of the
+lookup table. Its statements are frozen here, as of this migration.
+"""
+from django.db import migrations, models
+
+import wallet.fields
+
+TABLES = ('Transaction', 'ArchivedTransaction')
+CODE_COLUMNS = ('transaction_type', 'status')
+
+# The index as migration 0006 created it, for unapplying this one
+CREATE_TEXT_SEARCH_INDEX = {
+    'sqlite': [
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(owner, description, "
+            "category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN "
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) VALUES (new.id, 'u' || new.user_id, new.description, new.category, "
+            "new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN "
+            "INSERT INTO transactions_fts(transactions_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, old.category, old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions BEGIN INSERT INTO "
+            "transactions_fts(transactions_fts, rowid, owner, description, category, recipient_email,"
+            " sender_email) VALUES ('delete', old.id, 'u' || old.user_id, old.description, "
+            "old.category, old.recipient_email, old.sender_email); INSERT INTO "
+            "transactions_fts(rowid, owner, description, category, recipient_email, sender_email) "
+            "VALUES (new.id, 'u' || new.user_id, new.description, new.category, new.recipient_email, "
+            "new.sender_email); END"
+        ),
+        (
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) SELECT id, 'u' || transactions.user_id, transactions.description, "
+            "transactions.category, transactions.recipient_email, transactions.sender_email FROM "
+            "transactions"
+        ),
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_archive_fts USING fts5(owner, "
+            "description, category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_insert AFTER INSERT ON "
+            "transactions_archive BEGIN INSERT INTO transactions_archive_fts(rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES (new.id, 'u' || "
+            "new.user_id, new.description, new.category, new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_delete AFTER DELETE ON "
+            "transactions_archive BEGIN INSERT INTO "
+            "transactions_archive_fts(transactions_archive_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, old.category, old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions_archive BEGIN "
+            "INSERT INTO transactions_archive_fts(transactions_archive_fts, rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES ('delete', old.id, 'u' || "
+            "old.user_id, old.description, old.category, old.recipient_email, old.sender_email); "
+            "INSERT INTO transactions_archive_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES (new.id, 'u' || new.user_id, new.description, "
+            "new.category, new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "INSERT INTO transactions_archive_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) SELECT id, 'u' || transactions_archive.user_id, "
+            "transactions_archive.description, transactions_archive.category, "
+            "transactions_archive.recipient_email, transactions_archive.sender_email FROM "
+            "transactions_archive"
+        ),
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_search_idx ON transactions USING GIN (user_id, "
+            "(to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(category, '') || ' '"
+            " || coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_email_trgm_idx ON transactions USING GIN "
+            "(((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) gin_trgm_ops)"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_search_idx ON transactions_archive USING"
+            " GIN (user_id, (to_tsvector('simple', coalesce(description, '') || ' ' || "
+            "coalesce(category, '') || ' ' || coalesce(recipient_email, '') || ' ' || "
+            "coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_email_trgm_idx ON transactions_archive "
+            "USING GIN (((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) "
+            "gin_trgm_ops)"
+        ),
+    ],
+}
+
+# The index reading category names from the lookup table
+CREATE_SEARCH_INDEX = {
+    'sqlite': [
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(owner, description, "
+            "category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN "
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) VALUES (new.id, 'u' || new.user_id, new.description, (SELECT name FROM "
+            "transaction_categories WHERE id = new.category), new.recipient_email, new.sender_email);"
+            " END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN "
+            "INSERT INTO transactions_fts(transactions_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, (SELECT name FROM transaction_categories WHERE id = old.category), "
+            "old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions BEGIN INSERT INTO "
+            "transactions_fts(transactions_fts, rowid, owner, description, category, recipient_email,"
+            " sender_email) VALUES ('delete', old.id, 'u' || old.user_id, old.description, (SELECT "
+            "name FROM transaction_categories WHERE id = old.category), old.recipient_email, "
+            "old.sender_email); INSERT INTO transactions_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES (new.id, 'u' || new.user_id, new.description, "
+            "(SELECT name FROM transaction_categories WHERE id = new.category), new.recipient_email, "
+            "new.sender_email); END"
+        ),
+        (
+            "INSERT INTO transactions_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) SELECT id, 'u' || transactions.user_id, transactions.description, (SELECT "
+            "name FROM transaction_categories WHERE id = transactions.category), "
+            "transactions.recipient_email, transactions.sender_email FROM transactions"
+        ),
+        (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_archive_fts USING fts5(owner, "
+            "description, category, recipient_email, sender_email, content='', prefix='2 3')"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_insert AFTER INSERT ON "
+            "transactions_archive BEGIN INSERT INTO transactions_archive_fts(rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES (new.id, 'u' || "
+            "new.user_id, new.description, (SELECT name FROM transaction_categories WHERE id = "
+            "new.category), new.recipient_email, new.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_delete AFTER DELETE ON "
+            "transactions_archive BEGIN INSERT INTO "
+            "transactions_archive_fts(transactions_archive_fts, rowid, owner, description, category, "
+            "recipient_email, sender_email) VALUES ('delete', old.id, 'u' || old.user_id, "
+            "old.description, (SELECT name FROM transaction_categories WHERE id = old.category), "
+            "old.recipient_email, old.sender_email); END"
+        ),
+        (
+            "CREATE TRIGGER IF NOT EXISTS transactions_archive_fts_update AFTER UPDATE OF user_id, "
+            "description, category, recipient_email, sender_email ON transactions_archive BEGIN "
+            "INSERT INTO transactions_archive_fts(transactions_archive_fts, rowid, owner, "
+            "description, category, recipient_email, sender_email) VALUES ('delete', old.id, 'u' || "
+            "old.user_id, old.description, (SELECT name FROM transaction_categories WHERE id = "
+            "old.category), old.recipient_email, old.sender_email); INSERT INTO "
+            "transactions_archive_fts(rowid, owner, description, category, recipient_email, "
+            "sender_email) VALUES (new.id, 'u' || new.user_id, new.description, (SELECT name FROM "
+            "transaction_categories WHERE id = new.category), new.recipient_email, new.sender_email);"
+            " END"
+        ),
+        (
+            "INSERT INTO transactions_archive_fts(rowid, owner, description, category, "
+            "recipient_email, sender_email) SELECT id, 'u' || transactions_archive.user_id, "
+            "transactions_archive.description, (SELECT name FROM transaction_categories WHERE id = "
+            "transactions_archive.category), transactions_archive.recipient_email, "
+            "transactions_archive.sender_email FROM transactions_archive"
+        ),
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_search_idx ON transactions USING GIN (user_id, "
+            "(to_tsvector('simple', coalesce(description, '') || ' ' || coalesce(recipient_email, '')"
+            " || ' ' || coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_email_trgm_idx ON transactions USING GIN "
+            "(((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) gin_trgm_ops)"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_search_idx ON transactions_archive USING"
+            " GIN (user_id, (to_tsvector('simple', coalesce(description, '') || ' ' || "
+            "coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))))"
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS transactions_archive_email_trgm_idx ON transactions_archive "
+            "USING GIN (((coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))) "
+            "gin_trgm_ops)"
+        ),
+    ],
+}
+
+DROP_SEARCH_INDEX = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS transactions_fts_insert",
+        "DROP TRIGGER IF EXISTS transactions_fts_delete",
+        "DROP TRIGGER IF EXISTS transactions_fts_update",
+        "DROP TABLE IF EXISTS transactions_fts",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_insert",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_delete",
+        "DROP TRIGGER IF EXISTS transactions_archive_fts_update",
+        "DROP TABLE IF EXISTS transactions_archive_fts",
+    ],
+    'postgresql': [
+        "DROP INDEX IF EXISTS transactions_search_idx",
+        "DROP INDEX IF EXISTS transactions_email_trgm_idx",
+        "DROP INDEX IF EXISTS transactions_archive_search_idx",
+        "DROP INDEX IF EXISTS transactions_archive_email_trgm_idx",
+    ],
+}
+
+
+def _search_index(statements):
+    def run(apps, schema_editor):
+        # Other databases have no search index
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def _codes(model, column):
+    """(value, code) of each choice of a column, codes as text like the column still is"""
+    return [(value, str(code)) for code, (value, label) in enumerate(model._meta.get_field(column).choices)]
+
+
+def _case(column, pairs):
+    whens = ' '.join(f"WHEN '{old}' THEN '{new}'" for old, new in pairs)
+    return f"CASE {column} {whens} ELSE {column} END"
+
+
+def encode(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    categories = quote(apps.get_model('wallet', 'TransactionCategory')._meta.db_table)
+    for name in TABLES:
+        model = apps.get_model('wallet', name)
+        table = quote(model._meta.db_table)
+        schema_editor.execute(
+            f"INSERT INTO {categories} (name) SELECT DISTINCT category FROM {table} "
+            f"WHERE category IS NOT NULL AND category NOT IN (SELECT name FROM {categories})"
+        )
+        codes = [f"{column} = {_case(column, _codes(model, column))}" for column in CODE_COLUMNS]
+        schema_editor.execute(
+            f"UPDATE {table} SET {', '.join(codes)}, "
+            f"category = (SELECT CAST(id AS VARCHAR(20)) FROM {categories} WHERE name = {table}.category)"
+        )
+
+
+def decode(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    categories = quote(apps.get_model('wallet', 'TransactionCategory')._meta.db_table)
+    for name in TABLES:
+        model = apps.get_model('wallet', name)
+        table = quote(model._meta.db_table)
+        values = [
+            f"{column} = {_case(column, [(code, value) for value, code in _codes(model, column)])}"
+            for column in CODE_COLUMNS
+        ]
+        schema_editor.execute(
+            f"UPDATE {table} SET {', '.join(values)}, "
+            f"category = (SELECT name FROM {categories} WHERE CAST(id AS VARCHAR(20)) = {table}.category)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0008_admin_changelist_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                'db_table': 'transaction_categories',
+            },
+        ),
+        migrations.RunPython(_search_index(DROP_SEARCH_INDEX), _search_index(CREATE_TEXT_SEARCH_INDEX)),
+        migrations.RunPython(encode, decode),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='category',
+            field=wallet.fields.DictionaryField(blank=True, null=True, to='wallet.TransactionCategory'),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='status',
+            field=wallet.fields.ChoiceCodeField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')]),
+        ),
+        migrations.AlterField(
+            model_name='archivedtransaction',
+            name='transaction_type',
+            field=wallet.fields.ChoiceCodeField(choices=[('income', 'Income'), ('expense', 'Expense'), ('transfer_in', 'Transfer In'), ('transfer_out', 'Transfer Out')]),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=wallet.fields.DictionaryField(blank=True, null=True, to='wallet.TransactionCategory'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=wallet.fields.ChoiceCodeField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='completed'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=wallet.fields.ChoiceCodeField(choices=[('income', 'Income'), ('expense', 'Expense'), ('transfer_in', 'Transfer In'), ('transfer_out', 'Transfer Out')]),
+        ),
+        migrations.RunPython(_search_index(CREATE_SEARCH_INDEX), _search_index(DROP_SEARCH_INDEX)),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-19 06:11
+
+import wallet.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0009_compact_categorical_columns'),
+    ]
+
+    operations = [
+        # Only the Python-side default changes; altering the field would make
+        # SQLite rebuild the table, and drop the search triggers with it
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='transaction',
+                    name='transaction_id',
+                    field=models.UUIDField(default=wallet.ids.uuid7, editable=False, unique=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.5 on 2026-10-19 06:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0010_transaction_id_uuid7'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counterparty',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sent_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('received_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('received_count', models.PositiveIntegerField(default=0)),
+                ('last_transfer_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'counterparties',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedtransaction',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='counterparty',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['user', 'counterparty', '-created_at'], name='archive_user_party_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'counterparty', '-created_at'], name='transaction_user_party_idx'),
+        ),
+        migrations.AddField(
+            model_name='counterparty',
+            name='counterparty',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='counterparty',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='counterparties', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='counterparty',
+            index=models.Index(fields=['user', '-sent_total', '-received_total'], name='counterparty_user_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='counterparty',
+            index=models.Index(fields=['user', '-last_transfer_at'], name='counterparty_user_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='counterparty',
+            constraint=models.UniqueConstraint(fields=('user', 'counterparty'), name='counterparty_pair_unique'),
+        ),
+    ]
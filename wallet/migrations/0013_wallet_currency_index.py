@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-19 07:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wallet', '0012_balance_snapshots'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='wallet',
+            index=models.Index(fields=['currency', '-id'], name='wallet_currency_idx'),
+        ),
+    ]
@@ -1,25 +1,101 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F
 from django.conf import settings
 from django.utils import timezone
 import uuid
 
+from .fields import ChoiceCodeField, DictionaryField
+from .ids import uuid7
+from .sharding import shard_for_user
+
 
 class Wallet(models.Model):
     """User's wallet to hold balance and manage transactions"""
-    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wallet')
+    # Users live on the default database while wallet rows may live on another shard,
+    # so user foreign keys carry no database-level constraint (see wallet/sharding.py)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wallet',
+                                db_constraint=False)
     balance = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
     currency = models.CharField(max_length=3, default='NGN')
+    # Every transaction of this user created before this moment has been moved to
+    # ArchivedTransaction (see wallet/archive.py); None if nothing is archived
+    archived_before = models.DateTimeField(blank=True, null=True)
+    # Last day whose closing balance is recorded in WalletBalanceSnapshot (see
+    # wallet/snapshots.py); None until the snapshot job first reaches this wallet
+    balance_snapshot_through = models.DateField(blank=True, null=True)
+    # Incremented with every change to the user's wallet, cards, transactions or
+    # QR codes; read endpoints derive their ETags from it (see wallet/versioning.py)
+    # and changed rows record it as their ``seq`` (see wallet/sync.py)
+    version = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'wallets'
+        indexes = [
+            # Admin changelist filter, paged newest first by keyset (see wallet/admin.py)
+            models.Index(fields=['currency', '-id'], name='wallet_currency_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.email}'s Wallet - {self.currency} {self.balance}"
 
+    def save(self, *args, **kwargs):
+        # The version only moves through UPDATE ... SET version = version + 1; saving
+        # a stale instance must not wind it back to a value clients have cached
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
+
+
+class WalletBalanceSnapshot(models.Model):
+    """Closing balance of a user's wallet on a day its balance changed"""
+    # Covered by the unique (user, date) index
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='balance_snapshots',
+                             db_constraint=False, db_index=False)
+    date = models.DateField()
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        db_table = 'wallet_balance_snapshots'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='balance_snapshot_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.date}: {self.balance}"
+
+
+def next_version(user_id, using):
+    """Increment the user's change version and return the new value; call inside a transaction"""
+    wallets = Wallet.objects.using(using).filter(user_id=user_id)
+    wallets.update(version=F('version') + 1)
+    return wallets.values_list('version', flat=True).first() or 0
+
+
+class SyncedModel(models.Model):
+    """
+    User-owned rows reported by ``/wallet/sync``: every save stamps ``seq`` with
+    the user's next change version, in the same transaction as the write
+    """
+    seq = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            self.seq = next_version(self.user_id, using)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'seq'}
+            super().save(*args, **kwargs)
+
 
-class Card(models.Model):
+class Card(SyncedModel):
     """Linked bank account/credit/debit cards"""
     CARD_TYPES = [
         ('credit', 'Credit Card'),
@@ -27,7 +103,8 @@ class Card(models.Model):
         ('bank', 'Bank Account'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cards')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cards',
+                             db_constraint=False)
     card_number = models.CharField(max_length=19)
     card_type = models.CharField(max_length=10, choices=CARD_TYPES)
     card_holder_name = models.CharField(max_length=200)
@@ -39,18 +116,36 @@ class Card(models.Model):
     class Meta:
         db_table = 'cards'
         ordering = ['-is_primary', '-created_at']
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='card_user_seq_idx'),
+        ]
 
     def __str__(self):
         return f"{self.card_holder_name} - {self.card_number[-4:]}"
 
     def save(self, *args, **kwargs):
-        # If this card is set as primary, unset all other primary cards for this user
-        if self.is_primary:
-            Card.objects.filter(user=self.user, is_primary=True).update(is_primary=False)
-        super().save(*args, **kwargs)
+        using = shard_for_user(self.user_id)
+        with transaction.atomic(using=using, savepoint=False):
+            # If this card is set as primary, unset all other primary cards for this user
+            if self.is_primary:
+                Card.objects.using(using).filter(
+                    user_id=self.user_id, is_primary=True
+                ).exclude(pk=self.pk).update(is_primary=False, seq=next_version(self.user_id, using))
+            super().save(*args, **kwargs)
+
+
+class TransactionCategory(models.Model):
+    """Dictionary of transaction categories: transactions store the id of their category's row"""
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        db_table = 'transaction_categories'
+
+    def __str__(self):
+        return self.name
 
 
-class Transaction(models.Model):
+class Transaction(SyncedModel):
     """Transaction records for income and expenses"""
     TRANSACTION_TYPES = [
         ('income', 'Income'),
@@ -66,28 +161,125 @@ class Transaction(models.Model):
         ('cancelled', 'Cancelled'),
     ]
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transactions')
-    transaction_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
-    transaction_type = models.CharField(max_length=15, choices=TRANSACTION_TYPES)
+    # Transaction types that add to / subtract from the wallet balance
+    CREDIT_TYPES = ('income', 'transfer_in')
+    DEBIT_TYPES = ('expense', 'transfer_out')
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transactions',
+                             db_constraint=False)
+    # Time-ordered, so new ids append to the unique index (see wallet/ids.py)
+    transaction_id = models.UUIDField(default=uuid7, editable=False, unique=True)
+    # Strings in Python, small integers in the row and its indexes (see wallet/fields.py)
+    transaction_type = ChoiceCodeField(choices=TRANSACTION_TYPES)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
     description = models.CharField(max_length=255)
-    category = models.CharField(max_length=50, blank=True, null=True)
-    status = models.CharField(max_length=15, choices=TRANSACTION_STATUS, default='completed')
+    category = DictionaryField(to='wallet.TransactionCategory', blank=True, null=True)
+    status = ChoiceCodeField(choices=TRANSACTION_STATUS, default='completed')
     recipient_email = models.EmailField(blank=True, null=True)
     sender_email = models.EmailField(blank=True, null=True)
+    # The other user of a transfer: the recipient of a transfer_out, the sender of
+    # a transfer_in. The email columns keep the address if that user is deleted.
+    counterparty = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name='+',
+                                     blank=True, null=True, db_constraint=False, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'transactions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='transaction_user_seq_idx'),
+            # History pages, newest first; list_transactions filters lead with the column they test
+            models.Index(fields=['user', '-created_at', 'amount'], name='transaction_user_created_idx'),
+            models.Index(fields=['user', 'transaction_type', '-created_at'], name='transaction_user_type_idx'),
+            models.Index(fields=['user', 'status', '-created_at'], name='transaction_user_status_idx'),
+            models.Index(fields=['user', 'category', '-created_at'], name='transaction_user_category_idx'),
+            models.Index(fields=['user', 'counterparty', '-created_at'], name='transaction_user_party_idx'),
+            # Admin changelist across all users: its default order, and its filters
+            models.Index(fields=['-created_at', '-id'], name='transaction_created_idx'),
+            models.Index(fields=['transaction_type', '-created_at', '-id'], name='transaction_type_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='transaction_status_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], name='transaction_category_idx'),
+        ]
 
     def __str__(self):
         return f"{self.transaction_type} - {self.amount} - {self.user.email}"
 
 
-class QRCode(models.Model):
+class ArchivedTransaction(models.Model):
+    """Transactions moved out of the hot ``transactions`` table once they are old"""
+    # Keeps the id it had in ``transactions``
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='archived_transactions', db_constraint=False)
+    transaction_id = models.UUIDField(unique=True)
+    transaction_type = ChoiceCodeField(choices=Transaction.TRANSACTION_TYPES)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    description = models.CharField(max_length=255)
+    category = DictionaryField(to='wallet.TransactionCategory', blank=True, null=True)
+    status = ChoiceCodeField(choices=Transaction.TRANSACTION_STATUS)
+    recipient_email = models.EmailField(blank=True, null=True)
+    sender_email = models.EmailField(blank=True, null=True)
+    counterparty = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name='+',
+                                     blank=True, null=True, db_constraint=False, db_index=False)
+    created_at = models.DateTimeField()
+    seq = models.PositiveBigIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'transactions_archive'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archive_user_created_idx'),
+            models.Index(fields=['user', 'seq'], name='archive_user_seq_idx'),
+            models.Index(fields=['user', 'transaction_type', '-created_at'], name='archive_user_type_idx'),
+            models.Index(fields=['user', 'status', '-created_at'], name='archive_user_status_idx'),
+            models.Index(fields=['user', 'category', '-created_at'], name='archive_user_category_idx'),
+            models.Index(fields=['user', 'counterparty', '-created_at'], name='archive_user_party_idx'),
+            models.Index(fields=['-created_at', '-id'], name='archive_created_idx'),
+            models.Index(fields=['transaction_type', '-created_at', '-id'], name='archive_type_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='archive_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_type} - {self.amount} - {self.user.email} (archived)"
+
+
+class Counterparty(models.Model):
+    """
+    Running totals of one user's transfers with another user, on the owner's
+    shard. Updated with every transfer (see wallet/counterparties.py), so the
+    counterparties list never aggregates transaction history.
+    """
+    # Both user columns are covered by the unique (user, counterparty) index
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='counterparties',
+                             db_constraint=False, db_index=False)
+    counterparty = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, related_name='+',
+                                     db_constraint=False, db_index=False)
+    sent_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    received_total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    received_count = models.PositiveIntegerField(default=0)
+    last_transfer_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'counterparties'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'counterparty'], name='counterparty_pair_unique'),
+        ]
+        indexes = [
+            # ?order=top and ?order=recent
+            models.Index(fields=['user', '-sent_total', '-received_total'], name='counterparty_user_top_idx'),
+            models.Index(fields=['user', '-last_transfer_at'], name='counterparty_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <-> {self.counterparty_id}: sent {self.sent_total}, received {self.received_total}"
+
+
+class QRCode(SyncedModel):
     """QR codes for receiving money"""
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='qr_codes')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='qr_codes',
+                             db_constraint=False)
     qr_code = models.CharField(max_length=255, unique=True)
     amount = models.DecimalField(max_digits=15, decimal_places=2, blank=True, null=True)
     description = models.CharField(max_length=255, blank=True, null=True)
@@ -98,6 +290,9 @@ class QRCode(models.Model):
     class Meta:
         db_table = 'qr_codes'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='qr_code_user_seq_idx'),
+        ]
 
     def __str__(self):
         return f"QR Code for {self.user.email}"
@@ -106,3 +301,59 @@ class QRCode(models.Model):
         if self.expires_at:
             return timezone.now() > self.expires_at
         return False
+
+
+class TransferOutbox(models.Model):
+    """
+    Pending credit of a transfer whose recipient lives on another shard.
+
+    Written on the sender's shard in the same transaction as the debit, then
+    delivered to the recipient's shard; see ``wallet.services``.
+    """
+    OUTBOX_STATUS = [
+        ('pending', 'Pending'),
+        ('delivered', 'Delivered'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='transfer_outbox',
+                             db_constraint=False)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+',
+                                  db_constraint=False)
+    transfer_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    description = models.CharField(max_length=255)
+    category = models.CharField(max_length=50, blank=True, null=True)
+    sender_email = models.EmailField()
+    status = models.CharField(max_length=15, choices=OUTBOX_STATUS, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'transfer_outbox'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='outbox_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender_email} -> {self.recipient_id}: {self.amount} ({self.status})"
+
+
+class Tombstone(models.Model):
+    """Record of a deleted card, transaction or QR code, so that ``/wallet/sync`` can report it"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tombstones',
+                             db_constraint=False)
+    # Same names as the lists in the sync response: 'cards', 'transactions', 'qr_codes'
+    kind = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    seq = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tombstones'
+        indexes = [
+            models.Index(fields=['user', 'seq'], name='tombstone_user_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted at seq {self.seq}"
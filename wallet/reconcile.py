@@ -0,0 +1,130 @@
+"""
+Ledger reconciliation: every ``Wallet.balance`` must equal the signed sum of its
+user's transactions, hot and archived (credits in ``Transaction.CREDIT_TYPES``
+add, everything else subtracts, whatever the status, as ``seed_wallet_data``
+and the services that move money do).
+
+``reconcile_range`` checks the wallets of one user id range on one database. It
+streams ``(user_id, sign, amount)`` columns with plain cursors in large chunks,
+amounts already in integer minor units (kobo), and adds them into an int64
+array indexed by user id with NumPy, so sums are exact and no model instances,
+``Decimal`` objects or per-user queries are involved. The wallets and the
+transactions are read in one transaction, from one snapshot, so money moving
+while the job runs cannot show up as a discrepancy.
+
+That transaction only reads. On PostgreSQL it is ``REPEATABLE READ READ ONLY``.
+On SQLite it is a plain deferred one, so it takes no write lock even under the
+high-throughput profile (whose ``atomic`` blocks begin ``IMMEDIATE``), and in
+WAL mode transfers keep committing while the job runs.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+import numpy as np
+from django.db import connections, transaction
+
+from .models import Wallet, Transaction, ArchivedTransaction
+
+DECIMAL_PLACES = Wallet._meta.get_field('balance').decimal_places
+MINOR_UNITS = 10 ** DECIMAL_PLACES
+CENT = Decimal(1).scaleb(-DECIMAL_PLACES)
+
+
+def to_cents(total):
+    """A database ``SUM`` of amounts, rounded to the cent: SQLite adds decimals as floats"""
+    return total.quantize(CENT)
+
+
+def _minor(column):
+    return f"CAST(ROUND({column} * {MINOR_UNITS}) AS BIGINT)"
+
+
+def _sign():
+    # transaction_type holds small-int codes (see wallet/fields.py)
+    field = Transaction._meta.get_field('transaction_type')
+    credits = ', '.join(str(field.code(kind)) for kind in Transaction.CREDIT_TYPES)
+    return f"CASE WHEN transaction_type IN ({credits}) THEN 1 ELSE -1 END"
+
+
+def user_id_bounds(using):
+    """(lowest, highest) user id holding a wallet or transactions on a database, or None if it has none"""
+    bounds = []
+    with connections[using].cursor() as cursor:
+        for model in (Wallet, Transaction, ArchivedTransaction):
+            cursor.execute(f"SELECT MIN(user_id), MAX(user_id) FROM {model._meta.db_table}")
+            low, high = cursor.fetchone()
+            if low is not None:
+                bounds.append((low, high))
+    if not bounds:
+        return None
+    return min(low for low, high in bounds), max(high for low, high in bounds)
+
+
+def _stream(cursor, sql, params, chunk_size):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield np.array(rows, dtype=np.int64).reshape(-1, len(rows[0]))
+
+
+@contextmanager
+def _read_snapshot(using):
+    """A cursor reading from one snapshot of the database, without taking its write lock"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            yield cursor
+        return
+
+    # atomic() would honour transaction_mode, and BEGIN IMMEDIATE holds the write lock until COMMIT
+    with connection.cursor() as cursor:
+        cursor.execute("BEGIN DEFERRED")
+        try:
+            yield cursor
+        finally:
+            cursor.execute("COMMIT")
+
+
+def reconcile_range(using, low, high, chunk_size=100000):
+    """
+    Compare the wallets of users ``low <= user_id < high`` on one database with
+    their transactions. Returns ``(wallets, rows, discrepancies)``, where each
+    discrepancy is ``(user_id, balance, ledger)`` in minor units and ``balance``
+    is None for a user with transactions but no wallet.
+    """
+    size = high - low
+    ledger = np.zeros(size, dtype=np.int64)
+    balance = np.zeros(size, dtype=np.int64)
+    has_wallet = np.zeros(size, dtype=bool)
+    has_rows = np.zeros(size, dtype=bool)
+    rows = 0
+
+    with _read_snapshot(using) as cursor:
+        for model in (Transaction, ArchivedTransaction):
+            sql = (
+                f"SELECT user_id, {_sign()} * {_minor('amount')} FROM {model._meta.db_table} "
+                f"WHERE user_id >= %s AND user_id < %s"
+            )
+            for chunk in _stream(cursor, sql, [low, high], chunk_size):
+                index = chunk[:, 0] - low
+                np.add.at(ledger, index, chunk[:, 1])
+                has_rows[index] = True
+                rows += len(chunk)
+
+        sql = f"SELECT user_id, {_minor('balance')} FROM {Wallet._meta.db_table} WHERE user_id >= %s AND user_id < %s"
+        for chunk in _stream(cursor, sql, [low, high], chunk_size):
+            index = chunk[:, 0] - low
+            balance[index] = chunk[:, 1]
+            has_wallet[index] = True
+
+    wallets = int(has_wallet.sum())
+    wrong = np.flatnonzero((has_wallet & (balance != ledger)) | (has_rows & ~has_wallet))
+    discrepancies = [
+        (low + int(i), int(balance[i]) if has_wallet[i] else None, int(ledger[i]))
+        for i in wrong
+    ]
+    return wallets, rows, discrepancies
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field, field_serializer
+from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 import uuid
 
@@ -58,7 +58,7 @@ class TransactionCreateSchema(BaseModel):
 
 class TransactionSchema(BaseModel):
     id: int
-    transaction_id: str
+    transaction_id: uuid.UUID
     transaction_type: str
     amount: Decimal
     description: str
@@ -68,16 +68,33 @@ class TransactionSchema(BaseModel):
     sender_email: Optional[str]
     created_at: datetime
 
-    @field_serializer('transaction_id')
-    def serialize_transaction_id(self, value, _info):
-        if isinstance(value, uuid.UUID):
-            return str(value)
-        return value
-
     class Config:
         from_attributes = True
 
 
+class TransactionFilterSchema(BaseModel):
+    transaction_type: Optional[str] = None
+    status: Optional[str] = None
+    category: Optional[str] = None
+    counterparty: Optional[int] = Field(None, description="User id of the other party of a transfer")
+    min_amount: Optional[Decimal] = None
+    max_amount: Optional[Decimal] = None
+    created_from: Optional[datetime] = Field(None, description="Created at or after (naive values are in server time)")
+    created_to: Optional[datetime] = Field(None, description="Created before")
+
+
+class CounterpartySchema(BaseModel):
+    id: int
+    email: str
+    first_name: str
+    last_name: str
+    sent_total: Decimal
+    sent_count: int
+    received_total: Decimal
+    received_count: int
+    last_transfer_at: datetime
+
+
 # QR Code Schemas
 class QRCodeCreateSchema(BaseModel):
     amount: Optional[Decimal] = None
@@ -106,13 +123,19 @@ class QRCodeScanSchema(BaseModel):
 
 # Send Money Schema
 class SendMoneySchema(BaseModel):
-    recipient_email: str
+    recipient_email: Optional[str] = None
+    recipient_id: Optional[int] = Field(None, description="Instead of recipient_email, e.g. from /wallet/counterparties")
     amount: Decimal = Field(..., gt=0)
     description: str
     category: Optional[str] = None
 
 
 # Statistics Schemas
+class BalanceHistorySchema(BaseModel):
+    date: date
+    balance: Decimal
+
+
 class MonthlyStatsSchema(BaseModel):
     month: str
     income: Decimal
@@ -134,6 +157,21 @@ class DashboardSchema(BaseModel):
     stats: StatsSchema
 
 
+# Sync Schemas
+class DeletedSchema(BaseModel):
+    type: str
+    id: int
+
+
+class SyncSchema(BaseModel):
+    seq: int
+    has_more: bool
+    cards: List[CardSchema]
+    transactions: List[TransactionSchema]
+    qr_codes: List[QRCodeSchema]
+    deleted: List[DeletedSchema]
+
+
 # Message Schema
 class MessageSchema(BaseModel):
     message: str
@@ -0,0 +1,141 @@
+"""
+Full-text search over transaction history.
+
+The ``description``, ``category``, ``recipient_email`` and ``sender_email``
+of hot and archived transactions are indexed on every database holding them,
+and the index is maintained by the database itself, so every write path keeps
+it in sync, including bulk inserts, raw deletes and archiving. Migrations 0006
+and 0009 create it; a change to it needs a migration of its own:
+
+* SQLite: a contentless FTS5 table per transaction table, filled by triggers.
+  Each entry also holds an ``owner`` token (``u<user id>``), so a user's
+  search is an intersection of posting lists instead of a scan of their history.
+* PostgreSQL: a GIN index on ``(user_id, to_tsvector(...))`` (``btree_gin``)
+  for ranked word search, and a ``pg_trgm`` GIN index on the two email columns
+  for partial addresses. ``category`` only holds the id of the category's name
+  (see wallet/fields.py), which an index expression cannot look up, so names
+  are matched in the small ``transaction_categories`` table and rows by id.
+
+Every query term is matched as a prefix, and all terms must match.
+"""
+import uuid
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from accounts.models import User
+from .archive import archived_before
+from .models import TransactionCategory
+
+SEARCH_COLUMNS = ('description', 'category', 'recipient_email', 'sender_email')
+
+# BM25 weights for (owner, description, category, recipient_email, sender_email)
+FTS_WEIGHTS = (0.0, 10.0, 5.0, 2.0, 2.0)
+
+TSVECTOR = (
+    "to_tsvector('simple', coalesce(description, '') || ' ' || "
+    "coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))"
+)
+EMAILS = "(coalesce(recipient_email, '') || ' ' || coalesce(sender_email, ''))"
+CATEGORIES = (
+    f"category IN (SELECT id FROM {TransactionCategory._meta.db_table} "
+    f"WHERE to_tsvector('simple', name) @@ to_tsquery('simple', %s))"
+)
+
+
+def fts_table(model):
+    return f"{model._meta.db_table}_fts"
+
+
+_UNQUOTED = str.maketrans('', '', '"\'\\')
+
+
+def _terms(q):
+    # Quotes and backslashes would end the quoted terms of the index queries
+    return [term for term in (word.strip().translate(_UNQUOTED) for word in q.split()) if term]
+
+
+def _fts_match(terms, user_id=None):
+    text = '{%s}: (%s)' % (' '.join(SEARCH_COLUMNS), ' '.join(f'"{term}"*' for term in terms))
+    if user_id is not None:
+        text = f'owner:"u{user_id}" AND {text}'
+    return text
+
+
+def _tsquery(terms):
+    return ' & '.join(f"'{term}':*" for term in terms)
+
+
+def _ranked_ids(model, using, user_id, terms, limit):
+    """(id, score) of the user's best matches in one table; higher scores are better"""
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    if connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT id, ts_rank({TSVECTOR}, to_tsquery('simple', %s)) AS score FROM {table} "
+            f"WHERE user_id = %s AND ({TSVECTOR} @@ to_tsquery('simple', %s) OR {EMAILS} ILIKE %s OR {CATEGORIES}) "
+            f"ORDER BY score DESC, id DESC LIMIT %s"
+        )
+        tsquery = _tsquery(terms)
+        params = [tsquery, user_id, tsquery, '%' + ' '.join(terms) + '%', tsquery, limit]
+    else:
+        fts = fts_table(model)
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        sql = (
+            f"SELECT rowid, -bm25({fts}, {weights}) AS score FROM {fts} "
+            f"WHERE {fts} MATCH %s ORDER BY score DESC, rowid DESC LIMIT %s"
+        )
+        params = [_fts_match(terms, user_id), limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_transactions(user, q, fields, limit=20):
+    """The user's transactions (hot and archived) matching ``q``, best match first, as ``.values(*fields)`` rows"""
+    terms = _terms(q)
+    if not terms:
+        return []
+    sources = [user.transactions.all()]
+    if archived_before(user) is not None:
+        sources.append(user.archived_transactions.all())
+
+    ranked = []
+    for source in sources:
+        ids = _ranked_ids(source.model, source.db, user.pk, terms, limit)
+        rows = source.filter(id__in=[pk for pk, _ in ids]).values(*dict.fromkeys(['id', *fields]))
+        rows = {row['id']: row for row in rows}
+        ranked += [(score, pk, rows[pk]) for pk, score in ids if pk in rows]
+    ranked.sort(key=lambda item: (-item[0], -item[1]))
+    return [{name: row[name] for name in fields} for score, pk, row in ranked[:limit]]
+
+
+def search_queryset(queryset, q):
+    """
+    Filter a Transaction or ArchivedTransaction queryset (e.g. in the admin) to
+    rows matching ``q`` in the text index, by transaction id, or by owner email
+    """
+    terms = _terms(q)
+    if not terms:
+        return queryset
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    if connection.vendor == 'postgresql':
+        matches = RawSQL(
+            f"SELECT id FROM {table} WHERE {TSVECTOR} @@ to_tsquery('simple', %s) OR {EMAILS} ILIKE %s OR {CATEGORIES}",
+            [_tsquery(terms), '%' + ' '.join(terms) + '%', _tsquery(terms)],
+        )
+    else:
+        fts = fts_table(queryset.model)
+        matches = RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [_fts_match(terms)])
+
+    condition = Q(id__in=matches)
+    try:
+        condition |= Q(transaction_id=uuid.UUID(q.strip()))
+    except ValueError:
+        pass
+    if '@' in q:
+        condition |= Q(user_id__in=User.objects.filter(email=q.strip()).values('id'))
+    return queryset.filter(condition)
+
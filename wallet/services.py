@@ -0,0 +1,212 @@
+"""
+Balance-changing operations shared by the wallet endpoints.
+
+Balances are always changed with a single conditional ``UPDATE ... SET balance =
+balance +/- amount`` rather than read-modify-save on a ``Wallet`` instance, so
+concurrent requests cannot overwrite each other's updates or overdraw a wallet.
+
+When sender and recipient live on different shards, a transfer cannot be one
+database transaction. The debit, the sender's ``transfer_out`` row and a
+``TransferOutbox`` entry are committed together on the sender's shard; the
+credit is then applied on the recipient's shard, keyed by the outbox
+``transfer_id`` so that redelivery is idempotent. Undelivered entries are
+retried by ``python manage.py relay_transfer_outbox``.
+
+Both sides of a transfer record the other user as their ``counterparty`` and
+add to the pair's running totals (see wallet/counterparties.py) in the same
+transaction as the transfer row.
+
+Write transactions go through ``atomic_write`` so that, with ``GROUP_COMMIT``
+on, many requests' writes share one commit (see ethnosdemo/group_commit.py).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from ethnosdemo.group_commit import atomic_write
+from .counterparties import record_transfer
+from .models import Wallet, Transaction, TransferOutbox
+from .sharding import shard_for_user
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientBalance(ValueError):
+    pass
+
+
+def credit_wallet(user, amount):
+    """Add ``amount`` to the user's wallet, creating the wallet if needed"""
+    wallets = Wallet.objects.using(shard_for_user(user))
+    updated = wallets.filter(user_id=user.pk).update(
+        balance=F('balance') + amount, version=F('version') + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        wallets.create(user=user, balance=amount)
+
+
+def debit_wallet(user, amount):
+    """Subtract ``amount`` from the user's wallet, failing if the balance is too low"""
+    updated = Wallet.objects.using(shard_for_user(user)).filter(
+        user_id=user.pk, balance__gte=amount
+    ).update(balance=F('balance') - amount, version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        raise InsufficientBalance("Insufficient balance")
+
+
+def record_transaction(user, **fields):
+    """Create a transaction for the user and apply it to their wallet balance"""
+    return atomic_write(_record_transaction, user, fields, using=shard_for_user(user))
+
+
+def _record_transaction(user, fields):
+    txn = user.transactions.create(**fields)
+    if txn.transaction_type in Transaction.CREDIT_TYPES:
+        credit_wallet(user, txn.amount)
+    elif txn.transaction_type in Transaction.DEBIT_TYPES:
+        debit_wallet(user, txn.amount)
+    return txn
+
+
+def transfer_money(sender, recipient, amount, *, description, recipient_description,
+                   category=None):
+    """
+    Move ``amount`` from sender to recipient and record both sides.
+
+    Returns the sender's ``transfer_out`` transaction. Raises
+    ``InsufficientBalance`` (and rolls everything back) if the sender cannot pay.
+    """
+    sender_shard = shard_for_user(sender)
+    if sender_shard != shard_for_user(recipient):
+        return _transfer_across_shards(sender, recipient, amount, description=description,
+                                       recipient_description=recipient_description, category=category)
+
+    return atomic_write(_transfer_within_shard, sender, recipient, amount, description,
+                        recipient_description, category, using=sender_shard)
+
+
+def _transfer_within_shard(sender, recipient, amount, description, recipient_description, category):
+    # Touch wallets in user-id order so opposite transfers cannot deadlock
+    if sender.id < recipient.id:
+        debit_wallet(sender, amount)
+        credit_wallet(recipient, amount)
+    else:
+        credit_wallet(recipient, amount)
+        debit_wallet(sender, amount)
+
+    sender_txn = sender.transactions.create(
+        transaction_type='transfer_out',
+        amount=amount,
+        description=description,
+        category=category,
+        recipient_email=recipient.email,
+        counterparty=recipient,
+        status='completed'
+    )
+    record_transfer(shard_for_user(sender), sender.pk, recipient.pk, amount, sent=True, at=sender_txn.created_at)
+
+    recipient_txn = recipient.transactions.create(
+        transaction_type='transfer_in',
+        amount=amount,
+        description=recipient_description,
+        category=category,
+        sender_email=sender.email,
+        counterparty=sender,
+        status='completed'
+    )
+    record_transfer(shard_for_user(recipient), recipient.pk, sender.pk, amount, sent=False,
+                    at=recipient_txn.created_at)
+
+    return sender_txn
+
+
+def _transfer_across_shards(sender, recipient, amount, *, description, recipient_description, category):
+    sender_txn, outbox = atomic_write(_debit_into_outbox, sender, recipient, amount, description,
+                                      recipient_description, category, using=shard_for_user(sender))
+
+    try:
+        deliver_transfer(outbox)
+    except Exception:
+        # The debit is committed; the relay will apply the credit later
+        logger.exception("Delivery of transfer %s failed; left in outbox", outbox.transfer_id)
+
+    return sender_txn
+
+
+def _debit_into_outbox(sender, recipient, amount, description, recipient_description, category):
+    debit_wallet(sender, amount)
+
+    sender_txn = sender.transactions.create(
+        transaction_type='transfer_out',
+        amount=amount,
+        description=description,
+        category=category,
+        recipient_email=recipient.email,
+        counterparty=recipient,
+        status='completed'
+    )
+    record_transfer(shard_for_user(sender), sender.pk, recipient.pk, amount, sent=True, at=sender_txn.created_at)
+
+    outbox = sender.transfer_outbox.create(
+        recipient=recipient,
+        amount=amount,
+        description=recipient_description,
+        category=category,
+        sender_email=sender.email,
+    )
+    return sender_txn, outbox
+
+
+def deliver_transfer(outbox):
+    """Apply an outbox entry's credit on the recipient's shard, at most once"""
+    outbox.attempts += 1
+    TransferOutbox.objects.using(outbox._state.db).filter(pk=outbox.pk).update(attempts=F('attempts') + 1)
+
+    recipient = outbox.recipient
+    try:
+        with transaction.atomic(using=shard_for_user(recipient)):
+            already_delivered = Transaction.objects.using(shard_for_user(recipient)).filter(
+                transaction_id=outbox.transfer_id
+            ).exists()
+            if not already_delivered:
+                recipient_txn = recipient.transactions.create(
+                    transaction_id=outbox.transfer_id,
+                    transaction_type='transfer_in',
+                    amount=outbox.amount,
+                    description=outbox.description,
+                    category=outbox.category,
+                    sender_email=outbox.sender_email,
+                    counterparty_id=outbox.user_id,
+                    status='completed'
+                )
+                credit_wallet(recipient, outbox.amount)
+                record_transfer(shard_for_user(recipient), recipient.pk, outbox.user_id, outbox.amount,
+                                sent=False, at=recipient_txn.created_at)
+    except IntegrityError:
+        # Another relay delivered it concurrently (unique transaction_id)
+        pass
+
+    outbox.status = 'delivered'
+    outbox.delivered_at = timezone.now()
+    outbox.save(update_fields=['status', 'delivered_at'])
+
+
+def deliver_pending_transfers(older_than=timedelta(0), limit=1000):
+    """Retry undelivered cross-shard credits on every shard; returns the number delivered"""
+    delivered = 0
+    cutoff = timezone.now() - older_than
+    for shard in settings.WALLET_SHARDS:
+        pending = TransferOutbox.objects.using(shard).filter(
+            status='pending', created_at__lte=cutoff
+        ).order_by('created_at')[:limit]
+        for outbox in pending:
+            try:
+                deliver_transfer(outbox)
+                delivered += 1
+            except Exception:
+                logger.exception("Delivery of transfer %s failed", outbox.transfer_id)
+    return delivered
@@ -1,14 +1,25 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Wallet
+from ethnosdemo.db_routers import pin_to_primary
+from accounts.models import User
+from .models import (
+    Wallet, Card, Transaction, ArchivedTransaction, Counterparty, QRCode, TransferOutbox, Tombstone,
+    WalletBalanceSnapshot, next_version,
+)
+from . import columns
+from .events import publish_transaction
+from .sharding import shard_for_user
+from .sync import KINDS
+from .versioning import bump_version
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_wallet(sender, instance, created, **kwargs):
     """Create a wallet automatically when a new user is created"""
     if created:
-        Wallet.objects.create(user=instance)
+        Wallet.objects.using(shard_for_user(instance)).create(user=instance)
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -16,3 +27,65 @@ def save_wallet(sender, instance, **kwargs):
     """Save wallet when user is saved"""
     if hasattr(instance, 'wallet'):
         instance.wallet.save()
+
+
+@receiver(post_save, sender=Wallet)
+@receiver(post_save, sender=Card)
+@receiver(post_save, sender=Transaction)
+@receiver(post_save, sender=QRCode)
+@receiver(post_delete, sender=Card)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=QRCode)
+def pin_writer_to_primary(sender, instance, using, **kwargs):
+    """Keep the user's reads on the primary until replicas have caught up with this write"""
+    if settings.DATABASE_REPLICAS:
+        transaction.on_commit(lambda: pin_to_primary(instance.user_id), using=using)
+
+
+@receiver(post_save, sender=Wallet)
+def bump_change_version(sender, instance, using, **kwargs):
+    """Invalidate the user's ETags, in the same transaction as the write"""
+    # Cards, transactions and QR codes take a new version as they are saved (SyncedModel)
+    bump_version(instance.user_id, using)
+
+
+@receiver(post_delete, sender=Card)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=QRCode)
+def leave_tombstone(sender, instance, using, origin=None, **kwargs):
+    """Record the deletion for /wallet/sync, under a new change version"""
+    if isinstance(origin, User):
+        # The whole account is going; its tombstones would be deleted with it
+        return
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id, kind=KINDS[sender], object_id=instance.pk,
+        seq=next_version(instance.user_id, using),
+    )
+
+
+@receiver(post_save, sender=Transaction)
+def publish_new_transaction(sender, instance, created, using, **kwargs):
+    """Push the transaction to the owner's event streams once it has committed"""
+    if created:
+        transaction.on_commit(lambda: publish_transaction(instance), using=using)
+
+
+@receiver(post_save, sender=Transaction)
+def apply_save_to_columns(sender, instance, using, **kwargs):
+    """Append or update the transaction in its owner's cached analytics columns once it has committed"""
+    transaction.on_commit(lambda: columns.note_saved(instance), using=using)
+
+
+@receiver(post_delete, sender=Transaction)
+def apply_delete_to_columns(sender, instance, using, **kwargs):
+    transaction.on_commit(lambda: columns.note_deleted(instance), using=using)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_sharded_wallet_rows(sender, instance, **kwargs):
+    """Cascade user deletion to wallet rows on another shard, which the ORM cascade cannot see"""
+    shard = shard_for_user(instance)
+    if shard == 'default':
+        return
+    for model in (TransferOutbox, QRCode, Counterparty, ArchivedTransaction, Transaction, Card, Tombstone, WalletBalanceSnapshot, Wallet):
+        model.objects.using(shard).filter(user_id=instance.pk).delete()
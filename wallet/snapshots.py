@@ -0,0 +1,155 @@
+"""
+Daily closing balances, for balance history without summing old transactions.
+
+``WalletBalanceSnapshot`` holds a wallet's balance at the end of each day on
+which it changed, in the server's time zone. ``python manage.py
+snapshot_balances`` runs after midnight and records the days since each
+wallet's ``balance_snapshot_through``, then moves that watermark, in one
+transaction per batch of wallets. A wallet the job has not reached yet gets
+its whole history recorded on the first run.
+
+A closing balance is worked back from the current balance: the balance at the
+end of a day is today's balance less the changes of every later day. So the
+job only reads the transactions created since the watermark.
+
+``balance_history`` answers a date range from the snapshots up to the
+watermark, carrying each forward over days without changes, plus the
+transactions created after it, at most a day or two of rows. Transactions are
+assumed never to be backdated before a wallet's watermark.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .archive import transaction_sources
+from .models import Wallet, WalletBalanceSnapshot, Transaction, ArchivedTransaction
+from .reconcile import to_cents
+
+ZERO = Decimal('0.00')
+
+
+def _signed_amount():
+    return Case(
+        When(transaction_type__in=Transaction.CREDIT_TYPES, then=F('amount')),
+        default=-F('amount'),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def day_start(day):
+    """The local midnight starting ``day``"""
+    return timezone.make_aware(datetime.combine(day, dt_time.min))
+
+
+def _daily_changes(querysets):
+    """``{user_id: {day: net change}}`` of the transactions in ``querysets``, to the cent"""
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for queryset in querysets:
+        rows = (
+            queryset.order_by().annotate(day=TruncDate('created_at'))
+            .values('user_id', 'day').annotate(change=Sum(_signed_amount()))
+            .values_list('user_id', 'day', 'change')
+        )
+        for user_id, day, change in rows:
+            changes[user_id][day] += to_cents(change)
+    return changes
+
+
+def _closing_balances(balance, changes):
+    """``(day, closing balance)`` of each day in ``changes``, newest first, given the balance after all of them"""
+    for day in sorted(changes, reverse=True):
+        yield day, balance
+        balance -= changes[day]
+
+
+def _snapshot_batch(using, batch, through):
+    by_watermark = defaultdict(list)
+    for user_id, watermark in batch:
+        by_watermark[watermark].append(user_id)
+
+    wallets = Wallet.objects.using(using)
+    snapshots = []
+    with transaction.atomic(using=using):
+        # Writing the wallets first takes their locks: balances cannot move while their history is read
+        wallets.filter(user_id__in=[user_id for user_id, watermark in batch]).update(balance_snapshot_through=through)
+        balances = dict(wallets.filter(user_id__in=[user_id for user_id, watermark in batch])
+                        .values_list('user_id', 'balance'))
+        for watermark, user_ids in by_watermark.items():
+            sources = [Transaction.objects.using(using), ArchivedTransaction.objects.using(using)]
+            sources = [source.filter(user_id__in=user_ids) for source in sources]
+            if watermark is not None:
+                since = day_start(watermark + timedelta(days=1))
+                sources = [source.filter(created_at__gte=since) for source in sources]
+            for user_id, changes in _daily_changes(sources).items():
+                snapshots += [
+                    WalletBalanceSnapshot(user_id=user_id, date=day, balance=balance)
+                    for day, balance in _closing_balances(balances[user_id], changes) if day <= through
+                ]
+        WalletBalanceSnapshot.objects.using(using).bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def snapshot_balances(using, through, batch_size=1000, pause=0.0):
+    """
+    Record the closing balances of every wallet on one database up to and
+    including day ``through``, which must be over. Returns ``(wallets, snapshots)``.
+    """
+    pending = Wallet.objects.using(using).filter(
+        Q(balance_snapshot_through__isnull=True) | Q(balance_snapshot_through__lt=through)
+    )
+    wallets = written = 0
+    last_user_id = None
+    while True:
+        batch = pending if last_user_id is None else pending.filter(user_id__gt=last_user_id)
+        batch = list(batch.order_by('user_id').values_list('user_id', 'balance_snapshot_through')[:batch_size])
+        if not batch:
+            return wallets, written
+        written += _snapshot_batch(using, batch, through)
+        wallets += len(batch)
+        last_user_id = batch[-1][0]
+        if pause:
+            # Give request traffic a turn at the write lock between batches
+            time.sleep(pause)
+
+
+def balance_history(user, start, end):
+    """Closing balance of each day from ``start`` to ``end`` (today's so far), oldest first"""
+    wallet = Wallet.objects.db_manager(hints={'instance': user}).filter(user_id=user.pk)
+    row = wallet.values_list('balance', 'balance_snapshot_through').first()
+    if row is None:
+        return []
+    balance, through = row
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    closing = {}
+
+    if through is not None and start <= through:
+        snapshots = user.balance_snapshots.all()
+        # Before a wallet's first change its balance was zero
+        current = snapshots.filter(date__lt=start).order_by('-date').values_list('balance', flat=True).first() or ZERO
+        recorded = dict(snapshots.filter(date__gte=start, date__lte=min(end, through)).values_list('date', 'balance'))
+        for day in days:
+            if day > through:
+                break
+            current = recorded.get(day, current)
+            closing[day] = current
+
+    if through is None or end > through:
+        since = None if through is None else day_start(through + timedelta(days=1))
+        sources = transaction_sources(user, since)
+        if since is not None:
+            sources = [source.filter(created_at__gte=since) for source in sources]
+        changes = _daily_changes(sources).get(user.pk, {})
+        current = balance - sum((change for day, change in changes.items() if day > end), ZERO)
+        for day in reversed(days):
+            if through is not None and day <= through:
+                break
+            closing[day] = current
+            current -= changes.get(day, ZERO)
+
+    return [{'date': day, 'balance': closing[day]} for day in days]
@@ -0,0 +1,80 @@
+"""
+Per-user change version for conditional GETs.
+
+``Wallet.version`` is incremented in the same database transaction as every
+write to the user's wallet, cards, transactions or QR codes: balance updates
+fold it into their own ``UPDATE``, card, transaction and QR code saves take the
+new value as their ``seq`` (``SyncedModel``), and wallet saves and deletes are
+covered by the signals in wallet/signals.py. Read endpoints decorated with ``@etag_from_version()``
+derive their ETag from it, and answer a matching ``If-None-Match`` with 304
+after reading that one column, without running the view or serializing anything.
+"""
+from functools import wraps
+
+from django.db.models import F
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import parse_etags, patch_cache_control, patch_vary_headers
+
+from ethnosdemo.renderers import wants_msgpack
+from .models import Wallet
+
+
+def bump_version(user_id, using):
+    """Mark the user's data as changed; call inside the transaction making the change"""
+    Wallet.objects.using(using).filter(user_id=user_id).update(version=F('version') + 1)
+
+
+def current_version(user):
+    """The user's change version, or None if they have no wallet yet"""
+    wallets = Wallet.objects.db_manager(hints={'instance': user})
+    return wallets.filter(user_id=user.pk).values_list('version', flat=True).first()
+
+
+def _weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _not_modified(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or _weak(etag) in {_weak(tag) for tag in etags}
+
+
+def etag_from_version(daily=False):
+    """
+    Give a read view an ETag built from the user's change version and the response
+    format, and answer 304 when the client already has it.
+
+    Use ``daily=True`` for views whose output also depends on today's date.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            # Views calling other decorated views (the dashboard) have already done this
+            if getattr(request, 'response_etag', None):
+                return view_func(request, *args, **kwargs)
+
+            version = current_version(request.auth)
+            if version is None:
+                return view_func(request, *args, **kwargs)
+
+            parts = [request.auth.pk, version, 'msgpack' if wants_msgpack(request) else 'json']
+            if daily:
+                parts.append(timezone.localdate().isoformat())
+            etag = 'W/"%s"' % '-'.join(map(str, parts))
+
+            if _not_modified(request, etag):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ['Accept'])
+                return response
+
+            # Picked up by render_response for the 200 response
+            request.response_etag = etag
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator